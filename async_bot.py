@@ -0,0 +1,341 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from parser import scrape_images, create_session
+from workspaces import WorkspaceManager
+from result_cache import ResultCache
+from image_formatter import ImageTooLarge
+from file_id_cache import FileIdCache
+from file_digests import FileDigests
+from worker import encoding, crawl
+from bot_common import user_menu, PTL_menu, get_photos, start_metrics, count_sent, SEND_SECONDS, SEND_ERRORS, \
+    cached_file_ids, remember_file_ids, forget_file_ids
+from config import TOKEN, WORKSPACES_PATH, WORKSPACE_IDLE_TIMEOUT, RESULTS_PATH, RESULT_CACHE_MAX_BYTES, BOT_THREADS, \
+    IMAGE_MAX_PIXELS, OPERATION_MAX_BYTES, FILE_IDS_PATH
+# Асинхронный режим бота: сообщения всех чатов обрабатываются на одном event loop,
+# парсинг выполняется на нём же, а обработка изображений — в ограниченном пуле потоков
+bot = AsyncTeleBot(TOKEN)
+# Хэши файлов общие для кэша результатов и file_id: одно изображение хэшируется один раз
+digests = FileDigests()
+workspaces = WorkspaceManager(WORKSPACES_PATH, WORKSPACE_IDLE_TIMEOUT,
+                              result_cache=ResultCache(RESULTS_PATH, RESULT_CACHE_MAX_BYTES, digests=digests),
+                              encoding=encoding, max_pixels=IMAGE_MAX_PIXELS, max_memory_bytes=OPERATION_MAX_BYTES)
+# Отправленные файлы повторно отправляются по file_id, без загрузки
+file_ids = FileIdCache(FILE_IDS_PATH, digests=digests)
+# Pillow отпускает GIL на время фильтров, ресайза и кодирования, поэтому потоков достаточно.
+# Форматтер хранит выбранное изображение чата и общий кэш, процессам их пришлось бы передавать
+executor = ThreadPoolExecutor(BOT_THREADS, thread_name_prefix='formatter')
+# Следующий шаг диалога для каждого чата: (функция, аргументы)
+next_steps = {}
+# Общая сессия парсинга, создается при запуске бота
+session = None
+
+async def get_workspace(chat_id):
+    # Удаление старых папок чатов не должно останавливать event loop
+    return await asyncio.to_thread(workspaces.get, chat_id)
+
+def register_next_step(message, callback, *args):
+    next_steps[message.chat.id] = (callback, args)
+
+def call_operation(workspace, operation, args):
+    # Выполняется в пуле: блокировка потока защищает папку чата от удаления на время операции
+    with workspace.lock:
+        return getattr(workspace.formatter, operation)(*args)
+
+async def run_operation(message, operation, *args):
+    # Операции одного чата выполняются по очереди, разных чатов — параллельно
+    workspace = await get_workspace(message.chat.id)
+    async with workspace.async_lock:
+        loop = asyncio.get_running_loop()
+        try:
+            result_path = await loop.run_in_executor(executor, call_operation, workspace, operation, args)
+        except ImageTooLarge as e:
+            print(e)
+            await bot.send_message(message.chat.id, 'Изображение слишком большое для этой операции',
+                                   reply_markup=PTL_menu())
+            return
+        await send_res(message, result_path)
+
+async def send_photos(chat_id, photos):
+    # В одном альбоме Telegram не больше 10 фотографий, альбом из одной фотографии отправить нельзя
+    for i in range(0, len(photos), 10):
+        group = photos[i:i + 10]
+        # Хэши файлов считаются и file_id ищутся в базе в потоке, чтобы не останавливать event loop
+        digests, cached = await asyncio.to_thread(cached_file_ids, file_ids, group, 'photo')
+        try:
+            await send_group(chat_id, group, digests, cached)
+        except ApiTelegramException as e:
+            if e.error_code != 400 or not any(cached):
+                raise
+            # Telegram не принял сохраненный file_id — забываем его и загружаем файлы заново
+            await asyncio.to_thread(forget_file_ids, file_ids, digests, cached, 'photo')
+            await send_group(chat_id, group, digests, [None] * len(group))
+
+async def send_group(chat_id, group, digests, cached):
+    # Уже загруженные файлы отправляются по file_id, остальные загружаются
+    with ExitStack() as stack:
+        media = [file_id or stack.enter_context(open(photo, 'rb')) for photo, file_id in zip(group, cached)]
+        method = 'send_photo' if len(media) == 1 else 'send_media_group'
+        with SEND_SECONDS.time(SEND_ERRORS, method=method):
+            if len(media) == 1:
+                messages = [await bot.send_photo(chat_id, media[0])]
+            else:
+                messages = await bot.send_media_group(chat_id, [types.InputMediaPhoto(m) for m in media])
+    await asyncio.to_thread(remember_file_ids, file_ids, digests, cached, messages, 'photo')
+    count_sent(method, group, cached)
+
+async def send_document(chat_id, path):
+    # Документ тоже отправляется по file_id, если этот файл уже загружался
+    digests, cached = await asyncio.to_thread(cached_file_ids, file_ids, [path], 'document')
+    try:
+        await send_file(chat_id, path, digests, cached)
+    except ApiTelegramException as e:
+        if e.error_code != 400 or cached[0] is None:
+            raise
+        await asyncio.to_thread(forget_file_ids, file_ids, digests, cached, 'document')
+        await send_file(chat_id, path, digests, [None])
+
+async def send_file(chat_id, path, digests, cached):
+    with ExitStack() as stack:
+        document = cached[0] or stack.enter_context(open(path, 'rb'))
+        with SEND_SECONDS.time(SEND_ERRORS, method='send_document'):
+            sent = await bot.send_document(chat_id, document)
+    await asyncio.to_thread(remember_file_ids, file_ids, digests, cached, [sent], 'document')
+    count_sent('send_document', [path], cached)
+
+async def send_res(message, result_path):
+    await send_photos(message.chat.id, [result_path])
+    await bot.send_message(message.chat.id, 'Выберете действие', reply_markup=PTL_menu())
+
+# Обработчик следующего шага проверяется раньше остальных, как в синхронном боте
+@bot.message_handler(func=lambda message: message.chat.id in next_steps)
+async def bot_next_step(message):
+    callback, args = next_steps.pop(message.chat.id)
+    await callback(message, *args)
+
+@bot.message_handler(commands=['start'])
+async def bot_start(message):
+    await bot.send_message(message.chat.id, 'Приветствую! \n Я бот для обработки спаршеных изображений, дабы воспользоваться моими функциями введите url')
+
+@bot.message_handler(func=lambda message: message.text.startswith('Главное меню'))
+async def bot_main_menu(message):
+    await bot.send_message(message.chat.id, 'Выберете действие', reply_markup=user_menu())
+
+@bot.message_handler(func=lambda message: message.text.startswith('http'))
+async def bot_parce(message):
+    workspace = await get_workspace(message.chat.id)
+    async with workspace.async_lock:
+        status, result = await scrape_images(message.text, workspace.path, session, encoding, crawl)
+        if status == 'error':
+            print(result)
+            await bot.send_message(message.chat.id, 'Не удалось спарсить изображения', reply_markup=user_menu())
+            return
+        workspace.selected_path = None
+        photos, paths = await asyncio.to_thread(get_photos, workspace.path)
+
+    await send_photos(message.chat.id, photos)
+
+    await bot.send_message(message.chat.id, 'Изображения спаршены', reply_markup=user_menu())
+
+@bot.message_handler(func=lambda message: message.text == 'Выбрать изображение')
+async def bot_select_image(message):
+    workspace = await get_workspace(message.chat.id)
+    photos, paths = await asyncio.to_thread(get_photos, workspace.path)
+    markup = types.ReplyKeyboardMarkup(one_time_keyboard=True)
+    for i in range(1, len(photos) + 1):
+        markup.add(str(i))
+    markup.add("Главное меню")
+    await bot.send_message(message.chat.id, 'Выберете номер изобржения', reply_markup=markup)
+    register_next_step(message, bot_selected_image, photos, paths)
+
+async def bot_selected_image(message, photos, paths):
+    try:
+        index = int(message.text) -1
+        workspace = await get_workspace(message.chat.id)
+        async with workspace.async_lock:
+            workspace.selected_path = paths[index]
+            workspace.formatter.select_image_directory(workspace.selected_path)
+        await send_photos(message.chat.id, [photos[index]])
+        await bot.send_message(message.chat.id, 'Выберете действие', reply_markup=PTL_menu())
+    except Exception as e:
+        print(e)
+        await bot.send_message(message.chat.id, 'Возможно изображения с таким индексом нет', reply_markup=PTL_menu())
+
+@bot.message_handler(regexp="Оригинал")
+async def send_original(message):
+    # Оригинал отправляется документом, без сжатия, только по запросу
+    workspace = await get_workspace(message.chat.id)
+    try:
+        async with workspace.async_lock:
+            formatter = workspace.formatter
+            original = formatter.current_image_directory + 'default.' + formatter.current_image_format
+            await send_document(message.chat.id, original)
+    except Exception as e:
+        print(e)
+        await bot.send_message(message.chat.id, 'Сначала выберите изображение', reply_markup=user_menu())
+        return
+    await bot.send_message(message.chat.id, 'Выберете действие', reply_markup=PTL_menu())
+
+@bot.message_handler(regexp="Повернуть изображение")
+async def rotate_image(message):
+    await bot.reply_to(message, "Выберете градус поворота")
+    register_next_step(message, rotated_image)
+async def rotated_image(message):
+    try:
+        rotate = int(message.text)
+        await run_operation(message, 'rotate_image', rotate)
+    except Exception as e:
+        print(e)
+        await bot.send_message(message.chat.id, 'Ошибка ввода', reply_markup=PTL_menu())
+
+@bot.message_handler(regexp="Отзеркалить")
+async def flip_image(message):
+    markup = types.ReplyKeyboardMarkup()
+    markup.add('По горизонтали', 'По вертикали')
+    await bot.send_message(message.chat.id, "Выберете градус поворота", reply_markup=markup)
+    register_next_step(message, fliped_image)
+async def fliped_image(message):
+    if message.text == 'По горизонтали':
+        mode = "horizontal"
+    elif message.text == 'По вертикали':
+        mode = "vertical"
+    else:
+        await bot.send_message(message.chat.id, 'Такого отзеркаливания у нас нету', reply_markup=PTL_menu())
+        return
+    await run_operation(message, 'flip_image', mode)
+
+@bot.message_handler(regexp="Обрезать")
+async def crop_image(message):
+    # Логика обрезки изображения
+    await bot.send_message(message.chat.id, 'Возвращайся позже', reply_markup=PTL_menu())
+
+@bot.message_handler(regexp="Изменить размер")
+async def resize_image(message):
+    await bot.reply_to(message, "Введите % изменения ширины и высоты")
+    register_next_step(message, resized_image)
+async def resized_image(message):
+    try:
+        message_text = message.text.split(" ")
+        await run_operation(message, 'resize_image', int(message_text[0]), int(message_text[1]))
+    except Exception as e:
+        print(e)
+        await bot.send_message(message.chat.id, 'Ошибка ввода', reply_markup=PTL_menu())
+
+@bot.message_handler(regexp="Сделать чёрно-белым")
+async def grayscale_image(message):
+    await run_operation(message, 'grayscale_image')
+
+@bot.message_handler(regexp="Преобразовать в цветовой диапазон")
+async def color_range_image(message):
+    markup = types.ReplyKeyboardMarkup()
+    markup.add("Красный", "Зелёный", "Голубой")
+    await bot.send_message(message.chat.id, 'Выберете цвет', reply_markup=markup)
+    register_next_step(message, color_ranged_image)
+async def color_ranged_image(message):
+    if message.text =="Красный":
+        color = "r"
+    elif message.text == "Зелёный":
+        color = "g"
+    elif message.text == "Голубой":
+        color = "b"
+    else:
+        await bot.send_message(message.chat.id, 'Что-то не то', reply_markup=PTL_menu())
+        return
+    await run_operation(message, 'chanel_convert_image', color)
+
+@bot.message_handler(regexp="Размытие")
+async def blur_image(message):
+    markup = types.ReplyKeyboardMarkup()
+    markup.add("Прямоугольное", "Гауссово")
+    await bot.send_message(message.chat.id, 'Выберете тип размытия', reply_markup=markup)
+    register_next_step(message, blur_image_val)
+async def blur_image_val(message):
+    if message.text == "Прямоугольное":
+        mode = 'box'
+    elif message.text == "Гауссово":
+        mode = 'gaussian'
+    else:
+        await bot.send_message(message.chat.id, 'Что-то не то', reply_markup=PTL_menu())
+        return
+    await bot.send_message(message.chat.id, 'Впишите радиус размытия')
+    register_next_step(message, blured_image_val, mode)
+async def blured_image_val(message, mode):
+    try:
+        val = int(message.text)
+        await run_operation(message, 'blur_image', mode, val)
+    except Exception as e:
+        print(e)
+        await bot.send_message(message.chat.id, 'Что-то не то', reply_markup=PTL_menu())
+
+@bot.message_handler(regexp="Увеличьте резкость")
+async def sharpen_image(message):
+    await run_operation(message, 'sharpen_image')
+
+@bot.message_handler(regexp="Сглаживание")
+async def smooth_image(message):
+    await run_operation(message, 'smooth_image')
+
+@bot.message_handler(regexp="Найти рёбра")
+async def edge_detection(message):
+    await run_operation(message, 'find_edges')
+
+@bot.message_handler(regexp="Яркость")
+async def brightness_adjustment(message):
+    await bot.send_message(message.chat.id, 'Введите число, все что выше 1.0 увеличивает яркость, и наоборот')
+    register_next_step(message, brightnessed_adjustment)
+async def brightnessed_adjustment(message):
+    try:
+        val = float(message.text)
+        await run_operation(message, 'change_brightness', val)
+    except Exception as e:
+        print(e)
+        await bot.send_message(message.chat.id, 'Что-то не то', reply_markup=PTL_menu())
+
+@bot.message_handler(regexp="Добавить текст")
+async def add_text(message):
+    await bot.send_message(message.chat.id, 'Введите текст который хотите добваить на изображение')
+    register_next_step(message, add_text_place)
+async def add_text_place(message):
+    total = [message.text]
+    await bot.send_message(message.chat.id, 'Введите x и y текста, через пробел')
+    register_next_step(message, add_text_font, total)
+async def add_text_font(message, total):
+    try:
+        message_val = message.text.split(" ")
+        total.append(int(message_val[0]))
+        total.append(int(message_val[1]))
+        await bot.send_message(message.chat.id, 'Шрифт ')
+        register_next_step(message, add_text_color, total)
+    except Exception as e:
+        print(e)
+        await bot.send_message(message.chat.id, 'Ошибка ввода', reply_markup=PTL_menu())
+async def add_text_color(message, total):
+    try:
+        total.append(int(message.text))
+        await bot.send_message(message.chat.id, 'Введите r g b параметры')
+        register_next_step(message, added_text_color, total)
+    except Exception as e:
+        print(e)
+        await bot.send_message(message.chat.id, 'Ошибка ввода', reply_markup=PTL_menu())
+async def added_text_color(message, total):
+    try:
+        color = tuple(map(int, message.text.split(" ")))
+        await run_operation(message, 'add_text', *total, color)
+    except Exception as e:
+        print(e)
+        await bot.send_message(message.chat.id, 'Ошибка ввода', reply_markup=PTL_menu())
+
+async def main():
+    global session
+    start_metrics()
+    async with create_session() as session:
+        try:
+            await bot.infinity_polling(skip_pending=True)
+        finally:
+            executor.shutdown(wait=True)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,7 @@
+"""
+Offline benchmarks of the image formatter and the scraper.
+
+Run from the repository root:
+    python -m benchmarks --output results.json
+    python -m benchmarks --output new.json --compare results.json --max-regression 10
+"""
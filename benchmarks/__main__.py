@@ -0,0 +1,89 @@
+import argparse
+import platform
+import json
+import time
+import sys
+import PIL
+from benchmarks import formatter_bench, scrape_bench, color_bench, links_bench, encoding_bench, dedup_bench
+
+
+def compare(results, baseline, max_regression):
+    """
+    Print the change of the median time of every benchmark against the baseline.
+
+    Args:
+        results (dict): The current results.
+        baseline (dict): The baseline results loaded from a previous run.
+        max_regression (float or None): The allowed slowdown in percent.
+
+    Returns:
+        list of str: The keys of the benchmarks which are slower than allowed.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        old, new = baseline[key]['median'], result['median']
+        change = (new - old) / old * 100 if old else 0
+        mark = ''
+        if max_regression is not None and change > max_regression:
+            regressions.append(key)
+            mark = '  REGRESSION'
+        print(f'{key:<60} {old * 1000:10.2f} -> {new * 1000:10.2f} ms {change:+7.1f}%{mark}')
+    return regressions
+
+
+def main():
+    arguments = argparse.ArgumentParser(description='Benchmarks of ImageFormatter and scrape_and_save_images')
+    arguments.add_argument('--suite', choices=['all', 'formatter', 'color', 'encoding', 'links', 'scrape', 'dedup'], default='all')
+    arguments.add_argument('--repeat', type=int, default=3, help='runs of every benchmark')
+    arguments.add_argument('--sizes', type=float, nargs='+', default=formatter_bench.SIZES, help='image sizes, MP')
+    arguments.add_argument('--formats', nargs='+', default=formatter_bench.FORMATS)
+    arguments.add_argument('--page-mib', type=float, nargs='+', default=links_bench.PAGE_SIZES,
+                           help='sizes of the HTML pages for link extraction, MiB')
+    arguments.add_argument('--images', type=int, default=50, help='images on the scraped page')
+    arguments.add_argument('--image-kib', type=int, default=200, help='size of every scraped image, KiB')
+    arguments.add_argument('--latency-ms', type=float, default=20, help='server latency of every response')
+    arguments.add_argument('--dedup-images', type=int, default=dedup_bench.IMAGES,
+                           help='generated images for near-duplicate detection')
+    arguments.add_argument('--output', help='save the results to this JSON file')
+    arguments.add_argument('--compare', help='compare the results with this JSON file')
+    arguments.add_argument('--max-regression', type=float, help='exit with code 1 if a benchmark is slower by more '
+                                                               'than this percent than in --compare')
+    args = arguments.parse_args()
+
+    results = {}
+    if args.suite in ('all', 'formatter'):
+        results.update(formatter_bench.run(args.sizes, args.formats, args.repeat))
+    if args.suite in ('all', 'color'):
+        results.update(color_bench.run(args.sizes, args.repeat))
+    if args.suite in ('all', 'encoding'):
+        results.update(encoding_bench.run(args.sizes, args.repeat))
+    if args.suite in ('all', 'links'):
+        results.update(links_bench.run(args.page_mib, args.repeat))
+    if args.suite in ('all', 'scrape'):
+        results.update(scrape_bench.run(args.images, args.image_kib * 1024, args.latency_ms / 1000, args.repeat))
+    if args.suite in ('all', 'dedup'):
+        results.update(dedup_bench.run(args.dedup_images, args.repeat))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'meta': {
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'pillow': PIL.__version__,
+                    'machine': platform.machine(),
+                },
+                'results': results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
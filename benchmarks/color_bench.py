@@ -0,0 +1,50 @@
+from PIL import Image, ImageEnhance
+import color_ops
+from benchmarks.common import measure, make_image
+
+
+SIZES = [0.5, 2, 8, 24]
+
+
+def _legacy_chanel(image, chanel):
+    # The previous implementation of ImageFormatter.chanel_convert_image
+    r, g, b = image.split()
+    zeroes = r.point(lambda x: 0)
+    return Image.merge("RGB", (
+        r if chanel == 'r' else zeroes,
+        g if chanel == 'g' else zeroes,
+        b if chanel == 'b' else zeroes
+    ))
+
+
+def run(sizes=None, repeat=3, log=print):
+    """
+    Compare color_ops with the previous implementations of the color operations.
+
+    Args:
+        sizes (list of float, optional): The image sizes in megapixels. Defaults to SIZES.
+        repeat (int, optional): The number of runs of every operation. Defaults to 3.
+        log (callable, optional): Receives a line for every result. Defaults to print.
+
+    Returns:
+        dict: The results keyed by 'color/{operation}/{size}MP/{legacy|color_ops}'.
+    """
+    results = {}
+    for size in sizes or SIZES:
+        image = make_image(size)
+        cases = {
+            'chanel': (lambda: _legacy_chanel(image, 'g'),
+                       lambda: color_ops.isolate_chanel(image, 'g')),
+            'all_chanels': (lambda: [_legacy_chanel(image, chanel) for chanel in 'rgb'],
+                            lambda: color_ops.isolate_all_chanels(image)),
+            'brightness': (lambda: ImageEnhance.Brightness(image).enhance(1.5),
+                           lambda: color_ops.brightness(image, 1.5)),
+            'contrast': (lambda: ImageEnhance.Contrast(image).enhance(1.5),
+                         lambda: color_ops.contrast(image, 1.5)),
+        }
+        for name, (legacy, current) in cases.items():
+            for implementation, function in (('legacy', legacy), ('color_ops', current)):
+                key = f'color/{name}/{size}MP/{implementation}'
+                results[key] = measure(function, repeat)
+                log(f"{key:<60} {results[key]['median'] * 1000:10.2f} ms")
+    return results
@@ -0,0 +1,50 @@
+import statistics
+import time
+from PIL import Image
+
+
+def measure(function, repeat=3, setup=None):
+    """
+    Measure the wall time of the function.
+
+    Args:
+        function (callable): The measured function without arguments.
+        repeat (int, optional): The number of runs. Defaults to 3.
+        setup (callable, optional): Called before every run, its time is not measured. Defaults to None.
+
+    Returns:
+        dict: The median, minimum and maximum time of a run in seconds and the number of runs.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {
+        'median': statistics.median(times),
+        'min': min(times),
+        'max': max(times),
+        'runs': repeat,
+    }
+
+
+def make_image(megapixels, mode='RGB', seed=0):
+    """
+    Generate a synthetic photo-like image: smooth gradients with noise, so it compresses like a real photo.
+
+    Args:
+        megapixels (float): The size of the image in megapixels, the aspect ratio is 4:3.
+        mode (str, optional): The mode of the image. Defaults to 'RGB'.
+        seed (int, optional): Changes the content of the image. Defaults to 0.
+
+    Returns:
+        PIL.Image.Image: The generated image.
+    """
+    width = max(1, int((megapixels * 1_000_000 * 4 / 3) ** 0.5))
+    height = max(1, int(width * 3 / 4))
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed % 20)
+    bands = (gradient, noise, gradient.rotate(180 + seed))
+    return Image.merge('RGB', bands).convert(mode)
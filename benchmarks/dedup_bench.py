@@ -0,0 +1,121 @@
+import os
+import random
+import tempfile
+from PIL import Image, ImageDraw
+from perceptual_hash import DuplicateIndex, fingerprint, hamming
+from benchmarks.common import measure
+
+
+# The number of generated images, every product photo is saved in VARIANTS versions
+IMAGES = 2000
+VARIANTS = 4
+PHOTO_SIZE = (480, 360)
+
+
+def make_product_photo(seed, size=PHOTO_SIZE):
+    """
+    Generate a distinct product-like photo: colored shapes on a plain background.
+
+    Args:
+        seed (int): Selects the content of the photo.
+        size (tuple of int, optional): The width and height. Defaults to PHOTO_SIZE.
+
+    Returns:
+        PIL.Image.Image: The generated RGB image.
+    """
+    generator = random.Random(seed)
+    width, height = size
+    image = Image.new('RGB', size, tuple(generator.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        x, y = generator.randrange(width), generator.randrange(height)
+        box = (x, y, x + generator.randrange(width // 10, width // 2), y + generator.randrange(height // 10, height // 2))
+        color = tuple(generator.randrange(256) for _ in range(3))
+        if generator.random() < 0.5:
+            draw.ellipse(box, fill=color)
+        else:
+            draw.rectangle(box, fill=color)
+    return image
+
+
+def _variants(photo):
+    # The versions of one photo a catalogue typically has: the original, a thumbnail, a recompressed copy and
+    # a copy with a caption. Color and tone variants are different images and are not generated
+    captioned = photo.copy()
+    ImageDraw.Draw(captioned).text((10, 10), 'SALE -20%', fill=(255, 0, 0))
+    return [(photo, 90), (photo.resize((photo.width // 2, photo.height // 2)), 85), (photo, 30), (captioned, 90)]
+
+
+def _write_images(directory, images):
+    paths = []
+    for seed in range(max(1, images // VARIANTS)):
+        for number, (variant, quality) in enumerate(_variants(make_product_photo(seed))):
+            path = os.path.join(directory, f'{seed}_{number}.jpg')
+            variant.save(path, quality=quality)
+            paths.append((seed, path))
+    return paths
+
+
+class _LinearIndex:
+    # The MultiIndexHash interface with a scan of every hash, to show what the index saves
+
+    def __init__(self):
+        self._items = []
+
+    def add(self, value, item):
+        self._items.append((value, item))
+
+    def search(self, value, max_distance=8):
+        found = [(hamming(value, other), item) for other, item in self._items]
+        return sorted(result for result in found if result[0] <= max_distance)
+
+
+def _deduplicate(fingerprints, linear=False):
+    index = DuplicateIndex()
+    if linear:
+        index._index = _LinearIndex()
+    for key, image_fingerprint in enumerate(fingerprints):
+        index.add(key, image_fingerprint)
+    return index
+
+
+def run(images=IMAGES, repeat=3, log=print):
+    """
+    Measure near-duplicate detection on generated product photos saved in several versions: the hashing of the
+    files (a reduced decode and aHash/dHash/pHash) and the grouping with MultiIndexHash against a scan of every kept
+    image.
+
+    Args:
+        images (int, optional): The number of generated images. Defaults to IMAGES.
+        repeat (int, optional): The number of runs of every case. Defaults to 3.
+        log (callable, optional): Receives a line for every result. Defaults to print.
+
+    Returns:
+        dict: The results keyed by 'dedup/{fingerprint|multi_index|linear}/{images}'. The grouping results also have
+              'kept' (images left), 'missed' (duplicates left besides the first image of a photo)
+              and 'merged' (photos left without any image, merged into another photo).
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        files = _write_images(directory, images)
+        seeds = [seed for seed, _ in files]
+        count = len(files)
+
+        key = f'dedup/fingerprint/{count}'
+        fingerprints = []
+        results[key] = measure(lambda: fingerprints.__setitem__(slice(None), [fingerprint(path) for _, path in files]),
+                               repeat)
+        log(f"{key:<60} {results[key]['median'] * 1000:10.2f} ms")
+
+        for implementation in ('multi_index', 'linear'):
+            key = f'dedup/{implementation}/{count}'
+            results[key] = measure(lambda: _deduplicate(fingerprints, implementation == 'linear'), repeat)
+            index = _deduplicate(fingerprints, implementation == 'linear')
+            kept = [seeds[number] for number in range(count) if index.is_kept(number)]
+            photos = set(seeds)
+            results[key]['kept'] = len(kept)
+            results[key]['missed'] = len(kept) - len(set(kept))
+            results[key]['merged'] = len(photos - set(kept))
+            log(f"{key:<60} {results[key]['median'] * 1000:10.2f} ms  kept {len(kept)} of {count} "
+                f"({len(photos)} photos), missed {results[key]['missed']}, merged {results[key]['merged']}")
+    return results
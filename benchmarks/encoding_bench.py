@@ -0,0 +1,71 @@
+import io
+from PIL import Image, ImageDraw
+from encoding import EncodingPolicy
+from image_formatter import PREVIEW_MAX_SIZE
+from benchmarks.common import measure, make_image
+
+
+SIZES = [0.5, 2, 8]
+
+
+def make_flat_image(megapixels):
+    """
+    Generate a flat image with few colors, like a screenshot or a chart.
+
+    Args:
+        megapixels (float): The size of the image in megapixels, the aspect ratio is 4:3.
+
+    Returns:
+        PIL.Image.Image: The generated RGB image.
+    """
+    width = max(1, int((megapixels * 1_000_000 * 4 / 3) ** 0.5))
+    height = max(1, int(width * 3 / 4))
+    image = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for i in range(40):
+        x, y = width * i // 40, height * (i % 8) // 8
+        draw.rectangle((x, y, x + width // 10, y + height // 10), fill=(i * 6, 120, 255 - i * 6))
+        draw.line((0, height * i // 40, width, height - height * i // 40), fill=(0, 0, 0), width=3)
+    return image
+
+
+def _encode(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def run(sizes=None, repeat=3, log=print):
+    """
+    Compare the encoding of images with Pillow defaults (as ImageFormatter saved them before) and with EncodingPolicy.
+
+    Args:
+        sizes (list of float, optional): The image sizes in megapixels. Defaults to SIZES.
+        repeat (int, optional): The number of runs of every case. Defaults to 3.
+        log (callable, optional): Receives a line for every result. Defaults to print.
+
+    Returns:
+        dict: The results keyed by 'encoding/{case}/{size}MP/{pillow|policy}', with the encoded size in 'bytes'.
+    """
+    policy = EncodingPolicy()
+    results = {}
+    for size in sizes or SIZES:
+        photo = make_image(size)
+        flat = make_flat_image(size)
+        preview = photo.copy()
+        preview.thumbnail((PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE))
+        cases = {
+            'photo_jpeg': (lambda: _encode(photo, 'JPEG'),
+                           lambda: policy.encode(photo, 'JPEG')),
+            'flat_png': (lambda: _encode(flat, 'PNG'),
+                         lambda: policy.encode(flat, 'PNG')),
+            'preview_webp': (lambda: _encode(preview, 'JPEG', quality=85, optimize=True),
+                             lambda: policy.encode(preview, 'WEBP')),
+        }
+        for name, (pillow, current) in cases.items():
+            for implementation, function in (('pillow', pillow), ('policy', current)):
+                key = f'encoding/{name}/{size}MP/{implementation}'
+                results[key] = measure(function, repeat)
+                results[key]['bytes'] = len(function())
+                log(f"{key:<60} {results[key]['median'] * 1000:10.2f} ms {results[key]['bytes'] / 1024:10.1f} KiB")
+    return results
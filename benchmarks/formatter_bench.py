@@ -0,0 +1,81 @@
+import tempfile
+import os
+from image_formatter import ImageFormatter, DecodedImageCache
+from benchmarks.common import measure, make_image
+
+
+WATERMARK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'images', 'static', 'example_watermark.png')
+
+# (name, method, args) of every ImageFormatter operation
+OPERATIONS = [
+    ('rotate_image', 'rotate_image', (90,)),
+    ('flip_image', 'flip_image', ('horizontal',)),
+    ('crop_image', 'crop_image', (25, 25, 25, 25)),
+    ('crop_image_in_pixels', 'crop_image_in_pixels', (0, 0, 100, 100)),
+    ('resize_image', 'resize_image', (50, 50)),
+    ('resize_image_small', 'resize_image', (10, 10)),
+    ('grayscale_image', 'grayscale_image', ()),
+    ('chanel_convert_image', 'chanel_convert_image', ('r',)),
+    ('blur_image_box', 'blur_image', ('box', 10)),
+    ('blur_image_gaussian', 'blur_image', ('gaussian', 10)),
+    ('sharpen_image', 'sharpen_image', ()),
+    ('smooth_image', 'smooth_image', ()),
+    ('find_edges', 'find_edges', ()),
+    ('chanel_convert_all', 'chanel_convert_all', ()),
+    ('change_brightness', 'change_brightness', (1.5,)),
+    ('change_contrast', 'change_contrast', (1.5,)),
+    ('change_gamma', 'change_gamma', (2.2,)),
+    ('adjust_levels', 'adjust_levels', (16, 240, 1.2)),
+    ('add_watermark', 'add_watermark', (WATERMARK_PATH, (100, 100))),
+    ('add_text', 'add_text', ('Hello, world!', 0, 0, 32, (255, 0, 0))),
+    ('get_image_size', 'get_image_size', ()),
+]
+
+SIZES = [0.5, 2, 8, 24]
+FORMATS = ['jpeg', 'png']
+
+
+def _preset(formatter):
+    return formatter.pipeline().resize(50, 50).sharpen().watermark(WATERMARK_PATH, (100, 100)).save('preset')
+
+
+def run(sizes=None, formats=None, repeat=3, log=print):
+    """
+    Benchmark every ImageFormatter operation on generated images.
+
+    Every operation is measured cold (the decoded image cache is cleared before each run, so the original
+    is decoded from disk) and warm (the original is already decoded).
+
+    Args:
+        sizes (list of float, optional): The image sizes in megapixels. Defaults to SIZES.
+        formats (list of str, optional): The image formats. Defaults to FORMATS.
+        repeat (int, optional): The number of runs of every operation. Defaults to 3.
+        log (callable, optional): Receives a line for every result. Defaults to print.
+
+    Returns:
+        dict: The results keyed by 'formatter/{operation}/{format}/{size}MP/{cold|warm}'.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes or SIZES:
+            image = make_image(size)
+            for image_format in formats or FORMATS:
+                image_directory = os.path.join(directory, f'{size}MP_{image_format}')
+                os.makedirs(image_directory)
+                image.save(os.path.join(image_directory, f'default.{image_format}'))
+                cache = DecodedImageCache()
+                formatter = ImageFormatter(directory, cache)
+                formatter.select_image_directory(image_directory)
+
+                operations = [(name, getattr(formatter, method), args) for name, method, args in OPERATIONS]
+                operations.append(('pipeline_preset', lambda: _preset(formatter), ()))
+                for name, function, args in operations:
+                    for state in ('cold', 'warm'):
+                        setup = cache.invalidate if state == 'cold' else None
+                        if state == 'warm':
+                            function(*args)
+                        key = f'formatter/{name}/{image_format}/{size}MP/{state}'
+                        results[key] = measure(lambda: function(*args), repeat, setup)
+                        log(f"{key:<60} {results[key]['median'] * 1000:10.2f} ms")
+    return results
@@ -0,0 +1,97 @@
+import re
+try:
+    # Only the legacy baseline needs BeautifulSoup, it is not a dependency of the bot
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+from image_links import extract_image_links
+from benchmarks.common import measure
+
+
+PAGE_SIZES = [1, 4, 16]
+PAGE_URL = 'https://example.com/catalog/page.html'
+
+
+def _legacy_links(html, url, charset=None):
+    # The previous implementation of parser._fetch_img_links
+    soup = BeautifulSoup(html, 'lxml', from_encoding=charset)
+    image_links = []
+    domain = re.search(r'https?://[^/]+', url).group()
+    http = re.search(r'https?:', url).group()
+    for item in soup.find_all('img'):
+        link = item.get('data-src') or item.get('src')
+        if not link:
+            continue
+        if re.search(r'[.](png|jpg|jpeg)$', link) is None:
+            continue
+        if link.startswith('http'):
+            image_links.append(link)
+        elif link.startswith('//'):
+            image_links.append(http + link)
+        elif link.startswith('/'):
+            image_links.append(domain + link)
+        else:
+            image_links.append(domain + '/' + link)
+    return image_links
+
+
+def make_page(mebibytes):
+    """
+    Generate a catalog-like HTML page: product cards with text, plain, lazy loaded and responsive images.
+
+    Args:
+        mebibytes (float): The approximate size of the page in MiB.
+
+    Returns:
+        bytes: The page encoded as UTF-8.
+    """
+    cards = []
+    size = 0
+    i = 0
+    while size < mebibytes * 1024 * 1024:
+        kind = i % 4
+        if kind == 0:
+            image = f'<img src="/img/{i}.jpg" alt="Product {i}">'
+        elif kind == 1:
+            image = f'<img src="/img/placeholder.gif" data-src="/img/{i}.png?v=3" alt="Product {i}">'
+        elif kind == 2:
+            image = (f'<img srcset="/img/{i}-480.jpg 480w, /img/{i}-1080.jpg 1080w, /img/{i}-1920.jpg 1920w" '
+                     f'src="/img/{i}-480.jpg" alt="Product {i}">')
+        else:
+            image = (f'<picture><source srcset="/img/{i}.webp" type="image/webp">'
+                     f'<source srcset="/img/{i}-800.jpg 800w, /img/{i}-1600.jpg 1600w"><img src="/img/{i}.jpg"></picture>')
+        card = (f'<div class="card" id="p{i}"><a href="/product/{i}">{image}</a><h3>Product {i}</h3>'
+                f'<p class="description">{"Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4}</p>'
+                f'<span class="price">{i % 1000}.99</span></div>\n')
+        cards.append(card)
+        size += len(card)
+        i += 1
+    return f'<html><head><meta charset="utf-8"></head><body>{"".join(cards)}</body></html>'.encode()
+
+
+def run(page_sizes=None, repeat=3, log=print):
+    """
+    Compare extract_image_links with the previous BeautifulSoup extractor on generated pages. The legacy extractor
+    is skipped if beautifulsoup4 is not installed.
+
+    Args:
+        page_sizes (list of float, optional): The page sizes in MiB. Defaults to PAGE_SIZES.
+        repeat (int, optional): The number of runs of every extractor. Defaults to 3.
+        log (callable, optional): Receives a line for every result. Defaults to print.
+
+    Returns:
+        dict: The results keyed by 'links/{size}MiB/{legacy|image_links}', with the number of found links.
+    """
+    results = {}
+    implementations = [('legacy', _legacy_links), ('image_links', extract_image_links)]
+    if BeautifulSoup is None:
+        log('links/legacy skipped: pip install beautifulsoup4 to compare with the previous extractor')
+        implementations = implementations[1:]
+    for size in page_sizes or PAGE_SIZES:
+        html = make_page(size)
+        for implementation, function in implementations:
+            key = f'links/{size}MiB/{implementation}'
+            results[key] = measure(lambda: function(html, PAGE_URL), repeat)
+            results[key]['links'] = len(function(html, PAGE_URL))
+            log(f"{key:<60} {results[key]['median'] * 1000:10.2f} ms {results[key]['links']:8} links")
+    return results
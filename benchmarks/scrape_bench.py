@@ -0,0 +1,129 @@
+import asyncio
+import tempfile
+import threading
+import shutil
+import io
+import os
+from aiohttp import web
+import parser
+from benchmarks.common import measure
+from benchmarks.dedup_bench import make_product_photo
+
+
+# The dimensions of the served images, about 0.05 MP
+IMAGE_SIZE = (258, 194)
+
+
+class ImageServer:
+    """
+    Local HTTP stand-in for a site: a page with N images, served with configurable latency and image size.
+
+    Images support ETag revalidation. Every image is a different photo, so the near-duplicate filter of the parser
+    keeps all of them. Use as a context manager, the server runs in a background thread.
+
+    Args:
+        images (int, optional): The number of images on the page. Defaults to 50.
+        image_bytes (int, optional): The approximate size of every image in bytes. Defaults to 200 KiB.
+        latency (float, optional): The delay before every response in seconds. Defaults to 0.
+    """
+
+    def __init__(self, images=50, image_bytes=200 * 1024, latency=0.0):
+        self.images = images
+        self.latency = latency
+        self.requests = 0
+        self._bodies = []
+        for i in range(images):
+            buffer = io.BytesIO()
+            make_product_photo(i, IMAGE_SIZE).save(buffer, 'JPEG')
+            photo = buffer.getvalue()
+            # Bytes after the end of the JPEG are ignored by decoders, they give the image the needed size
+            self._bodies.append(photo + b'\0' * max(0, image_bytes - len(photo)))
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._runner = None
+        self.url = None
+
+    async def _page(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        images = ''.join(f'<img src="/img/{i}.jpg">' for i in range(self.images))
+        return web.Response(text=f'<html><body>{images}</body></html>', content_type='text/html')
+
+    async def _image(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        index = int(request.match_info['index'])
+        etag = f'"{index}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=self._bodies[index], content_type='image/jpeg', headers={'ETag': etag})
+
+    async def _start(self):
+        app = web.Application()
+        app.add_routes([web.get('/', self._page), web.get('/img/{index}.jpg', self._image)])
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f'http://127.0.0.1:{port}/'
+
+    def __enter__(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def run(images=50, image_bytes=200 * 1024, latency=0.0, repeat=3, log=print):
+    """
+    Benchmark scrape_and_save_images against a local server.
+
+    The scrape is measured cold (empty HTTP cache and image store) and warm (everything is revalidated).
+    The images are distinct photos, so with parser.DEDUPLICATE every one of them is hashed and placed.
+
+    Args:
+        images (int, optional): The number of images on the page. Defaults to 50.
+        image_bytes (int, optional): The approximate size of every image in bytes. Defaults to 200 KiB.
+        latency (float, optional): The server delay before every response in seconds. Defaults to 0.
+        repeat (int, optional): The number of runs. Defaults to 3.
+        log (callable, optional): Receives a line for every result. Defaults to print.
+
+    Returns:
+        dict: The results keyed by 'scrape/{images}x{size}KiB/{latency}ms/{cold|warm}'.
+    """
+    results = {}
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp()
+    # The scraper keeps its cache and store relative to the current directory
+    os.chdir(directory)
+    try:
+        with ImageServer(images, image_bytes, latency) as server:
+            def reset():
+                shutil.rmtree('images', ignore_errors=True)
+                parser._http_cache = None
+
+            def scrape():
+                status, message = parser.scrape_and_save_images(server.url, 'images/parsed_images')
+                if status != 'done':
+                    raise RuntimeError(message)
+                placed = len(os.listdir('images/parsed_images')) - 1
+                if placed != images:
+                    raise RuntimeError(f'{placed} of {images} images were placed')
+
+            name = f'scrape/{images}x{image_bytes // 1024}KiB/{int(latency * 1000)}ms'
+            log(f'{name}: {images} distinct images, near-duplicate filter '
+                f"{'on' if parser.DEDUPLICATE else 'off'} (parser.DEDUPLICATE)")
+            results[f'{name}/cold'] = measure(scrape, repeat, reset)
+            results[f'{name}/warm'] = measure(scrape, repeat)
+            for state in ('cold', 'warm'):
+                log(f"{name + '/' + state:<60} {results[name + '/' + state]['median'] * 1000:10.2f} ms")
+    finally:
+        os.chdir(cwd)
+        parser._http_cache = None
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
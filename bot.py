@@ -1,73 +1,181 @@
 import telebot
 from telebot import types
-import os
-from parser import scrape_and_save_images
-from image_formatter import ImageFormatter
-from config import TOKEN, PHOTOS_PATH
-bot = telebot.TeleBot(TOKEN, skip_pending=True)
-formatter = ImageFormatter()
+from telebot.apihelper import ApiTelegramException
+from contextlib import ExitStack
+import time
+import threading
+from workspaces import WorkspaceManager
+from result_cache import ResultCache
+from image_formatter import ImageTooLarge
+from file_id_cache import FileIdCache
+from file_digests import FileDigests
+from job_queue import JobQueue
+from worker import start_workers, encoding
+from bot_common import user_menu, PTL_menu, get_photos, start_metrics, count_sent, SEND_SECONDS, SEND_ERRORS, \
+    cached_file_ids, remember_file_ids, forget_file_ids
+from config import TOKEN, WORKSPACES_PATH, WORKSPACE_IDLE_TIMEOUT, RESULTS_PATH, RESULT_CACHE_MAX_BYTES, BOT_THREADS, \
+    IMAGE_MAX_PIXELS, OPERATION_MAX_BYTES, FILE_IDS_PATH, JOBS_PATH, JOB_WORKERS, JOB_CONCURRENCY
+# Бот, очередь задач, папки чатов и file_id создаются в main(): рабочие процессы запускаются через spawn
+# и импортируют этот модуль заново, им ничего из этого не нужно
+bot = None
+jobs = None
+workspaces = None
+file_ids = None
+# Обработчики сообщений регистрируются в боте при запуске: (функция, фильтры)
+handlers = []
+# Как часто проверяются завершенные задачи и задачи остановившихся процессов
+NOTIFY_INTERVAL = 0.5
+RECOVER_INTERVAL = 10
 
-def user_menu():
-    markup = types.ReplyKeyboardMarkup(one_time_keyboard=True)
-    markup.add('Выбрать изображение','Поменять ссылку')
-    return markup
+def message_handler(**filters):
+    # Как bot.message_handler, но бот еще не создан — обработчик запоминается до main()
+    def register(function):
+        handlers.append((function, filters))
+        return function
+    return register
 
-def select(name):
-    for i in os.listdir(path):
-        if i.startswith(name):
-            send_photo = path + "/" + i
-            send_photo = types.InputMediaPhoto(open(send_photo, 'rb'))
-            return(send_photo)
-    return
+def main():
+    global bot, jobs, workspaces, file_ids
+    bot = telebot.TeleBot(TOKEN, skip_pending=True, num_threads=BOT_THREADS)
+    for function, filters in handlers:
+        bot.register_message_handler(function, **filters)
+    # Парсинг и операции выполняются рабочими процессами, обработчики сообщений только ставят задачи
+    jobs = JobQueue(JOBS_PATH, JOB_CONCURRENCY)
+    # Хэши файлов общие для кэша результатов и file_id: одно изображение хэшируется один раз
+    digests = FileDigests()
+    # Каждый чат работает в своей папке со своим выбранным изображением. Папки чатов, в которых работают
+    # рабочие процессы, не удаляются
+    workspaces = WorkspaceManager(WORKSPACES_PATH, WORKSPACE_IDLE_TIMEOUT,
+                                  result_cache=ResultCache(RESULTS_PATH, RESULT_CACHE_MAX_BYTES, digests=digests),
+                                  encoding=encoding, max_pixels=IMAGE_MAX_PIXELS, max_memory_bytes=OPERATION_MAX_BYTES,
+                                  busy_chats=jobs.busy_chats)
+    # Отправленные файлы повторно отправляются по file_id, без загрузки
+    file_ids = FileIdCache(FILE_IDS_PATH, digests=digests)
+    start_metrics()
+    start_workers(JOB_WORKERS)
+    threading.Thread(target=notify_chats, name='notify-chats', daemon=True).start()
+    bot.polling(non_stop=True)
 
-def PTL_menu():
-    markup = types.ReplyKeyboardMarkup(one_time_keyboard=True)
-    markup.add('Повернуть изображение', 'Отзеркалить','Обрезать',\
-               'Изменить размер', 'Сделать чёрно-белым', 'Преобразовать в цветовой диапазон',\
-                'Размытие', 'Увеличьте резкость', 'Сглаживание', 'Найти рёбра',\
-                'Яркость',  'Добавить текст', 'Главное меню')
-    return markup
+def run_operation(message, operation, *args):
+    # Операции одного чата выполняются по очереди, разных чатов — параллельно. Результат отправит notify_chats()
+    workspace = workspaces.get(message.chat.id)
+    with workspace.lock:
+        if workspace.selected_path is None:
+            bot.send_message(message.chat.id, 'Сначала выберите изображение', reply_markup=user_menu())
+            return
+        jobs.submit('operation', message.chat.id, {'path': workspace.path, 'image': workspace.selected_path,
+                                                   'operation': operation, 'args': list(args)})
+
+def notify(job):
+    # Сообщает чату о начале и результате задачи
+    chat_id = job['chat_id']
+    if job['state'] == 'running':
+        if job['kind'] == 'scrape':
+            bot.send_message(chat_id, 'Парсинг начат')
+    elif job['state'] == 'failed':
+        print(job['error'])
+        if job['error'].startswith(ImageTooLarge.__name__):
+            bot.send_message(chat_id, 'Изображение слишком большое для этой операции', reply_markup=PTL_menu())
+        elif job['kind'] == 'scrape':
+            bot.send_message(chat_id, 'Не удалось спарсить изображения', reply_markup=user_menu())
+        else:
+            bot.send_message(chat_id, 'Не удалось обработать изображение', reply_markup=PTL_menu())
+    elif job['kind'] == 'scrape' and job['result']['status'] == 'error':
+        print(job['result']['message'])
+        bot.send_message(chat_id, 'Не удалось спарсить изображения', reply_markup=user_menu())
+    elif job['kind'] == 'scrape':
+        workspace = workspaces.get(chat_id)
+        with workspace.lock:
+            workspace.selected_path = None
+            photos, paths = get_photos(workspace.path)
+        send_photos(chat_id, photos)
+        bot.send_message(chat_id, 'Изображения спаршены', reply_markup=user_menu())
+    else:
+        send_photos(chat_id, [job['result']['path']])
+        bot.send_message(chat_id, 'Выберете действие', reply_markup=PTL_menu())
+
+def notify_chats():
+    # Задачи, завершенные, пока бот был остановлен, тоже сообщаются — после запуска
+    last_recover = 0
+    while True:
+        if time.monotonic() - last_recover > RECOVER_INTERVAL:
+            # Задачи остановившихся рабочих процессов ставятся в очередь заново
+            jobs.recover()
+            last_recover = time.monotonic()
+        for job in jobs.updates():
+            try:
+                notify(job)
+            except Exception as e:
+                print(e)
+            jobs.mark_notified(job['id'], job['state'])
+        time.sleep(NOTIFY_INTERVAL)
 
-def get_photos():
-    photos = []
-    paths = []
-    for photo_folder in os.listdir(PHOTOS_PATH):
+def send_photos(chat_id, photos):
+    # В одном альбоме Telegram не больше 10 фотографий, альбом из одной фотографии отправить нельзя
+    for i in range(0, len(photos), 10):
+        group = photos[i:i + 10]
+        digests, cached = cached_file_ids(file_ids, group, 'photo')
         try:
-            int(photo_folder[:3])
-            for photo in os.listdir(PHOTOS_PATH + "/" + photo_folder):
-                if photo.startswith("default"):
-                    paths.append(PHOTOS_PATH + "/" + photo_folder)
-                    photo = PHOTOS_PATH + "/" + photo_folder + "/" + photo
-                    photos.append(types.InputMediaPhoto(open(photo, 'rb')))
-                    
-        except Exception as e:
-            print(e)
-    return photos, paths
+            send_group(chat_id, group, digests, cached)
+        except ApiTelegramException as e:
+            if e.error_code != 400 or not any(cached):
+                raise
+            # Telegram не принял сохраненный file_id — забываем его и загружаем файлы заново
+            forget_file_ids(file_ids, digests, cached, 'photo')
+            send_group(chat_id, group, digests, [None] * len(group))
 
-def send_res(message, name):
-    send_photo = select(name)
-    bot.send_media_group(message.chat.id, [send_photo])
-    bot.send_message(message.chat.id, 'Выберете действие', reply_markup=PTL_menu())
-@bot.message_handler(commands=['start'])
+def send_group(chat_id, group, digests, cached):
+    # Уже загруженные файлы отправляются по file_id, остальные загружаются
+    with ExitStack() as stack:
+        media = [file_id or stack.enter_context(open(photo, 'rb')) for photo, file_id in zip(group, cached)]
+        method = 'send_photo' if len(media) == 1 else 'send_media_group'
+        with SEND_SECONDS.time(SEND_ERRORS, method=method):
+            if len(media) == 1:
+                messages = [bot.send_photo(chat_id, media[0])]
+            else:
+                messages = bot.send_media_group(chat_id, [types.InputMediaPhoto(m) for m in media])
+    remember_file_ids(file_ids, digests, cached, messages, 'photo')
+    count_sent(method, group, cached)
+
+def send_document(chat_id, path):
+    # Документ тоже отправляется по file_id, если этот файл уже загружался
+    digests, cached = cached_file_ids(file_ids, [path], 'document')
+    try:
+        send_file(chat_id, path, digests, cached)
+    except ApiTelegramException as e:
+        if e.error_code != 400 or cached[0] is None:
+            raise
+        forget_file_ids(file_ids, digests, cached, 'document')
+        send_file(chat_id, path, digests, [None])
+
+def send_file(chat_id, path, digests, cached):
+    with ExitStack() as stack:
+        document = cached[0] or stack.enter_context(open(path, 'rb'))
+        with SEND_SECONDS.time(SEND_ERRORS, method='send_document'):
+            sent = bot.send_document(chat_id, document)
+    remember_file_ids(file_ids, digests, cached, [sent], 'document')
+    count_sent('send_document', [path], cached)
+
+@message_handler(commands=['start'])
 def bot_start(message):
     bot.send_message(message.chat.id, 'Приветствую! \n Я бот для обработки спаршеных изображений, дабы воспользоваться моими функциями введите url')
 
-@bot.message_handler(func=lambda message: message.text.startswith('Главное меню'))
+@message_handler(func=lambda message: message.text.startswith('Главное меню'))
 def bot_main_menu(message):
     bot.send_message(message.chat.id, 'Выберете действие', reply_markup=user_menu())
     
-@bot.message_handler(func=lambda message: message.text.startswith('http'))
+@message_handler(func=lambda message: message.text.startswith('http'))
 def bot_parce(message):
-    scrape_and_save_images(message.text)
-    photos, paths = get_photos()
-    
-    bot.send_media_group(message.chat.id, photos)
-    
-    bot.send_message(message.chat.id, 'Изображения спаршены', reply_markup=user_menu())
+    # Парсинг идет в рабочем процессе, обработчик сразу освобождается
+    workspace = workspaces.get(message.chat.id)
+    job_id = jobs.submit('scrape', message.chat.id, {'url': message.text, 'path': workspace.path})
+    ahead = jobs.position(job_id)
+    if ahead:
+        bot.send_message(message.chat.id, f'Ссылка в очереди, перед ней задач: {ahead}')
 
-@bot.message_handler(func=lambda message: message.text == 'Выбрать изображение')
+@message_handler(func=lambda message: message.text == 'Выбрать изображение')
 def bot_select_image(message):
-    photos, paths = get_photos()
+    photos, paths = get_photos(workspaces.get(message.chat.id).path)
     markup = types.ReplyKeyboardMarkup(one_time_keyboard=True)
     for i in range(1, len(photos) + 1):
         markup.add(str(i))
@@ -78,30 +186,45 @@ def bot_select_image(message):
 def bot_selected_image(message, photos, paths):
     try:
         index = int(message.text) -1
-        global path
-        path = paths[index]
-        formatter.select_image_directory(path)
-        bot.send_media_group(message.chat.id, [photos[index]])
+        workspace = workspaces.get(message.chat.id)
+        with workspace.lock:
+            workspace.selected_path = paths[index]
+            workspace.formatter.select_image_directory(workspace.selected_path)
+        send_photos(message.chat.id, [photos[index]])
         bot.send_message(message.chat.id, 'Выберете действие', reply_markup=PTL_menu())
     except Exception as e:
         print(e)
         bot.send_message(message.chat.id, 'Возможно изображения с таким индексом нет', reply_markup=PTL_menu())
 
-@bot.message_handler(regexp="Повернуть изображение")
+@message_handler(regexp="Оригинал")
+def send_original(message):
+    # Оригинал отправляется документом, без сжатия, только по запросу
+    workspace = workspaces.get(message.chat.id)
+    try:
+        with workspace.lock:
+            formatter = workspace.formatter
+            original = formatter.current_image_directory + 'default.' + formatter.current_image_format
+            send_document(message.chat.id, original)
+    except Exception as e:
+        print(e)
+        bot.send_message(message.chat.id, 'Сначала выберите изображение', reply_markup=user_menu())
+        return
+    bot.send_message(message.chat.id, 'Выберете действие', reply_markup=PTL_menu())
+
+@message_handler(regexp="Повернуть изображение")
 def rotate_image(message):
     bot.reply_to(message, "Выберете градус поворота")
     bot.register_next_step_handler(message, rotated_image)
 def rotated_image(message):
     try:
         rotate = int(message.text)
-        formatter.rotate_image(rotate)
-        send_res(message, "rotated")
+        run_operation(message, 'rotate_image', rotate)
     except Exception as e:
         print(e)
         bot.send_message(message.chat.id, 'Ошибка ввода', reply_markup=PTL_menu())
 
     
-@bot.message_handler(regexp="Отзеркалить")
+@message_handler(regexp="Отзеркалить")
 def flip_image(message):
     markup = types.ReplyKeyboardMarkup()
     markup.add('По горизонтали', 'По вертикали')
@@ -114,15 +237,14 @@ def fliped_image(message):
         mode = "vertical"
     else:
         bot.send_message(message.chat.id, 'Такого отзеркаливания у нас нету', reply_markup=PTL_menu())
-    formatter.flip_image(mode)
-    send_res(message, "flipped")
+    run_operation(message, 'flip_image', mode)
 
-@bot.message_handler(regexp="Обрезать")
+@message_handler(regexp="Обрезать")
 def crop_image(message):
     # Логика обрезки изображения
     bot.send_message(message.chat.id, 'Возвращайся позже', reply_markup=PTL_menu())
 
-@bot.message_handler(regexp="Изменить размер")
+@message_handler(regexp="Изменить размер")
 def resize_image(message):
     # Логика изменения размера изображения
     bot.reply_to(message, "Введите % изменения ширины и высоты")
@@ -130,19 +252,15 @@ def resize_image(message):
 def resized_image(message):
     try:
         message_text = message.text.split(" ")
-        formatter.resize_image(int(message_text[0]), int(message_text[1]))
-        send_photo = select('resized')
-        bot.send_media_group(message.chat.id, [send_photo])
-        bot.send_message(message.chat.id, 'Выберете действие', reply_markup=PTL_menu())
+        run_operation(message, 'resize_image', int(message_text[0]), int(message_text[1]))
     except Exception as e:
         print(e)
         bot.send_message(message.chat.id, 'Ошибка ввода', reply_markup=PTL_menu())
-@bot.message_handler(regexp="Сделать чёрно-белым")
+@message_handler(regexp="Сделать чёрно-белым")
 def grayscale_image(message):
-    formatter.grayscale_image()
-    send_res(message, 'grayscaled')
+    run_operation(message, 'grayscale_image')
     
-@bot.message_handler(regexp="Преобразовать в цветовой диапазон")
+@message_handler(regexp="Преобразовать в цветовой диапазон")
 def color_range_image(message):
     # Логика преобразования изображения в цветовой диапазон
     markup = types.ReplyKeyboardMarkup()
@@ -159,10 +277,9 @@ def color_ranged_image(message):
     else:
         bot.send_message(message.chat.id, 'Что-то не то', reply_markup=PTL_menu())
         return
-    formatter.chanel_convert_image(color)
-    send_res(message, 'chanel_converted')
+    run_operation(message, 'chanel_convert_image', color)
 
-@bot.message_handler(regexp="Размытие")
+@message_handler(regexp="Размытие")
 def blur_image(message):
     markup = types.ReplyKeyboardMarkup()
     markup.add("Прямоугольное", "Гауссово")
@@ -181,29 +298,25 @@ def blur_image_val(message):
 def blured_image_val(message, mode):
     try:
         val = int(message.text)
-        formatter.blur_image(mode, val)
-        send_res(message, 'blurred')
+        run_operation(message, 'blur_image', mode, val)
     except Exception as e:
         print(e)
         bot.send_message(message.chat.id, 'Что-то не то', reply_markup=PTL_menu())
 
 
-@bot.message_handler(regexp="Увеличьте резкость")
+@message_handler(regexp="Увеличьте резкость")
 def sharpen_image(message):
-    formatter.sharpen_image()
-    send_res(message, 'sharpened')
+    run_operation(message, 'sharpen_image')
 
-@bot.message_handler(regexp="Сглаживание")
+@message_handler(regexp="Сглаживание")
 def smooth_image(message):
-    formatter.smooth_image()
-    send_res(message, 'smoothed')
+    run_operation(message, 'smooth_image')
 
-@bot.message_handler(regexp="Найти рёбра")
+@message_handler(regexp="Найти рёбра")
 def edge_detection(message):
-    formatter.find_edges()
-    send_res(message, 'edges')
+    run_operation(message, 'find_edges')
 
-@bot.message_handler(regexp="Яркость")
+@message_handler(regexp="Яркость")
 def brightness_adjustment(message):
     # Логика регулировки яркости изображения
     bot.send_message(message.chat.id, 'Введите число, все что выше 1.0 увеличивает яркость, и наоборот')
@@ -211,14 +324,13 @@ def brightness_adjustment(message):
 def brightnessed_adjustment(message):
     try:
         val = float(message.text)
-        formatter.change_brightness(val)
-        send_res(message, 'brightness_changed')
+        run_operation(message, 'change_brightness', val)
     except Exception as e:
         print(e)
         bot.send_message(message.chat.id, 'Что-то не то', reply_markup=PTL_menu())
 
 
-@bot.message_handler(regexp="Добавить текст")
+@message_handler(regexp="Добавить текст")
 def add_text(message):
     try:
         bot.send_message(message.chat.id, 'Введите текст который хотите добваить на изображение')
@@ -258,11 +370,10 @@ def add_text_color(message, total):
 def added_text_color(message, total):
     try:
         color = tuple(map(int, message.text.split(" ")))
-        formatter.add_text(*total, color)
-        send_res(message, 'text_added')
+        run_operation(message, 'add_text', *total, color)
     except Exception as e:
         print(e)
         bot.send_message(message.chat.id, 'Ошибка ввода', reply_markup=PTL_menu())
 
 if __name__ == "__main__":
-    bot.polling(non_stop=True)
\ No newline at end of file
+    main()
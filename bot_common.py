@@ -0,0 +1,85 @@
+import os
+from telebot import types
+import metrics
+from worker import encoding
+from config import METRICS_PORT, METRICS_FILE, METRICS_DUMP_INTERVAL, WORKER_METRICS_PATH
+# Общее для bot.py и async_bot.py: меню, спаршенные изображения чата, file_id отправленных файлов и метрики отправки.
+# Импорт модуля ничего не создает: ни бота, ни папок, ни баз — их создает каждый бот сам
+
+# Метрики отправки в Telegram
+SEND_SECONDS = metrics.histogram('telegram_send_seconds', 'Duration of uploads to Telegram')
+SEND_ERRORS = metrics.counter('telegram_send_errors_total', 'Failed uploads to Telegram')
+SENT_BYTES = metrics.counter('telegram_sent_bytes_total', 'Bytes of the files uploaded to Telegram')
+SENT_FILES = metrics.counter('telegram_sent_files_total', 'Files uploaded to Telegram')
+REUSED_FILES = metrics.counter('telegram_reused_files_total', 'Files sent by a cached file_id without an upload')
+
+def start_metrics():
+    # Метрики записываются, только если задан порт HTTP-сервера или файл для них
+    if METRICS_PORT is not None:
+        metrics.enable()
+        metrics.serve(METRICS_PORT)
+    if METRICS_FILE is not None:
+        metrics.enable()
+        metrics.dump_periodically(METRICS_FILE, METRICS_DUMP_INTERVAL)
+    if metrics.is_enabled():
+        # Метрики парсинга и операций записывают рабочие процессы, файлы остановленных процессов удаляются
+        metrics.collect(WORKER_METRICS_PATH, METRICS_DUMP_INTERVAL * 4)
+
+def count_sent(method, photos, cached=None):
+    # Считаются только загруженные файлы, отправленные по file_id — отдельно
+    if metrics.is_enabled():
+        uploaded = [photo for photo, file_id in zip(photos, cached or [None] * len(photos)) if file_id is None]
+        SENT_FILES.inc(len(uploaded), method=method)
+        SENT_BYTES.inc(sum(os.path.getsize(photo) for photo in uploaded), method=method)
+        REUSED_FILES.inc(len(photos) - len(uploaded), method=method)
+
+def cached_file_ids(file_ids, paths, variant):
+    # Хэши содержимого файлов и их file_id ('photo' или 'document'), None — файл еще не загружался
+    digests = [file_ids.digest(path) for path in paths]
+    return digests, [file_ids.get(digest, variant) for digest in digests]
+
+def remember_file_ids(file_ids, digests, cached, messages, variant):
+    # Telegram возвращает file_id загруженного файла в отправленном сообщении, у фото — для каждого размера
+    for digest, file_id, sent in zip(digests, cached, messages):
+        if file_id is None:
+            file_ids.put(digest, variant, sent.photo[-1].file_id if variant == 'photo' else sent.document.file_id)
+
+def forget_file_ids(file_ids, digests, cached, variant):
+    for digest, file_id in zip(digests, cached):
+        if file_id is not None:
+            file_ids.forget(digest, variant)
+
+def user_menu():
+    markup = types.ReplyKeyboardMarkup(one_time_keyboard=True)
+    markup.add('Выбрать изображение','Поменять ссылку')
+    return markup
+
+def PTL_menu():
+    markup = types.ReplyKeyboardMarkup(one_time_keyboard=True)
+    markup.add('Повернуть изображение', 'Отзеркалить','Обрезать',\
+               'Изменить размер', 'Сделать чёрно-белым', 'Преобразовать в цветовой диапазон',\
+                'Размытие', 'Увеличьте резкость', 'Сглаживание', 'Найти рёбра',\
+                'Яркость',  'Добавить текст', 'Оригинал', 'Главное меню')
+    return markup
+
+def get_photos(photos_path):
+    # Возвращает пути к превью (или к оригиналам, если превью нет) и папки изображений
+    photos = []
+    paths = []
+    if not os.path.exists(photos_path):
+        return photos, paths
+    for photo_folder in os.listdir(photos_path):
+        if not os.path.isdir(photos_path + "/" + photo_folder):
+            continue
+        try:
+            int(photo_folder[:3])
+            for photo in os.listdir(photos_path + "/" + photo_folder):
+                if photo.startswith("default"):
+                    paths.append(photos_path + "/" + photo_folder)
+                    preview = photos_path + "/" + photo_folder + "/preview." + encoding.preview_format
+                    photo = photos_path + "/" + photo_folder + "/" + photo
+                    photos.append(preview if os.path.exists(preview) else photo)
+                    
+        except Exception as e:
+            print(e)
+    return photos, paths
@@ -0,0 +1,125 @@
+CHANELS = ('r', 'g', 'b')
+
+
+def _to_rgb(image):
+    # Alpha is dropped and grayscale or palette images get three channels, like the rest of the color operations
+    return image if image.mode == 'RGB' else image.convert('RGB')
+
+
+def _clip(value):
+    return 0 if value < 0 else 255 if value > 255 else int(value)
+
+
+def _apply_table(image, table):
+    # One lookup table applied to every color channel, alpha channel is kept as is.
+    # Image.point() maps all the pixels in C, in a single pass over the image
+    if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        image = image.convert('RGB')
+    bands = image.getbands()
+    lut = []
+    for band in bands:
+        lut.extend(range(256) if band == 'A' else table)
+    return image.point(lut)
+
+
+def isolate_chanel(image, chanel):
+    """
+    Keep only one color channel of the image, the other ones are set to zero.
+
+    Args:
+        image (PIL.Image.Image): The source image.
+        chanel (str): The channel to keep. Possible values are 'r', 'g', 'b'.
+
+    Returns:
+        PIL.Image.Image: The RGB image with the single channel.
+    """
+    index = CHANELS.index(chanel)
+    lut = [0] * 768
+    lut[256 * index:256 * (index + 1)] = range(256)
+    return _to_rgb(image).point(lut)
+
+
+def isolate_all_chanels(image):
+    """
+    Isolate every color channel of the image, converting the image to RGB only once.
+
+    Args:
+        image (PIL.Image.Image): The source image.
+
+    Returns:
+        dict: The RGB images with the single channel keyed by 'r', 'g' and 'b'.
+    """
+    image = _to_rgb(image)
+    return {chanel: isolate_chanel(image, chanel) for chanel in CHANELS}
+
+
+def brightness(image, scale_value):
+    """
+    Adjust the brightness of the image. The result is the same as of PIL.ImageEnhance.Brightness.
+
+    Args:
+        image (PIL.Image.Image): The source image.
+        scale_value (float): Values greater than 1.0 increase brightness, values between 0.0 and 1.0 decrease it.
+
+    Returns:
+        PIL.Image.Image: The adjusted image.
+    """
+    return _apply_table(image, [_clip(i * scale_value) for i in range(256)])
+
+
+def contrast(image, scale_value):
+    """
+    Adjust the contrast of the image. The result is the same as of PIL.ImageEnhance.Contrast.
+
+    Args:
+        image (PIL.Image.Image): The source image.
+        scale_value (float): Values greater than 1.0 increase contrast, values between 0.0 and 1.0 decrease it.
+
+    Returns:
+        PIL.Image.Image: The adjusted image.
+    """
+    # The pixels are moved away from (or towards) the mean gray level of the image
+    histogram = image.convert('L').histogram()
+    mean = int(sum(i * count for i, count in enumerate(histogram)) / max(1, sum(histogram)) + 0.5)
+    return _apply_table(image, [_clip(mean + (i - mean) * scale_value) for i in range(256)])
+
+
+def gamma(image, gamma_value):
+    """
+    Apply gamma correction to the image.
+
+    Args:
+        image (PIL.Image.Image): The source image.
+        gamma_value (float): Values greater than 1.0 brighten the midtones, values between 0.0 and 1.0 darken them.
+
+    Returns:
+        PIL.Image.Image: The corrected image.
+    """
+    return levels(image, 0, 255, gamma_value)
+
+
+def levels(image, black=0, white=255, gamma_value=1.0):
+    """
+    Stretch the tonal range of the image: black and white input levels become 0 and 255.
+
+    Args:
+        image (PIL.Image.Image): The source image.
+        black (int, optional): The input level mapped to black. Defaults to 0.
+        white (int, optional): The input level mapped to white. Defaults to 255.
+        gamma_value (float, optional): The gamma correction of the midtones. Defaults to 1.0.
+
+    Returns:
+        PIL.Image.Image: The adjusted image.
+
+    Raises:
+        ValueError: If black is not less than white or gamma_value is not positive.
+    """
+    if black >= white:
+        raise ValueError('Black level must be less than white level')
+    if gamma_value <= 0:
+        raise ValueError('Gamma must be positive')
+    table = []
+    for i in range(256):
+        value = min(1.0, max(0.0, (i - black) / (white - black)))
+        table.append(_clip(255 * value ** (1 / gamma_value) + 0.5))
+    return _apply_table(image, table)
@@ -1,2 +1,41 @@
 
-PHOTOS_PATH = 'images/parsed_images'
\ No newline at end of file
+PHOTOS_PATH = 'images/parsed_images'
+
+# Папки чатов: у каждого чата свои спаршенные изображения и выбранное изображение
+WORKSPACES_PATH = 'images/chats'
+# Через сколько секунд бездействия папка чата удаляется
+WORKSPACE_IDLE_TIMEOUT = 60 * 60
+# Кэш результатов операций: одна и та же операция над одним изображением выполняется один раз
+RESULTS_PATH = 'images/results'
+RESULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Количество потоков обработки сообщений (в асинхронном боте — потоков обработки изображений)
+BOT_THREADS = 4
+# Метрики в формате Prometheus: порт HTTP-сервера (http://127.0.0.1:порт/metrics) и/или файл,
+# который перезаписывается каждые METRICS_DUMP_INTERVAL секунд. None — метрики выключены
+METRICS_PORT = None
+METRICS_FILE = None
+METRICS_DUMP_INTERVAL = 15
+# Рабочие процессы пишут свои метрики в эту папку, бот добавляет их к своим (на порт и в METRICS_FILE)
+WORKER_METRICS_PATH = 'images/metrics'
+# Кодирование результатов и превью: качество JPEG, формат превью ('jpeg', 'webp' или 'avif', для avif нужен
+# pillow-avif-plugin) и предельный размер фотографии, до которого снижается качество (Telegram принимает фото до 10 МБ)
+JPEG_QUALITY = 75
+PREVIEW_FORMAT = 'jpeg'
+MAX_PHOTO_BYTES = 10 * 1024 * 1024
+# Ограничения памяти обработки: изображения больше IMAGE_MAX_PIXELS пикселей уменьшаются при загрузке,
+# операция, которой не хватает OPERATION_MAX_BYTES байт памяти, отвечает ошибкой. Пик памяти — около BOT_THREADS бюджетов
+IMAGE_MAX_PIXELS = 50_000_000
+OPERATION_MAX_BYTES = 1024 * 1024 * 1024
+# file_id загруженных в Telegram файлов по хэшу содержимого: неизмененное изображение повторно не загружается
+FILE_IDS_PATH = 'images/file_ids.sqlite3'
+# Обход нескольких страниц по ссылкам (пагинация, страницы товаров): глубина в ссылках от присланной страницы,
+# максимум страниц и запросов страниц к одному сайту в секунду. 0 — парсится только присланная страница
+CRAWL_MAX_DEPTH = 0
+CRAWL_MAX_PAGES = 20
+CRAWL_REQUESTS_PER_SECOND = 2.0
+# Очередь задач: парсинг и обработка изображений выполняются рабочими процессами, бот только ставит задачи и
+# сообщает результат. JOB_WORKERS — процессы, которые бот запускает сам (еще можно запустить python worker.py),
+# JOB_CONCURRENCY — сколько задач каждого вида выполняется одновременно всеми процессами
+JOBS_PATH = 'images/jobs.sqlite3'
+JOB_WORKERS = {'scrape': 2, 'operation': 2}
+JOB_CONCURRENCY = {'scrape': 4, 'operation': 4}
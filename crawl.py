@@ -0,0 +1,210 @@
+from urllib.parse import urlsplit, urlunsplit, urldefrag
+import asyncio
+import time
+import re
+
+
+# Defaults of the crawl mode
+CRAWL_MAX_DEPTH = 1
+CRAWL_MAX_PAGES = 20
+# Page requests to one host per second
+CRAWL_REQUESTS_PER_SECOND = 2.0
+# Pages fetched at the same time
+CRAWL_PAGE_CONCURRENCY = 4
+
+
+def normalize_url(url):
+    """
+    Normalize the page URL, so the same page is not crawled twice under different spellings.
+
+    The fragment is removed, the scheme and the host are lowercased, the default port is dropped
+    and an empty path becomes '/'. The query string is kept: it often selects the page of a catalogue.
+
+    Args:
+        url (str): The absolute URL.
+
+    Returns:
+        str: The normalized URL.
+    """
+    parts = urlsplit(urldefrag(url.strip())[0])
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rpartition(':')[2]) in (('http', '80'), ('https', '443')):
+        netloc = netloc.rpartition(':')[0]
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def _site(host):
+    # www.example.com and example.com are the same site
+    return host[4:] if host.startswith('www.') else host
+
+
+class CrawlPolicy:
+    """
+    Settings of the multi-page crawl: which links are followed and how fast.
+
+    The crawl starts at the given page and follows its <a href> links breadth-first up to max_depth links away,
+    fetching at most max_pages pages. A link is followed if it is on the same site as the start page after
+    redirects (when same_domain is set; www. is ignored), matches one of the include patterns (if there are any)
+    and none of the exclude patterns. The patterns are regular expressions searched in the normalized URL.
+
+    Args:
+        max_depth (int, optional): How many links away from the start page are crawled, 0 fetches only the start
+                                   page. Defaults to CRAWL_MAX_DEPTH.
+        max_pages (int, optional): The maximum number of fetched pages, including the start page.
+                                   Defaults to CRAWL_MAX_PAGES.
+        same_domain (bool, optional): Follow only the links to the site of the start page. Defaults to True.
+        include (list of str, optional): Follow only the links matching one of these patterns. Defaults to None.
+        exclude (list of str, optional): Do not follow the links matching any of these patterns. Defaults to None.
+        requests_per_second (float, optional): The maximum rate of page requests to one host.
+                                               Defaults to CRAWL_REQUESTS_PER_SECOND.
+        concurrency (int, optional): The number of pages fetched at the same time. Defaults to CRAWL_PAGE_CONCURRENCY.
+    """
+
+    def __init__(self, max_depth=CRAWL_MAX_DEPTH, max_pages=CRAWL_MAX_PAGES, same_domain=True, include=None,
+                 exclude=None, requests_per_second=CRAWL_REQUESTS_PER_SECOND, concurrency=CRAWL_PAGE_CONCURRENCY):
+        if max_depth < 0 or max_pages < 1 or concurrency < 1 or requests_per_second <= 0:
+            raise ValueError('Invalid crawl limits')
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.same_domain = same_domain
+        self.include = [re.compile(pattern) for pattern in include or ()]
+        self.exclude = [re.compile(pattern) for pattern in exclude or ()]
+        self.requests_per_second = requests_per_second
+        self.concurrency = concurrency
+
+    def allows(self, url, start_url):
+        """
+        Check if the link should be followed.
+
+        Args:
+            url (str): The normalized link.
+            start_url (str): The normalized URL of the start page.
+
+        Returns:
+            bool: True if the link passes the domain and pattern filters.
+        """
+        if not url.startswith(('http://', 'https://')):
+            return False
+        if self.same_domain and _site(urlsplit(url).hostname or '') != _site(urlsplit(start_url).hostname or ''):
+            return False
+        if self.include and not any(pattern.search(url) for pattern in self.include):
+            return False
+        return not any(pattern.search(url) for pattern in self.exclude)
+
+
+# A single page crawl, as scrape_and_save_images() has always done
+SINGLE_PAGE = CrawlPolicy(max_depth=0, max_pages=1, concurrency=1)
+
+
+class Frontier:
+    """
+    The queue of pages to crawl. Every page is queued once, and no more than max_pages pages are ever queued,
+    so the frontier does not grow with the number of links on the pages. The links are filtered against the site
+    of the start page after redirects, see redirected().
+
+    Args:
+        start_url (str): The first page, it is queued at depth 0 regardless of the filters.
+        policy (CrawlPolicy): The limits and the filters of the crawl.
+    """
+
+    def __init__(self, start_url, policy):
+        self.policy = policy
+        self.start_url = normalize_url(start_url)
+        # The start page as it was actually served, the same site filter compares the links with it
+        self.final_url = self.start_url
+        self._seen = set()
+        self._queue = asyncio.Queue()
+        self._push(self.start_url, 0)
+
+    def redirected(self, final_url):
+        """
+        Record where the start page was redirected, e.g. from example.com to shop.example.com. Its links are
+        then compared with the site of the final page, and the final page itself is not crawled again.
+
+        Args:
+            final_url (str): The URL of the start page after redirects.
+        """
+        self.final_url = normalize_url(final_url)
+        self._seen.add(self.final_url)
+
+    def _push(self, url, depth):
+        self._seen.add(url)
+        self._queue.put_nowait((url, depth))
+
+    def add(self, url, depth):
+        """
+        Queue the page unless it was queued before, is too deep, does not pass the filters or the page limit is reached.
+
+        Args:
+            url (str): The absolute link.
+            depth (int): The number of links from the start page.
+
+        Returns:
+            bool: True if the page was queued.
+        """
+        if depth > self.policy.max_depth or len(self._seen) >= self.policy.max_pages:
+            return False
+        url = normalize_url(url)
+        if url in self._seen or not self.policy.allows(url, self.final_url):
+            return False
+        self._push(url, depth)
+        return True
+
+    def is_full(self):
+        """
+        Returns:
+            bool: True if no more pages can be queued.
+        """
+        return len(self._seen) >= self.policy.max_pages
+
+    async def get(self):
+        """
+        Wait for the next page.
+
+        Returns:
+            tuple: (url, depth).
+        """
+        return await self._queue.get()
+
+    def task_done(self):
+        """
+        Mark the page returned by get() as processed, its links are already added.
+        """
+        self._queue.task_done()
+
+    async def join(self):
+        """
+        Wait until every queued page is processed.
+        """
+        await self._queue.join()
+
+
+class HostRateLimiter:
+    """
+    Spaces the requests to one host at least 1 / requests_per_second seconds apart. Requests to different hosts
+    are not delayed by each other.
+
+    Args:
+        requests_per_second (float): The maximum request rate per host.
+    """
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        # The time of the last reserved request of every host
+        self._next = {}
+
+    async def wait(self, url):
+        """
+        Wait for the turn of the request.
+
+        Args:
+            url (str): The requested URL, its host is rate limited.
+        """
+        host = urlsplit(url).netloc.lower()
+        now = time.monotonic()
+        # The slot is reserved before sleeping, so concurrent requests queue up one interval apart
+        slot = max(now, self._next.get(host, now - self.interval) + self.interval)
+        self._next[host] = slot
+        if slot > now:
+            await asyncio.sleep(slot - now)
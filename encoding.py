@@ -0,0 +1,204 @@
+from PIL import Image, ImageChops
+import io
+
+try:
+    # AVIF is not built into Pillow 11, the plugin registers the format on import
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+
+# Default settings of the encoders, Pillow itself saves baseline JPEG of quality 75 without Huffman table optimization
+JPEG_QUALITY = 75
+JPEG_SUBSAMPLING = '4:2:0'
+PNG_COMPRESS_LEVEL = 6
+PREVIEW_QUALITY = 85
+# The quality is never lowered below this value to fit max_bytes
+MIN_QUALITY = 40
+
+# Pillow format names by file extension
+FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'avif': 'AVIF'}
+# Formats with a quality setting, only they can be shrunk to max_bytes
+LOSSY_FORMATS = ('JPEG', 'WEBP', 'AVIF')
+
+
+def is_supported(extension):
+    """
+    Check if images can be saved with the extension by the installed Pillow.
+
+    Args:
+        extension (str): The file extension, e.g. 'webp'.
+
+    Returns:
+        bool: True if the format is known and its encoder is available.
+    """
+    image_format = FORMATS.get(extension.lower())
+    if image_format is None:
+        return False
+    Image.init()
+    return image_format in Image.SAVE
+
+
+class EncodingPolicy:
+    """
+    Encoder settings of the saved images.
+
+    JPEG is saved with optimized Huffman tables with the given quality and chroma subsampling, which is about 5%
+    smaller than Pillow defaults at the same quality. Progressive JPEG is off by default: it is at most 2% smaller
+    but 2-3 times slower to encode, both on full size photos and on previews. PNG is saved losslessly with the given
+    compression level, and flat RGB images (at most 256 colors, e.g. screenshots, charts, the single chanel results)
+    are stored with an exact palette, which is about half the size. With max_bytes the quality of
+    JPEG, WebP and AVIF images is lowered by a binary search until the file fits, e.g. into the upload limit
+    of Telegram; PNG images are lossless and are saved as is.
+
+    Args:
+        jpeg_quality (int, optional): The JPEG quality, 1-95. Defaults to JPEG_QUALITY.
+        jpeg_optimize (bool, optional): Compute optimal Huffman tables. Defaults to True.
+        jpeg_progressive (bool, optional): Save progressive JPEG. Defaults to False.
+        jpeg_subsampling (str, optional): The chroma subsampling, '4:4:4', '4:2:2' or '4:2:0'. Defaults to JPEG_SUBSAMPLING.
+        png_compress_level (int, optional): The zlib compression level, 0-9. Defaults to PNG_COMPRESS_LEVEL.
+        png_quantize (bool, optional): Store flat RGB images with a palette. Defaults to True.
+        preview_format (str, optional): The extension of the previews, 'jpeg', 'webp' or 'avif'. Falls back to 'jpeg'
+                                        if the encoder is not available (AVIF needs pillow-avif-plugin). Defaults to 'jpeg'.
+        preview_quality (int, optional): The quality of the previews. Defaults to PREVIEW_QUALITY.
+        max_bytes (int, optional): The maximum size of lossy images in bytes. Defaults to None, which does not limit it.
+        min_quality (int, optional): The lowest quality used to fit max_bytes. Defaults to MIN_QUALITY.
+    """
+
+    def __init__(self, jpeg_quality=JPEG_QUALITY, jpeg_optimize=True, jpeg_progressive=False,
+                 jpeg_subsampling=JPEG_SUBSAMPLING, png_compress_level=PNG_COMPRESS_LEVEL, png_quantize=True,
+                 preview_format='jpeg', preview_quality=PREVIEW_QUALITY, max_bytes=None, min_quality=MIN_QUALITY):
+        if preview_format not in FORMATS or FORMATS[preview_format] == 'PNG':
+            raise ValueError(f'Unknown preview format {preview_format}')
+        self.jpeg_quality = jpeg_quality
+        self.jpeg_optimize = jpeg_optimize
+        self.jpeg_progressive = jpeg_progressive
+        self.jpeg_subsampling = jpeg_subsampling
+        self.png_compress_level = png_compress_level
+        self.png_quantize = png_quantize
+        self.preview_format = preview_format if is_supported(preview_format) else 'jpeg'
+        self.preview_quality = preview_quality
+        self.max_bytes = max_bytes
+        self.min_quality = min(min_quality, jpeg_quality, preview_quality)
+
+    def key(self):
+        """
+        Get the settings that affect the encoded files, e.g. for the keys of cached results.
+
+        Returns:
+            tuple: The settings.
+        """
+        return (self.jpeg_quality, self.jpeg_optimize, self.jpeg_progressive, self.jpeg_subsampling,
+                self.png_compress_level, self.png_quantize, self.max_bytes, self.min_quality)
+
+    def options(self, image_format, quality=None):
+        """
+        Get the keyword arguments of Image.save() for the format.
+
+        Args:
+            image_format (str): The Pillow format name, e.g. 'JPEG'.
+            quality (int, optional): Overrides the quality of lossy formats. Defaults to None.
+
+        Returns:
+            dict: The save options.
+        """
+        if image_format == 'JPEG':
+            return {'quality': quality or self.jpeg_quality, 'optimize': self.jpeg_optimize,
+                    'progressive': self.jpeg_progressive, 'subsampling': self.jpeg_subsampling}
+        if image_format == 'PNG':
+            return {'compress_level': self.png_compress_level}
+        if image_format == 'WEBP':
+            return {'quality': quality or self.preview_quality, 'method': 4}
+        if image_format == 'AVIF':
+            return {'quality': quality or self.preview_quality}
+        return {}
+
+    def _prepare(self, image, image_format):
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+            return image.convert('RGB')
+        if image_format == 'PNG' and self.png_quantize and image.mode == 'RGB':
+            # getcolors() gives up as soon as it finds more colors, so photos are rejected quickly
+            colors = image.getcolors(256)
+            if colors is not None:
+                # With at least as many palette entries as colors every color gets its own entry. Mapping to a given
+                # palette is not used: Pillow looks colors up with reduced precision and merges close ones
+                quantized = image.quantize(len(colors), method=Image.Quantize.MAXCOVERAGE, dither=Image.Dither.NONE)
+                if ImageChops.difference(quantized.convert('RGB'), image).getbbox() is None:
+                    return quantized
+        return image
+
+    def encode(self, image, image_format, quality=None):
+        """
+        Encode the image in memory.
+
+        Args:
+            image (PIL.Image.Image): The image.
+            image_format (str): The Pillow format name, e.g. 'JPEG'.
+            quality (int, optional): Overrides the quality of lossy formats. Defaults to None.
+
+        Returns:
+            bytes: The encoded image.
+        """
+        buffer = io.BytesIO()
+        self._prepare(image, image_format).save(buffer, image_format, **self.options(image_format, quality))
+        return buffer.getvalue()
+
+    def _fit(self, image, image_format, quality):
+        # The highest quality whose result fits max_bytes, or the lowest allowed one if none of them fits
+        data = self.encode(image, image_format, quality)
+        if self.max_bytes is None or len(data) <= self.max_bytes:
+            return data
+        low, high = self.min_quality, quality - 1
+        best = None
+        while low <= high:
+            middle = (low + high) // 2
+            candidate = self.encode(image, image_format, middle)
+            if len(candidate) <= self.max_bytes:
+                best, low = candidate, middle + 1
+            else:
+                high = middle - 1
+        return best if best is not None else self.encode(image, image_format, self.min_quality)
+
+    def save(self, image, path, quality=None):
+        """
+        Save the image, its format is selected by the extension of the path.
+
+        Args:
+            image (PIL.Image.Image): The image.
+            path (str): The path to the file.
+            quality (int, optional): The quality of lossy formats. Defaults to None, which uses jpeg_quality
+                                     for JPEG and preview_quality for WebP and AVIF.
+
+        Returns:
+            str: The path to the file.
+        """
+        image_format = FORMATS.get(path.rsplit('.', 1)[-1].lower())
+        if image_format is None:
+            # Unknown extensions are left to Pillow
+            image.save(path)
+            return path
+        if image_format == 'JPEG':
+            quality = quality or self.jpeg_quality
+        elif image_format in LOSSY_FORMATS:
+            quality = quality or self.preview_quality
+        if self.max_bytes is None or image_format not in LOSSY_FORMATS:
+            # Without the size search the image is encoded straight to the file, not kept encoded in memory
+            self._prepare(image, image_format).save(path, image_format, **self.options(image_format, quality))
+            return path
+        data = self._fit(image, image_format, quality)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def save_preview(self, image, path):
+        """
+        Save the preview with preview_quality.
+
+        Args:
+            image (PIL.Image.Image): The downscaled image.
+            path (str): The path to the preview, normally ending with preview_format.
+
+        Returns:
+            str: The path to the preview.
+        """
+        return self.save(image, path, self.preview_quality)
@@ -0,0 +1,51 @@
+from collections import OrderedDict
+import threading
+import hashlib
+import os
+
+
+# The number of files whose content hashes are remembered
+DIGESTS_MAX_ENTRIES = 4096
+
+
+class FileDigests:
+    """
+    Bounded LRU memo of the SHA-256 of file contents.
+
+    A file is hashed once for every version of it: the entries are keyed by the absolute path together with
+    the modification time and the size, so a changed file is hashed again. The memo is thread-safe.
+
+    Args:
+        max_entries (int, optional): The number of remembered files. Defaults to DIGESTS_MAX_ENTRIES.
+    """
+
+    def __init__(self, max_entries=DIGESTS_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Get the SHA-256 of the file content.
+
+        Args:
+            path (str): The path to the file.
+
+        Returns:
+            str: The hex digest.
+        """
+        stat = os.stat(path)
+        version = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._digests.get(version)
+            if digest is not None:
+                self._digests.move_to_end(version)
+                return digest
+        # The file is hashed without the lock, other threads are not held up
+        with open(path, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        with self._lock:
+            self._digests[version] = digest
+            if len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+        return digest
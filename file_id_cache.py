@@ -0,0 +1,129 @@
+from file_digests import FileDigests
+import threading
+import sqlite3
+import time
+import os
+
+
+# The number of file_ids kept in the database, the least recently used ones are removed
+FILE_IDS_MAX_ENTRIES = 100_000
+
+
+class FileIdCache:
+    """
+    Persistent map from the content of sent files to their Telegram file_ids.
+
+    Telegram returns a file_id for every uploaded file, and sending the file_id instead of the file makes Telegram
+    reuse the upload. The ids are keyed by the SHA-256 of the file content and the variant of the upload ('photo'
+    or 'document' — a photo file_id cannot be sent as a document and vice versa), so an unchanged image is uploaded
+    only once whatever it is called and in whatever chat it is sent. The map is stored in SQLite and survives
+    restarts of the bot.
+
+    Args:
+        path (str, optional): The SQLite database file. Defaults to 'images/file_ids.sqlite3'.
+        max_entries (int, optional): The maximum number of stored file_ids. Defaults to FILE_IDS_MAX_ENTRIES.
+        digests (FileDigests, optional): The memo of file hashes, can be shared with the other caches of the same
+                                         files. Defaults to None, which creates a new one.
+    """
+
+    def __init__(self, path='images/file_ids.sqlite3', max_entries=FILE_IDS_MAX_ENTRIES, digests=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._digests = digests if digests is not None else FileDigests()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # The connection is shared by the threads of the bot, the lock serializes the queries
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS file_ids (sha256 TEXT NOT NULL, variant TEXT NOT NULL, '
+                                 'file_id TEXT NOT NULL, used REAL NOT NULL, PRIMARY KEY (sha256, variant))')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS file_ids_used ON file_ids (used)')
+
+    def digest(self, path):
+        """
+        Get the SHA-256 of the file content. It is computed once for every version (modification time and size) of the file.
+
+        Args:
+            path (str): The path to the file.
+
+        Returns:
+            str: The hex digest.
+        """
+        return self._digests.get(path)
+
+    def get(self, digest, variant):
+        """
+        Get the file_id of the uploaded file.
+
+        Args:
+            digest (str): The SHA-256 of the file content returned by digest().
+            variant (str): The kind of the upload, e.g. 'photo' or 'document'.
+
+        Returns:
+            str or None: The file_id, or None if the file has not been uploaded yet.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT file_id FROM file_ids WHERE sha256 = ? AND variant = ?',
+                                           (digest, variant)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute('UPDATE file_ids SET used = ? WHERE sha256 = ? AND variant = ?',
+                                     (time.time(), digest, variant))
+            return row[0]
+
+    def put(self, digest, variant, file_id):
+        """
+        Remember the file_id of the uploaded file.
+
+        Args:
+            digest (str): The SHA-256 of the file content returned by digest().
+            variant (str): The kind of the upload, e.g. 'photo' or 'document'.
+            file_id (str): The file_id returned by Telegram.
+        """
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO file_ids (sha256, variant, file_id, used) '
+                                     'VALUES (?, ?, ?, ?)', (digest, variant, file_id, time.time()))
+            count = self._connection.execute('SELECT COUNT(*) FROM file_ids').fetchone()[0]
+            if count > self.max_entries:
+                self._connection.execute('DELETE FROM file_ids WHERE rowid IN '
+                                         '(SELECT rowid FROM file_ids ORDER BY used LIMIT ?)',
+                                         (count - self.max_entries,))
+
+    def forget(self, digest, variant):
+        """
+        Remove the file_id, e.g. after Telegram has rejected it.
+
+        Args:
+            digest (str): The SHA-256 of the file content returned by digest().
+            variant (str): The kind of the upload, e.g. 'photo' or 'document'.
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM file_ids WHERE sha256 = ? AND variant = ?', (digest, variant))
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        Returns:
+            dict: The number of hits and misses, the hit rate and the number of stored file_ids.
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'entries': self._connection.execute('SELECT COUNT(*) FROM file_ids').fetchone()[0],
+                'max_entries': self.max_entries,
+            }
+
+    def close(self):
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,320 @@
+import contextlib
+import hashlib
+import shutil
+import threading
+import json
+import time
+import uuid
+import re
+import os
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Default disk budget of the HTTP cache
+HTTP_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Body files that are not in the index are removed only when they have not been written for this many seconds:
+# another process may have stored them and not saved its index yet
+BODY_GRACE_PERIOD = 60 * 60
+
+
+def _parse_cache_control(value):
+    directives = {}
+    for directive in (value or '').split(','):
+        name, _, argument = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"')
+    return directives
+
+
+class HttpCache:
+    """
+    On-disk cache of HTTP responses with revalidation.
+
+    For every cached URL the response body is kept together with its validators (ETag and Last-Modified).
+    Cached responses are reused without a request while they are fresh according to Cache-Control max-age,
+    afterwards they are revalidated with a conditional request (If-None-Match / If-Modified-Since) and a
+    304 Not Modified response is served from the cache. The cache is limited by the total size of the bodies,
+    the least recently used responses are evicted first.
+
+    Several processes (e.g. the scrape workers) may share the directory. Every process keeps its own copy of
+    the index; save() and evict() hold a lock file while they merge it with the index on disk, so the responses
+    stored by the other processes are neither dropped from the index nor removed from the disk.
+
+    Args:
+        path (str, optional): The directory of the cache. Defaults to 'images/http_cache'.
+        max_bytes (int, optional): The disk budget in bytes. Defaults to HTTP_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, path='images/http_cache', max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bodies_path = os.path.join(path, 'bodies')
+        self.index_path = os.path.join(path, 'index.json')
+        self.lock_path = os.path.join(path, 'lock')
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.bodies_path, exist_ok=True)
+        self._entries = self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # The threads of the process are serialized by the lock, the processes sharing the directory by the lock file
+        with self._lock, open(self.lock_path, 'a+b') as f:
+            if fcntl is not None:
+                # The lock is released when the file is closed
+                fcntl.flock(f, fcntl.LOCK_EX)
+                yield
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _merge(self):
+        # Adds the entries stored by the other processes; of two versions of an entry the later stored one wins,
+        # then the later used one
+        for url, entry in self._read_index().items():
+            own = self._entries.get(url)
+            if own is None or (entry.get('stored', 0), entry['last_used']) > (own.get('stored', 0), own['last_used']):
+                self._entries[url] = entry
+
+    def _write_index(self):
+        temp_index = f'{self.index_path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_index, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(temp_index, self.index_path)
+
+    def body_path(self, url):
+        """
+        Get the path of the cached body of the URL.
+
+        Args:
+            url (str): The requested URL.
+
+        Returns:
+            str: The path to the body file.
+        """
+        return os.path.join(self.bodies_path, hashlib.sha256(url.encode()).hexdigest())
+
+    def lookup(self, url):
+        """
+        Get the cached response of the URL.
+
+        Args:
+            url (str): The requested URL.
+
+        Returns:
+            dict or None: The cache entry with the validators and the extra fields passed to store(),
+                          or None if the URL is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and not os.path.exists(self.body_path(url)):
+                del self._entries[url]
+                entry = None
+            return dict(entry) if entry is not None else None
+
+    @staticmethod
+    def is_fresh(entry):
+        """
+        Check if the cached response can be used without revalidation.
+
+        Args:
+            entry (dict): The cache entry returned by lookup().
+
+        Returns:
+            bool: True if the response has not expired yet.
+        """
+        return time.time() < entry['expires']
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        Get the headers of the conditional request revalidating the cached response.
+
+        Args:
+            entry (dict or None): The cache entry returned by lookup().
+
+        Returns:
+            dict: If-None-Match and If-Modified-Since headers, empty if there is nothing to revalidate.
+        """
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    @staticmethod
+    def _expires(headers):
+        cache_control = _parse_cache_control(headers.get('Cache-Control'))
+        if 'no-cache' in cache_control or 'must-revalidate' in cache_control and 'max-age' not in cache_control:
+            return 0
+        max_age = cache_control.get('s-maxage') or cache_control.get('max-age')
+        if max_age is not None and re.fullmatch(r'\d+', max_age):
+            return time.time() + int(max_age)
+        return 0
+
+    @staticmethod
+    def is_cacheable(headers):
+        """
+        Check if the response may be stored.
+
+        Args:
+            headers (Mapping): The response headers.
+
+        Returns:
+            bool: False for responses with Cache-Control no-store and for responses which
+                  neither have validators nor are fresh for some time.
+        """
+        cache_control = _parse_cache_control(headers.get('Cache-Control'))
+        if 'no-store' in cache_control:
+            return False
+        return bool(headers.get('ETag') or headers.get('Last-Modified') or HttpCache._expires(headers))
+
+    def store(self, url, headers, body_file, link=False, **extra):
+        """
+        Store the response.
+
+        Args:
+            url (str): The requested URL.
+            headers (Mapping): The response headers.
+            body_file (str): The path to the file with the response body.
+            link (bool, optional): Keep the body as a hard link to body_file instead of moving it. Defaults to False.
+            **extra: Additional JSON-serializable fields saved in the entry, e.g. the final URL or the charset.
+        """
+        body = self.body_path(url)
+        # Other processes may store the same URL at the same time
+        temp_body = f'{body}.{uuid.uuid4().hex}.tmp'
+        if link:
+            try:
+                os.link(body_file, temp_body)
+            except OSError:
+                shutil.copyfile(body_file, temp_body)
+        else:
+            shutil.move(body_file, temp_body)
+        os.replace(temp_body, body)
+        # Renaming a hard link onto another link of the same file does nothing, so the temporary link may remain
+        if os.path.exists(temp_body):
+            os.remove(temp_body)
+        now = time.time()
+        with self._lock:
+            self._entries[url] = {
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'expires': self._expires(headers),
+                'size': os.path.getsize(body),
+                'stored': now,
+                'last_used': now,
+                **extra,
+            }
+            self.misses += 1
+
+    def store_bytes(self, url, headers, body, **extra):
+        """
+        Store the response which body is kept in memory.
+
+        Args:
+            url (str): The requested URL.
+            headers (Mapping): The response headers.
+            body (bytes): The response body.
+            **extra: Additional JSON-serializable fields saved in the entry.
+        """
+        temp_body = f'{self.body_path(url)}.{uuid.uuid4().hex}.part.tmp'
+        with open(temp_body, 'wb') as f:
+            f.write(body)
+        self.store(url, headers, temp_body, **extra)
+
+    def refresh(self, url, headers=None):
+        """
+        Mark the cached response as used, e.g. after a 304 Not Modified response.
+
+        Args:
+            url (str): The requested URL.
+            headers (Mapping, optional): The headers of the 304 response, they update the validators and freshness.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return
+            entry['last_used'] = time.time()
+            if headers is not None:
+                entry['expires'] = self._expires(headers)
+                entry['etag'] = headers.get('ETag') or entry['etag']
+                entry['last_modified'] = headers.get('Last-Modified') or entry['last_modified']
+            self.hits += 1
+
+    def evict(self):
+        """
+        Remove the least recently used responses until the cache fits into max_bytes, save the index
+        and remove the body files which have not been in the index (of any process) for BODY_GRACE_PERIOD seconds.
+
+        Returns:
+            int: The number of removed responses.
+        """
+        with self._locked():
+            self._merge()
+            removed = 0
+            total = sum(entry['size'] for entry in self._entries.values())
+            for url, entry in sorted(self._entries.items(), key=lambda item: item[1]['last_used']):
+                if total <= self.max_bytes:
+                    break
+                total -= entry['size']
+                del self._entries[url]
+                removed += 1
+            self._write_index()
+            bodies = {os.path.basename(self.body_path(url)) for url in self._entries}
+            now = time.time()
+            for name in os.listdir(self.bodies_path):
+                if name in bodies:
+                    continue
+                # Also abandoned temporary files
+                body = os.path.join(self.bodies_path, name)
+                try:
+                    if now - os.stat(body).st_mtime > BODY_GRACE_PERIOD:
+                        os.remove(body)
+                except FileNotFoundError:
+                    pass
+            return removed
+
+    def save(self):
+        """
+        Atomically write the index of the cache to disk, merged with the entries saved by other processes.
+        """
+        with self._locked():
+            self._merge()
+            self._write_index()
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        Returns:
+            dict: The number of hits (fresh or revalidated responses) and misses, the number of entries and their size.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': sum(entry['size'] for entry in self._entries.values()),
+                'max_bytes': self.max_bytes,
+            }
@@ -1,5 +1,38 @@
-from PIL import Image, ImageFilter, ImageEnhance, ImageFont, ImageDraw
+from PIL import Image, ImageFilter, ImageFont, ImageDraw
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import threading
+import math
 import os
+import color_ops
+import metrics
+from encoding import EncodingPolicy
+
+
+# Default memory budget for decoded original images kept by ImageFormatter
+DECODED_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Previews are downscaled to fit this size, which is enough for Telegram photo messages
+PREVIEW_MAX_SIZE = 1280
+PREVIEW_FORMAT = 'jpeg'
+# Encoder settings of the formatters and previews created without their own EncodingPolicy
+DEFAULT_ENCODING = EncodingPolicy(preview_format=PREVIEW_FORMAT)
+# Images with more pixels are downscaled to this size on load
+MAX_PIXELS = 50_000_000
+# Memory budget of a single operation: the decoded source, its intermediate copies and the result
+OPERATION_MAX_BYTES = 1024 * 1024 * 1024
+# Convolution filters that do not fit into the budget are applied by tiles of this size (plus the margins)
+FILTER_TILE_SIZE = 1024
+
+
+# Metrics of the image operations, recorded only after metrics.enable()
+OPERATION_SECONDS = metrics.histogram('image_operation_seconds', 'Duration of ImageFormatter operations')
+OPERATION_ERRORS = metrics.counter('image_operation_errors_total', 'Failed ImageFormatter operations')
+OPERATION_BYTES = metrics.counter('image_operation_bytes_total', 'Bytes of the source (in) and result (out) images')
+
+
+# Outcome of an operation applied to a single image directory by ImageFormatter.batch().
+# Exactly one of result and error is set, error holds the raised exception (UnknownMode, ImageDirectoryNotSelected, ...)
+BatchResult = namedtuple('BatchResult', ['directory', 'result', 'error'])
 
 
 class ImageDirectoryNotSelected(Exception):
@@ -10,12 +43,178 @@ class UnknownMode(Exception):
     pass
 
 
+class ImageTooLarge(Exception):
+    pass
+
+
+def _image_bytes(size, mode):
+    # Memory occupied by the decoded pixels: Pillow keeps 1 byte per pixel for single-band 8-bit images,
+    # 2 for 16-bit ones and 4 for the rest, RGB included
+    if mode in ('1', 'L', 'P'):
+        pixel_bytes = 1
+    elif mode.startswith('I;16'):
+        pixel_bytes = 2
+    else:
+        pixel_bytes = 4
+    return size[0] * size[1] * pixel_bytes
+
+
+def create_preview(image_path, preview_path, max_size=PREVIEW_MAX_SIZE, encoding=None):
+    """
+    Create a downscaled copy of the image suitable for sending to Telegram.
+
+    Args:
+        image_path (str): The path to the source image.
+        preview_path (str): The path to the preview. Its extension selects the format, 'jpeg'/'jpg', 'webp' or 'avif'.
+        max_size (int, optional): The maximum width and height of the preview. Defaults to PREVIEW_MAX_SIZE.
+        encoding (EncodingPolicy, optional): The encoder settings. Defaults to None, which uses DEFAULT_ENCODING.
+
+    Returns:
+        str: The path to the preview.
+    """
+    with Image.open(image_path) as image:
+        # For JPEG images thumbnail() decodes only the needed resolution
+        image.thumbnail((max_size, max_size))
+        image.load()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+    # The preview appears only when it is written completely, the temporary file keeps the extension of the format
+    name, extension = os.path.splitext(preview_path)
+    temp_path = name + '.tmp' + extension
+    (encoding or DEFAULT_ENCODING).save_preview(image, temp_path)
+    os.replace(temp_path, preview_path)
+    return preview_path
+
+
+class DecodedImageCache:
+    """
+    Bounded LRU cache of decoded images.
+
+    Entries are keyed by the file path together with its modification time and size, so a changed file
+    is never served from the cache. JPEG images can also be kept decoded at a reduced resolution. The cache is limited by the approximate amount of memory occupied
+    by the decoded pixels, the least recently used images are evicted first.
+
+    Args:
+        max_bytes (int, optional): The memory budget in bytes. Defaults to DECODED_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, max_bytes=DECODED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, min_size=None):
+        """
+        Get the decoded image from the file, decoding it only if it is not cached yet.
+
+        Args:
+            path (str): The path to the image file.
+            min_size (tuple of int, optional): The smallest (width, height) the caller needs. If it is at most 1/2,
+                                               1/4 or 1/8 of a JPEG image, only the reduced resolution is decoded
+                                               (libjpeg DCT scaling). Defaults to None, which decodes the full image.
+
+        Returns:
+            PIL.Image.Image: The decoded image, at least min_size large. It is shared between callers and must not
+                             be modified in place.
+        """
+        stat = os.stat(path)
+        version = (path, stat.st_mtime_ns, stat.st_size)
+        # The smallest suitable decoded version is preferred, the full resolution one is always suitable
+        scales = (8, 4, 2, 1) if min_size is not None else (1,)
+        with self._lock:
+            for scale in scales:
+                key = version + (scale,)
+                image = self._entries.get(key)
+                if image is None or scale != 1 and (image.width < min_size[0] or image.height < min_size[1]):
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        with Image.open(path) as image:
+            full_width = image.width
+            if min_size is not None and image.format == 'JPEG':
+                image.draft(image.mode, (max(1, min_size[0]), max(1, min_size[1])))
+            image.load()
+        key = version + (max(1, round(full_width / image.width)),)
+
+        with self._lock:
+            # The file has changed, so the old versions of it are useless
+            self._invalidate(version)
+            size = _image_bytes(image.size, image.mode)
+            if size <= self.max_bytes:
+                if key in self._entries:
+                    old = self._entries.pop(key)
+                    self.current_bytes -= _image_bytes(old.size, old.mode)
+                self._entries[key] = image
+                self.current_bytes += size
+                while self.current_bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.current_bytes -= _image_bytes(evicted.size, evicted.mode)
+        return image
+
+    def _invalidate(self, version):
+        for key in [key for key in self._entries if key[0] == version[0] and key[:3] != version]:
+            old = self._entries.pop(key)
+            self.current_bytes -= _image_bytes(old.size, old.mode)
+
+    def invalidate(self, directory_path=None):
+        """
+        Remove cached images.
+
+        Args:
+            directory_path (str, optional): Remove only the images from this directory and its subdirectories.
+                                            Defaults to None, which removes all images.
+        """
+        with self._lock:
+            if directory_path is None:
+                self._entries.clear()
+                self.current_bytes = 0
+                return
+            directory_path = os.path.join(directory_path, '')
+            for key in [key for key in self._entries if key[0].startswith(directory_path)]:
+                removed = self._entries.pop(key)
+                self.current_bytes -= _image_bytes(removed.size, removed.mode)
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        Returns:
+            dict: The number of hits and misses, the number of cached images and the occupied memory in bytes.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
 
 class ImageFormatter:
-    def __init__(self, default_path='images/parsed_images'):
+    def __init__(self, default_path='images/parsed_images', image_cache=None, result_cache=None, encoding=None,
+                 max_pixels=MAX_PIXELS, max_memory_bytes=OPERATION_MAX_BYTES):
         self.default_path = default_path
         self.current_image_directory = None
         self.current_image_format = None
+        self.image_cache = image_cache if image_cache is not None else DecodedImageCache()
+        # Without the result cache every operation is computed and saved next to the default image
+        self.result_cache = result_cache
+        self.encoding = encoding if encoding is not None else DEFAULT_ENCODING
+        # Larger images are processed downscaled, operations that need more memory raise ImageTooLarge
+        self.max_pixels = max_pixels
+        self.max_memory_bytes = max_memory_bytes
 
         if not os.path.exists(self.default_path):
             os.makedirs(self.default_path)
@@ -35,7 +234,10 @@ class ImageFormatter:
         """
         if directory_path[-1] != '/':
             directory_path += '/'
+        if self.current_image_directory is not None and self.current_image_directory != directory_path:
+            self.image_cache.invalidate(self.current_image_directory)
         self.current_image_directory = directory_path
+        self.current_image_format = None
         for f in os.listdir(directory_path):
             if f.split('.')[0] == 'default':
                 self.current_image_format = f.split('.')[-1]
@@ -43,6 +245,306 @@ class ImageFormatter:
         if self.current_image_format is None:
             raise ImageDirectoryNotSelected(f'Cannot find default image in directory {directory_path}')
 
+    def _load_image(self, min_size=None):
+        # Images larger than max_pixels are downscaled on load, JPEG images are decoded right at a reduced resolution.
+        # The memory is checked by the image header before anything is decoded
+        path = self.current_image_directory + 'default.' + self.current_image_format
+        with Image.open(path) as image:
+            size, mode, image_format = image.size, image.mode, image.format
+        target = self._limited_size(size)
+        if target != size:
+            min_size = target if min_size is None else (min(min_size[0], target[0]), min(min_size[1], target[1]))
+        decoded_size = size
+        if image_format == 'JPEG' and min_size is not None:
+            # The scale DecodedImageCache gets from libjpeg with draft()
+            scale = min(size[0] // max(1, min_size[0]), size[1] // max(1, min_size[1]))
+            scale = next(factor for factor in (8, 4, 2, 1) if factor <= max(1, scale))
+            decoded_size = (math.ceil(size[0] / scale), math.ceil(size[1] / scale))
+        loaded_size = target if decoded_size[0] * decoded_size[1] > target[0] * target[1] else decoded_size
+        # The decoded image, its downscaled copy and the result of the operation
+        needed = _image_bytes(decoded_size, mode) + _image_bytes(loaded_size, mode)
+        if loaded_size != decoded_size:
+            needed += _image_bytes(loaded_size, mode)
+        self._check_memory(needed, f'Image {size[0]}x{size[1]}')
+
+        if target == size:
+            return self.image_cache.get(path, min_size)
+        # Oversized images are decoded past the cache, so only the downscaled copy stays in memory
+        with Image.open(path) as image:
+            if image_format == 'JPEG':
+                image.draft(image.mode, min_size)
+            image.load()
+        if image.width * image.height > target[0] * target[1]:
+            image = image.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        return image
+
+    def _limited_size(self, size):
+        # The size with the same aspect ratio and at most max_pixels pixels
+        if self.max_pixels is None or size[0] * size[1] <= self.max_pixels:
+            return size
+        scale = (self.max_pixels / (size[0] * size[1])) ** 0.5
+        return max(1, int(size[0] * scale)), max(1, int(size[1] * scale))
+
+    def _check_memory(self, needed, what):
+        if self.max_memory_bytes is not None and needed > self.max_memory_bytes:
+            raise ImageTooLarge(f'{what} needs about {needed // 2 ** 20} MiB, '
+                                f'the budget is {self.max_memory_bytes // 2 ** 20} MiB')
+
+    def _loaded_scale(self, image):
+        # Pixel coordinates of the original image are multiplied by it for an image downscaled on load
+        return image.width / self.get_image_size()[0]
+
+    def _save(self, image, name):
+        path = self.current_image_directory + name + '.' + self.current_image_format
+        return self.encoding.save(image, path)
+
+    def _output(self, name, key, render):
+        # Saves the image returned by render() as name.{format} next to the default image. With the result cache
+        # the result is looked up by the content of the default image and the key (the operation and its arguments)
+        # first, and render() is not called at all if the same operation has already been done. The encoder settings
+        # and the pixel limit are a part of the key, so changing them does not return files made with the old ones.
+        with OPERATION_SECONDS.time(OPERATION_ERRORS, operation=key[0]):
+            if self.result_cache is None:
+                path = self._save(render(), name)
+            else:
+                source = self.current_image_directory + 'default.' + self.current_image_format
+                path = self.result_cache.result_path(self.result_cache.source_digest(source), key[0],
+                                                     (key[1:], self.encoding.key(), self.max_pixels),
+                                                     self.current_image_format)
+                if not self.result_cache.lookup(path):
+                    self.result_cache.store(path, lambda result_path: self.encoding.save(render(), result_path))
+        self._count_bytes(key[0], path)
+        return path
+
+    def _count_bytes(self, operation, path):
+        if metrics.is_enabled():
+            source = self.current_image_directory + 'default.' + self.current_image_format
+            OPERATION_BYTES.inc(os.path.getsize(source), operation=operation, direction='in')
+            OPERATION_BYTES.inc(os.path.getsize(path), operation=operation, direction='out')
+
+    # In-memory operations. They are shared by the single-step methods below and ImagePipeline,
+    # and never modify the passed image in place unless it is stated explicitly.
+
+    def _to_rgb(self, image):
+        # Filters need RGB for png images (palette and alpha modes). The conversion is skipped
+        # if the image has already been converted, e.g. by the previous step of a pipeline.
+        if self.current_image_format == 'png' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+
+    @staticmethod
+    def _flip_axis(mode):
+        if mode == 'horizontal':
+            return Image.FLIP_LEFT_RIGHT
+        elif mode == 'vertical':
+            return Image.FLIP_TOP_BOTTOM
+        raise UnknownMode('Unknown flip mode')
+
+    @staticmethod
+    def _check_chanel(chanel):
+        if chanel != 'r' and chanel != 'g' and chanel != 'b':
+            raise UnknownMode('Unknown chanel')
+
+    @staticmethod
+    def _check_blur_type(blur_type):
+        if blur_type != 'box' and blur_type != 'gaussian':
+            raise UnknownMode('Unknown blur type')
+
+    def _rotate(self, image, angle):
+        return image.rotate(angle)
+
+    def _flip(self, image, axis):
+        return image.transpose(axis)
+
+    def _crop(self, image, top_margin_percent, left_margin_percent, right_margin_percent, bottom_margin_percent):
+        width, height = image.size
+        x = int(width * top_margin_percent / 100)
+        y = int(height * left_margin_percent / 100)
+        crop_width = int((100 - left_margin_percent - right_margin_percent) * width / 100)
+        crop_height = int((100 - top_margin_percent - bottom_margin_percent) * height / 100)
+        return image.crop((x, y, x + crop_width, y + crop_height))
+
+    def _crop_in_pixels(self, image, x_start, y_start, x_end, y_end):
+        width, height = x_end - x_start, y_end - y_start
+        return image.crop((x_start, y_start, width, height))
+
+    @staticmethod
+    def _resized_size(size, width_percent, height_percent):
+        return int(size[0] * width_percent / 100), int(size[1] * height_percent / 100)
+
+    def _resize(self, image, width_percent, height_percent, source_size=None):
+        # source_size is the size of the original image if the passed one has been decoded at a reduced resolution.
+        # Enlarged images are limited by max_pixels too
+        new_size = self._limited_size(self._resized_size(source_size or image.size, width_percent, height_percent))
+        self._check_memory(_image_bytes(image.size, image.mode) + _image_bytes(new_size, image.mode),
+                           f'Resizing to {new_size[0]}x{new_size[1]}')
+        if new_size[0] < image.width and new_size[1] < image.height:
+            # High quality resampling when shrinking, reducing_gap speeds it up for big reductions
+            return image.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        return image.resize(new_size)
+
+    def _load_resized(self, width_percent, height_percent):
+        # Decodes JPEG images only at the resolution needed for the resize (1/2, 1/4 or 1/8 of the original)
+        source_size = self.get_image_size()
+        image = self._load_image(self._resized_size(source_size, width_percent, height_percent))
+        return self._resize(image, width_percent, height_percent, source_size)
+
+    def _grayscale(self, image):
+        return image.convert('L')
+
+    def _chanel_convert(self, image, chanel):
+        return color_ops.isolate_chanel(image, chanel)
+
+    def _blur(self, image, blur_type, blur_radius):
+        # The margins are how far the filters reach: a box blur averages blur_radius + 1 pixels to each side,
+        # Pillow's gaussian blur is three box blurs of about the same radius. Both blur the columns in a transposed
+        # copy of the image, so they need one more full-size image than the kernel filters
+        if blur_type == 'box':
+            return self._convolve(image, ImageFilter.BoxBlur(radius=blur_radius), math.ceil(blur_radius) + 1, 3)
+        return self._convolve(image, ImageFilter.GaussianBlur(radius=blur_radius), 3 * math.ceil(blur_radius) + 3, 3)
+
+    def _filter(self, image, image_filter):
+        # SHARPEN, SMOOTH and FIND_EDGES are 3x3 kernels
+        return self._convolve(image, image_filter, image_filter.filterargs[0][0] // 2, 2)
+
+    def _convolve(self, image, image_filter, margin, copies):
+        # Applied to the whole image, a filter needs the source and its copies at once: the RGB conversion, the result
+        # and the temporary images of the filter. If they do not fit into max_memory_bytes, the filter is applied
+        # by overlapping tiles instead: every tile is cut with the margin the filter reaches, so the result is
+        # the same, and only the tile is converted and filtered
+        source_bytes = _image_bytes(image.size, image.mode)
+        result_bytes = _image_bytes(image.size, 'RGB')
+        if self.max_memory_bytes is None or source_bytes + copies * result_bytes <= self.max_memory_bytes:
+            return self._to_rgb(image).filter(image_filter)
+        tile_size = FILTER_TILE_SIZE + 2 * margin
+        self._check_memory(source_bytes + result_bytes + (copies + 1) * _image_bytes((tile_size, tile_size), 'RGB'),
+                           f'Filtering image {image.width}x{image.height}')
+        result = None
+        for top in range(0, image.height, FILTER_TILE_SIZE):
+            for left in range(0, image.width, FILTER_TILE_SIZE):
+                right, bottom = min(image.width, left + FILTER_TILE_SIZE), min(image.height, top + FILTER_TILE_SIZE)
+                box = (max(0, left - margin), max(0, top - margin),
+                       min(image.width, right + margin), min(image.height, bottom + margin))
+                tile = self._to_rgb(image.crop(box)).filter(image_filter)
+                if result is None:
+                    result = Image.new(tile.mode, image.size)
+                result.paste(tile.crop((left - box[0], top - box[1], right - box[0], bottom - box[1])), (left, top))
+        return result
+
+    def _brightness(self, image, scale_value):
+        return color_ops.brightness(self._to_rgb(image), scale_value)
+
+    def _contrast(self, image, scale_value):
+        return color_ops.contrast(self._to_rgb(image), scale_value)
+
+    def _levels(self, image, black, white, gamma_value):
+        return color_ops.levels(self._to_rgb(image), black, white, gamma_value)
+
+    def _watermark(self, image, watermark_path, position_percentage):
+        # Pastes the watermark in place
+        with Image.open(watermark_path) as watermark:
+            watermark = watermark.convert("RGBA")
+        image_width, image_height = image.size
+        watermark_width, watermark_height = watermark.size
+        x = int(image_width * position_percentage[0] / 100) - watermark_width
+        y = int(image_height * position_percentage[1] / 100) - watermark_height
+        image.paste(watermark, (x, y), watermark)
+        return image
+
+    def _text(self, image, text, x, y, font_size, color):
+        # Draws the text in place
+        font = ImageFont.load_default()
+        font = font.font_variant(size=font_size)
+        draw = ImageDraw.Draw(image)
+        draw.text((x, y), text, font=font, fill=color)
+        return image
+
+    def make_preview(self, max_size=PREVIEW_MAX_SIZE):
+        """
+        Create a downscaled preview of the current image for sending to Telegram.
+
+        Args:
+            max_size (int, optional): The maximum width and height of the preview. Defaults to PREVIEW_MAX_SIZE.
+
+        Returns:
+            str: The path to the preview.
+
+        Raises:
+            ImageDirectoryNotSelected: If the current image directory is not selected.
+        """
+        if self.current_image_directory is None:
+            raise ImageDirectoryNotSelected('Current image directory is not selected')
+
+        with OPERATION_SECONDS.time(OPERATION_ERRORS, operation='preview'):
+            path = create_preview(self.current_image_directory + 'default.' + self.current_image_format,
+                                  self.current_image_directory + 'preview.' + self.encoding.preview_format, max_size,
+                                  self.encoding)
+        self._count_bytes('preview', path)
+        return path
+
+    @staticmethod
+    def batch(operation, directories, *args, workers=None, default_path='images/parsed_images', **kwargs):
+        """
+        Apply an operation to many image directories in parallel worker processes.
+
+        Args:
+            operation (str or callable): The name of an ImageFormatter method, e.g. 'rotate_image', or a module-level
+                                         function taking the ImageFormatter with the selected directory as the first
+                                         argument. The arguments and the result must be picklable.
+            directories (iterable of str): The directories with the default images.
+            *args: Positional arguments passed to the operation.
+            workers (int, optional): The number of worker processes. Defaults to None, which uses the number of CPUs.
+            default_path (str, optional): The default path of the formatters in the workers.
+                                          Defaults to 'images/parsed_images'.
+            **kwargs: Keyword arguments passed to the operation.
+
+        Yields:
+            BatchResult: The outcome for every directory, in the order the images are finished.
+                         Errors are not raised, they are returned in the error field instead.
+
+        Examples:
+            >>> for directory, path, error in ImageFormatter.batch('rotate_image', directories, 90, workers=4):
+            ...     print(f'Image {directory} - {error}' if error else path)
+        """
+        directories = list(directories)
+        if not directories:
+            return
+        workers = min(workers or os.cpu_count() or 1, len(directories))
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = {
+                executor.submit(_run_batch_operation, default_path, directory, operation, args, kwargs): directory
+                for directory in directories
+            }
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    # The task could not be sent to or received from the worker, e.g. it is not picklable
+                    yield BatchResult(futures[future], None, e)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def pipeline(self):
+        """
+        Create a pipeline of operations on the current image.
+
+        The pipeline decodes the default image once, applies all the steps in memory and encodes the result once,
+        so a chain of N operations costs a single disk round-trip instead of N.
+
+        Returns:
+            ImagePipeline: The empty pipeline bound to the current image.
+
+        Raises:
+            ImageDirectoryNotSelected: If the current image directory is not selected.
+
+        Examples:
+            >>> formatter.pipeline().resize(50, 50).sharpen().watermark(WATERMARK_PATH, (100, 100)).save()
+        """
+        if self.current_image_directory is None:
+            raise ImageDirectoryNotSelected('Current image directory is not selected')
+        return ImagePipeline(self)
+
     def rotate_image(self, angle):
         """
         Rotate the current image by a specified angle.
@@ -56,14 +558,12 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            image = image.rotate(angle)
-            image.save(self.current_image_directory + 'rotated.' + self.current_image_format)
-        return self.current_image_directory + 'rotated.' + self.current_image_format
+        return self._output('rotated', ('rotate', angle % 360), lambda: self._rotate(self._load_image(), angle))
 
     def flip_image(self, mode='horizontal'):
         """
@@ -79,22 +579,14 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
             UnknownMode: If the flip mode is not recognized.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        if mode == 'horizontal':
-            axis = Image.FLIP_LEFT_RIGHT
-        elif mode == 'vertical':
-            axis = Image.FLIP_TOP_BOTTOM
-        else:
-            raise UnknownMode('Unknown flip mode')
-
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            image = image.transpose(axis)
-            image.save(self.current_image_directory + 'flipped' +  '.' + self.current_image_format)
-        return self.current_image_directory + 'flipped' + '.' + self.current_image_format
+        axis = self._flip_axis(mode)
+        return self._output('flipped', ('flip', mode), lambda: self._flip(self._load_image(), axis))
 
     def crop_image(self, top_margin_percent, left_margin_percent, right_margin_percent, bottom_margin_percent):
         """
@@ -111,19 +603,13 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            width, height = image.size
-            x = int(width * top_margin_percent / 100)
-            y = int(height * left_margin_percent / 100)
-            crop_width = int((100 - left_margin_percent - right_margin_percent) * width / 100)
-            crop_height = int((100 - top_margin_percent - bottom_margin_percent) * height / 100)
-            cropped_image = image.crop((x, y, x + crop_width, y + crop_height))
-            cropped_image.save(self.current_image_directory + 'cropped.' + self.current_image_format)
-        return self.current_image_directory + 'cropped.' + self.current_image_format
+        margins = (top_margin_percent, left_margin_percent, right_margin_percent, bottom_margin_percent)
+        return self._output('cropped', ('crop', *margins), lambda: self._crop(self._load_image(), *margins))
 
     def crop_image_in_pixels(self, x_start, y_start, x_end, y_end):
         """
@@ -140,15 +626,19 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            width, height = x_end - x_start, y_end - y_start
-            cropped_image = image.crop((x_start, y_start, width, height))
-            cropped_image.save(self.current_image_directory + 'cropped.' + self.current_image_format)
-        return self.current_image_directory + 'cropped.' + self.current_image_format
+        box = (x_start, y_start, x_end, y_end)
+
+        def render():
+            image = self._load_image()
+            scale = self._loaded_scale(image)
+            return self._crop_in_pixels(image, *(round(value * scale) for value in box))
+
+        return self._output('cropped', ('crop_in_pixels', *box), render)
 
     def resize_image(self, width_percent, height_percent):
         """
@@ -163,17 +653,13 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            width, height = image.size
-            new_width = int(width * width_percent / 100)
-            new_height = int(height * height_percent / 100)
-            image = image.resize((new_width, new_height))
-            image.save(self.current_image_directory + 'resized.' + self.current_image_format)
-        return self.current_image_directory + 'resized.' + self.current_image_format
+        return self._output('resized', ('resize', width_percent, height_percent),
+                            lambda: self._load_resized(width_percent, height_percent))
 
     def grayscale_image(self):
         """
@@ -184,14 +670,12 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            image = image.convert('L')
-            image.save(self.current_image_directory + 'grayscaled.' + self.current_image_format)
-        return self.current_image_directory + 'grayscaled.' + self.current_image_format
+        return self._output('grayscaled', ('grayscale',), lambda: self._grayscale(self._load_image()))
 
     def chanel_convert_image(self, chanel='r'): 
         """
@@ -206,24 +690,46 @@ class ImageFormatter:
         Raises:
             UnknownMode: If the specified chanel is not 'r', 'g', or 'b'.
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
-        if chanel != 'r' and chanel != 'g' and chanel != 'b':
-            raise UnknownMode('Unknown chanel')
+        self._check_chanel(chanel)
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            if self.current_image_format == 'png':
-                image = image.convert('RGB')
-            r, g, b = image.split()
-            zeroes = r.point(lambda x: 0)
-            chanel_image = Image.merge("RGB", (
-                r if chanel == 'r' else zeroes,
-                g if chanel == 'g' else zeroes,
-                b if chanel == 'b' else zeroes
-            ))
-            chanel_image.save(self.current_image_directory + 'chanel_converted' + '.' + self.current_image_format)
-        return self.current_image_directory + 'chanel_converted' +  '.' + self.current_image_format
+        return self._output('chanel_converted', ('chanel_convert', chanel),
+                            lambda: self._chanel_convert(self._load_image(), chanel))
+
+    def chanel_convert_all(self):
+        """
+        Convert the current image to each of the 'r', 'g' and 'b' color chanels at once.
+
+        The image is loaded and converted to RGB only once for all three chanels.
+
+        Returns:
+            dict: The paths to the images with the single chanel keyed by 'r', 'g' and 'b'.
+
+        Raises:
+            ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
+        """
+        if self.current_image_directory is None:
+            raise ImageDirectoryNotSelected('Current image directory is not selected')
+
+        images = {}
+
+        def render(chanel):
+            # The image is converted to all chanels on the first cache miss, the other chanels reuse the result
+            if not images:
+                image = self._load_image()
+                # Three results at once may not fit into the memory budget, then every chanel is converted on its own
+                needed = _image_bytes(image.size, image.mode) + 4 * _image_bytes(image.size, 'RGB')
+                if self.max_memory_bytes is not None and needed > self.max_memory_bytes:
+                    return self._chanel_convert(image, chanel)
+                images.update(color_ops.isolate_all_chanels(image))
+            return images[chanel]
+
+        return {chanel: self._output('chanel_converted_' + chanel, ('chanel_convert', chanel), lambda: render(chanel))
+                for chanel in color_ops.CHANELS}
 
     def blur_image(self, blur_type='box', blur_radius=10):
         """
@@ -238,23 +744,16 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
             UnknownMode: If the specified blur type is not 'box' or 'gaussian'.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        if blur_type != 'box' and blur_type != 'gaussian':
-            raise UnknownMode('Unknown blur type')
+        self._check_blur_type(blur_type)
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            if self.current_image_format == 'png':
-                image = image.convert('RGB')
-            if blur_type == 'box':
-                image = image.filter(ImageFilter.BoxBlur(radius=blur_radius))
-            elif blur_type == 'gaussian':
-                image = image.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-            image.save(self.current_image_directory + 'blurred.' + self.current_image_format)
-        return self.current_image_directory + 'blurred.' + self.current_image_format
+        return self._output('blurred', ('blur', blur_type, blur_radius),
+                            lambda: self._blur(self._load_image(), blur_type, blur_radius))
 
     def sharpen_image(self):
         """
@@ -265,16 +764,12 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            if self.current_image_format == 'png':
-                image = image.convert('RGB')
-            image = image.filter(ImageFilter.SHARPEN)
-            image.save(self.current_image_directory + 'sharpened.' + self.current_image_format)
-        return self.current_image_directory + 'sharpened.' + self.current_image_format
+        return self._output('sharpened', ('sharpen',), lambda: self._filter(self._load_image(), ImageFilter.SHARPEN))
 
     def smooth_image(self):
         """
@@ -285,16 +780,12 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            if self.current_image_format == 'png':
-                image = image.convert('RGB')
-            image = image.filter(ImageFilter.SMOOTH)
-            image.save(self.current_image_directory + 'smoothed.' + self.current_image_format)
-        return self.current_image_directory + 'smoothed.' + self.current_image_format
+        return self._output('smoothed', ('smooth',), lambda: self._filter(self._load_image(), ImageFilter.SMOOTH))
 
     def find_edges(self):
         """
@@ -305,16 +796,12 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            if self.current_image_format == 'png':
-                image = image.convert('RGB')
-            image = image.filter(ImageFilter.FIND_EDGES)
-            image.save(self.current_image_directory + 'edges.' + self.current_image_format)
-        return self.current_image_directory + 'edges.' + self.current_image_format
+        return self._output('edges', ('find_edges',), lambda: self._filter(self._load_image(), ImageFilter.FIND_EDGES))
 
     def change_brightness(self, scale_value):
         """
@@ -330,17 +817,80 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            if self.current_image_format == 'png':
-                image = image.convert('RGB')
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(scale_value)
-            image.save(self.current_image_directory + 'brightness_changed.' + self.current_image_format)
-        return self.current_image_directory + 'brightness_changed.' + self.current_image_format
+        return self._output('brightness_changed', ('brightness', scale_value),
+                            lambda: self._brightness(self._load_image(), scale_value))
+
+    def change_contrast(self, scale_value):
+        """
+        Adjust the contrast of the current image.
+
+        Args:
+            scale_value (float): The factor by which to adjust the contrast.
+                                 Values greater than 1.0 increase contrast,
+                                 while values between 0.0 and 1.0 decrease contrast.
+
+        Returns:
+            str: The path to the image with adjusted contrast.
+
+        Raises:
+            ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
+        """
+        if self.current_image_directory is None:
+            raise ImageDirectoryNotSelected('Current image directory is not selected')
+
+        return self._output('contrast_changed', ('contrast', scale_value),
+                            lambda: self._contrast(self._load_image(), scale_value))
+
+    def change_gamma(self, gamma_value):
+        """
+        Apply gamma correction to the current image.
+
+        Args:
+            gamma_value (float): Values greater than 1.0 brighten the midtones,
+                                 while values between 0.0 and 1.0 darken them.
+
+        Returns:
+            str: The path to the corrected image.
+
+        Raises:
+            ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
+            ValueError: If gamma_value is not positive.
+        """
+        if self.current_image_directory is None:
+            raise ImageDirectoryNotSelected('Current image directory is not selected')
+
+        return self._output('gamma_changed', ('levels', 0, 255, gamma_value),
+                            lambda: self._levels(self._load_image(), 0, 255, gamma_value))
+
+    def adjust_levels(self, black=0, white=255, gamma_value=1.0):
+        """
+        Stretch the tonal range of the current image, so the black and white input levels become 0 and 255.
+
+        Args:
+            black (int, optional): The input level mapped to black. Defaults to 0.
+            white (int, optional): The input level mapped to white. Defaults to 255.
+            gamma_value (float, optional): The gamma correction of the midtones. Defaults to 1.0.
+
+        Returns:
+            str: The path to the adjusted image.
+
+        Raises:
+            ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
+            ValueError: If black is not less than white or gamma_value is not positive.
+        """
+        if self.current_image_directory is None:
+            raise ImageDirectoryNotSelected('Current image directory is not selected')
+
+        return self._output('levels_adjusted', ('levels', black, white, gamma_value),
+                            lambda: self._levels(self._load_image(), black, white, gamma_value))
 
     def add_watermark(self, watermark_path, position_percentage=(0, 0)):
         """
@@ -356,19 +906,15 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            watermark = Image.open(watermark_path).convert("RGBA")
-            image_width, image_height = image.size
-            watermark_width, watermark_height = watermark.size
-            x = int(image_width * position_percentage[0] / 100) - watermark_width
-            y = int(image_height * position_percentage[1] / 100) - watermark_height
-            image.paste(watermark, (x, y), watermark)
-            image.save(self.current_image_directory + 'watermarked.' + self.current_image_format)
-        return self.current_image_directory + 'watermarked.' + self.current_image_format
+        # The watermark is identified by its content, so editing the watermark file gives a new result
+        watermark = self.result_cache.source_digest(watermark_path) if self.result_cache is not None else None
+        return self._output('watermarked', ('watermark', watermark, position_percentage),
+                            lambda: self._watermark(self._load_image().copy(), watermark_path, position_percentage))
 
     def add_text(self, text, x=0, y=0, font_size=16, color=(0, 0, 0)):
         """
@@ -386,17 +932,18 @@ class ImageFormatter:
 
         Raises:
             ImageDirectoryNotSelected: If the current image directory is not selected.
+            ImageTooLarge: If the image does not fit into the memory budget even downscaled.
         """
         if self.current_image_directory is None:
             raise ImageDirectoryNotSelected('Current image directory is not selected')
 
-        with Image.open(self.current_image_directory + 'default.' + self.current_image_format) as image:
-            font = ImageFont.load_default()
-            font = font.font_variant(size=font_size)
-            draw = ImageDraw.Draw(image)
-            draw.text((x, y), text, font=font, fill=color)
-            image.save(self.current_image_directory + 'text_added.' + self.current_image_format)
-        return self.current_image_directory + 'text_added.' + self.current_image_format
+        def render():
+            image = self._load_image()
+            scale = self._loaded_scale(image)
+            return self._text(image.copy(), text, round(x * scale), round(y * scale), max(1, round(font_size * scale)),
+                              color)
+
+        return self._output('text_added', ('text', text, x, y, font_size, color), render)
 
     def get_image_size(self):
         """
@@ -415,35 +962,167 @@ class ImageFormatter:
             return image.size
 
 
-if __name__ == '__main__':
-    formatter = ImageFormatter()
+class ImagePipeline:
+    """
+    Chain of operations applied to the current image of ImageFormatter in a single pass.
+
+    The steps are recorded by the methods named after the ImageFormatter operations and are executed
+    only by run() or save(). Invalid modes are reported when the step is added.
+
+    Args:
+        formatter (ImageFormatter): The formatter with the selected image directory.
+    """
+
+    def __init__(self, formatter):
+        self.formatter = formatter
+        self.steps = []
+
+    def _add(self, operation, *args, in_place=False):
+        self.steps.append((operation, args, in_place))
+        return self
+
+    def rotate(self, angle):
+        return self._add(self.formatter._rotate, angle)
+
+    def flip(self, mode='horizontal'):
+        return self._add(self.formatter._flip, self.formatter._flip_axis(mode))
+
+    def crop(self, top_margin_percent, left_margin_percent, right_margin_percent, bottom_margin_percent):
+        return self._add(self.formatter._crop, top_margin_percent, left_margin_percent,
+                         right_margin_percent, bottom_margin_percent)
+
+    def crop_in_pixels(self, x_start, y_start, x_end, y_end):
+        return self._add(self.formatter._crop_in_pixels, x_start, y_start, x_end, y_end)
+
+    def resize(self, width_percent, height_percent):
+        return self._add(self.formatter._resize, width_percent, height_percent)
+
+    def grayscale(self):
+        return self._add(self.formatter._grayscale)
+
+    def chanel_convert(self, chanel='r'):
+        self.formatter._check_chanel(chanel)
+        return self._add(self.formatter._chanel_convert, chanel)
 
+    def blur(self, blur_type='box', blur_radius=10):
+        self.formatter._check_blur_type(blur_type)
+        return self._add(self.formatter._blur, blur_type, blur_radius)
+
+    def sharpen(self):
+        return self._add(self.formatter._filter, ImageFilter.SHARPEN)
+
+    def smooth(self):
+        return self._add(self.formatter._filter, ImageFilter.SMOOTH)
+
+    def find_edges(self):
+        return self._add(self.formatter._filter, ImageFilter.FIND_EDGES)
+
+    def brightness(self, scale_value):
+        return self._add(self.formatter._brightness, scale_value)
+
+    def contrast(self, scale_value):
+        return self._add(self.formatter._contrast, scale_value)
+
+    def gamma(self, gamma_value):
+        return self.levels(0, 255, gamma_value)
+
+    def levels(self, black=0, white=255, gamma_value=1.0):
+        return self._add(self.formatter._levels, black, white, gamma_value)
+
+    def watermark(self, watermark_path, position_percentage=(0, 0)):
+        return self._add(self.formatter._watermark, watermark_path, position_percentage, in_place=True)
+
+    def text(self, text, x=0, y=0, font_size=16, color=(0, 0, 0)):
+        return self._add(self.formatter._text, text, x, y, font_size, color, in_place=True)
+
+    def run(self):
+        """
+        Apply all the steps to the current image.
+
+        Returns:
+            PIL.Image.Image: The resulting image.
+
+        Raises:
+            ImageTooLarge: If a step does not fit into the memory budget of the formatter.
+        """
+        steps = self.steps
+        # The decoded image is shared with the cache, so it is copied once before the first in-place step
+        owned = False
+        if steps and steps[0][0] == self.formatter._resize:
+            # The first resize decodes only the needed resolution of JPEG images
+            image = self.formatter._load_resized(*steps[0][1])
+            steps = steps[1:]
+            owned = True
+        else:
+            image = self.formatter._load_image()
+        for operation, args, in_place in steps:
+            if in_place and not owned:
+                image = image.copy()
+            image = operation(image, *args)
+            owned = True
+        return image
+
+    def save(self, name='pipeline'):
+        """
+        Apply all the steps and save the resulting image next to the default one.
+
+        Args:
+            name (str, optional): The name of the resulting file without the extension. Defaults to 'pipeline'.
+
+        Returns:
+            str: The path to the resulting image.
+        """
+        with OPERATION_SECONDS.time(OPERATION_ERRORS, operation='pipeline'):
+            path = self.formatter._save(self.run(), name)
+        self.formatter._count_bytes('pipeline', path)
+        return path
+
+
+# Formatters of the current worker process, kept between tasks so the decoded image cache is reused
+_batch_formatters = {}
+
+
+def _run_batch_operation(default_path, directory, operation, args, kwargs):
+    try:
+        formatter = _batch_formatters.get(default_path)
+        if formatter is None:
+            formatter = _batch_formatters[default_path] = ImageFormatter(default_path)
+        formatter.select_image_directory(directory)
+        if isinstance(operation, str):
+            result = getattr(formatter, operation)(*args, **kwargs)
+        else:
+            result = operation(formatter, *args, **kwargs)
+        return BatchResult(directory, result, None)
+    except Exception as e:
+        return BatchResult(directory, None, e)
+
+
+def _demo_operations(formatter, watermark_path):
+    formatter.rotate_image(90)
+    formatter.flip_image('horizontal')
+    formatter.crop_image(25, 25, 50, 50)
+    formatter.resize_image(50, 50)
+    formatter.grayscale_image()
+    formatter.chanel_convert_all()
+    formatter.blur_image('box', 10)
+    formatter.sharpen_image()
+    formatter.smooth_image()
+    formatter.find_edges()
+    formatter.change_brightness(1.5)
+    formatter.add_watermark(watermark_path, (100, 100))
+    formatter.add_text('Hello, world!', 0, 0, 32, (255, 0, 0))
+    # "Resize + sharpen + watermark" preset, decoded and encoded only once
+    formatter.pipeline().resize(50, 50).sharpen().watermark(watermark_path, (100, 100)).save('preset')
+
+
+if __name__ == '__main__':
     # IMAGE_DIRECTORY = 'images/parsed_images'
     IMAGE_DIRECTORY = 'images/example_parsed_images'
 
     # U can choose any watermark image from images/static and even create your own at images/static
     WATERMARK_PATH = 'images/static/example_watermark.png'
-    image_names = os.listdir(IMAGE_DIRECTORY)
-    for image_name in image_names:
-        try:
-            formatter.select_image_directory(f'{IMAGE_DIRECTORY}/{image_name}/')
-            formatter.rotate_image(90)
-            formatter.flip_image('horizontal')
-            formatter.crop_image(25, 25, 50, 50)
-            formatter.resize_image(50, 50)
-            formatter.grayscale_image()
-            [formatter.chanel_convert_image(chanel) for chanel in ['r', 'g', 'b']]
-            formatter.blur_image('box', 10)
-            formatter.sharpen_image()
-            formatter.smooth_image()
-            formatter.find_edges()
-            formatter.change_brightness(1.5)
-            formatter.add_watermark(WATERMARK_PATH, (100, 100))
-            formatter.add_text('Hello, world!', 0, 0, 32, (255, 0, 0))
-        except UnknownMode as e:
-            print(f'Image {image_name} - {e}')
-        except ImageDirectoryNotSelected as e:
-            print(f'Image {image_name} - {e}')
-        except Exception as e:
-            print(f'Image {image_name} - {e}')
-
+    image_directories = [f'{IMAGE_DIRECTORY}/{image_name}/' for image_name in os.listdir(IMAGE_DIRECTORY)]
+    # Every image is processed in its own worker process, the results are printed as soon as they are ready
+    for directory, _, error in ImageFormatter.batch(_demo_operations, image_directories, WATERMARK_PATH):
+        if error is not None:
+            print(f'Image {directory} - {error}')
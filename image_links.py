@@ -0,0 +1,250 @@
+from urllib.parse import urljoin, urldefrag
+from lxml import etree
+import posixpath
+
+
+# Images of these formats are downloaded, the format is taken from the extension of the URL path
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg')
+# srcset candidates are chosen for this width, it matches the size of the previews sent to Telegram
+TARGET_WIDTH = 1280
+# Lazy loading scripts keep the real address in one of these attributes, src holds a placeholder until then
+LAZY_SRC_ATTRIBUTES = ('data-src', 'data-lazy-src', 'data-original', 'data-lazy', 'data-url')
+LAZY_SRCSET_ATTRIBUTES = ('data-srcset', 'data-lazy-srcset')
+# The page is fed to the parser by chunks of this size
+FEED_SIZE = 64 * 1024
+
+
+def image_extension(url):
+    """
+    Get the image format of the URL by the extension of its path, the query string and the fragment are ignored.
+
+    Args:
+        url (str): The image URL.
+
+    Returns:
+        str or None: The lowercase extension if it is one of IMAGE_EXTENSIONS, otherwise None.
+    """
+    # Plain string operations instead of urlsplit(): the function is called for every candidate on the page
+    path = url.split('#', 1)[0].split('?', 1)[0]
+    if '://' in path:
+        path = path.split('://', 1)[1].partition('/')[2]
+    extension = posixpath.splitext(path)[1][1:].lower()
+    return extension if extension in IMAGE_EXTENSIONS else None
+
+
+def parse_srcset(srcset):
+    """
+    Parse the srcset attribute as described by the HTML standard.
+
+    Args:
+        srcset (str): The attribute value, e.g. 'small.jpg 480w, large.jpg 1080w' or 'a.jpg, a@2x.jpg 2x'.
+
+    Returns:
+        list of tuple: (url, width, density) for every candidate, width or density is None
+                       if the candidate does not have such a descriptor. A candidate without
+                       descriptors has the density 1.
+    """
+    candidates = []
+    position = 0
+    length = len(srcset)
+    while position < length:
+        while position < length and (srcset[position].isspace() or srcset[position] == ','):
+            position += 1
+        start = position
+        while position < length and not srcset[position].isspace():
+            position += 1
+        url = srcset[start:position]
+        descriptors = ''
+        if url.endswith(','):
+            url = url.rstrip(',')
+        else:
+            end = srcset.find(',', position)
+            end = length if end == -1 else end
+            descriptors = srcset[position:end]
+            position = end + 1
+        if not url:
+            continue
+        width = density = None
+        for descriptor in descriptors.split():
+            try:
+                if descriptor.endswith('w'):
+                    width = int(descriptor[:-1])
+                elif descriptor.endswith('x'):
+                    density = float(descriptor[:-1])
+            except ValueError:
+                pass
+        if width is None and density is None:
+            density = 1.0
+        candidates.append((url, width, density))
+    return candidates
+
+
+def choose_candidate(candidates, target_width=TARGET_WIDTH, layout_width=None):
+    """
+    Choose the srcset candidate for the target width: the narrowest one that is at least target_width wide,
+    or the widest one if all of them are narrower.
+
+    Args:
+        candidates (list of tuple): (url, width, density) tuples returned by parse_srcset().
+        target_width (int, optional): The needed width in pixels. Defaults to TARGET_WIDTH.
+        layout_width (int, optional): The width attribute of the image, it turns densities into widths.
+                                      Defaults to None, in which case the density is compared with 1x
+                                      being target_width wide.
+
+    Returns:
+        str or None: The URL of the chosen candidate, None if there are no candidates.
+    """
+    def width(candidate):
+        _, candidate_width, density = candidate
+        if candidate_width is not None:
+            return candidate_width
+        return density * (layout_width or target_width)
+
+    if not candidates:
+        return None
+    wide_enough = [candidate for candidate in candidates if width(candidate) >= target_width]
+    if wide_enough:
+        return min(wide_enough, key=width)[0]
+    return max(candidates, key=width)[0]
+
+
+class _ImageLinkTarget:
+    # lxml parser target: receives the start and end tag events, no element tree is built
+
+    def __init__(self, page_url, target_width, collect_pages=False):
+        self.base_url = page_url
+        self.base_found = False
+        self.target_width = target_width
+        self.links = []
+        self._seen = set()
+        # <a href> links to other pages, collected only for crawling
+        self.collect_pages = collect_pages
+        self.page_links = []
+        self._seen_pages = set()
+        # Candidates of the <picture> element being parsed, None outside of it
+        self._picture = None
+
+    def _resolve(self, link):
+        link = link.strip()
+        if not link or link.startswith('data:'):
+            return None
+        url = urldefrag(urljoin(self.base_url, link))[0]
+        if not url.startswith(('http://', 'https://')):
+            return None
+        return url
+
+    def _add(self, link):
+        # Only the chosen candidate is resolved, the extension of a relative link does not change on resolving
+        url = self._resolve(link) if link else None
+        if url is not None and url not in self._seen:
+            self._seen.add(url)
+            self.links.append(url)
+
+    def _candidates(self, attributes, layout_width=None, fallback=True):
+        # Candidates of a single <img> or <source> with a supported format, the real addresses of lazy loaded images first.
+        # Without fallback src is ignored, e.g. for <img> inside <picture> which sources have suitable candidates
+        srcset = next((attributes[name] for name in LAZY_SRCSET_ATTRIBUTES if attributes.get(name)), None)
+        srcset = srcset or attributes.get('srcset')
+        candidates = []
+        for url, width, density in parse_srcset(srcset or ''):
+            if image_extension(url) is not None:
+                if width is None and layout_width:
+                    width, density = int(density * layout_width), None
+                candidates.append((url, width, density))
+        if candidates or not fallback:
+            # src is only a fallback for browsers without srcset support, its width is unknown
+            return candidates
+        src = next((attributes[name] for name in LAZY_SRC_ATTRIBUTES if attributes.get(name)), None)
+        src = (src or attributes.get('src') or '').strip()
+        if image_extension(src) is not None:
+            candidates.append((src, layout_width, None if layout_width else 1.0))
+        return candidates
+
+    def start(self, tag, attributes):
+        if tag == 'base':
+            if not self.base_found and attributes.get('href'):
+                self.base_found = True
+                self.base_url = urljoin(self.base_url, attributes['href'].strip())
+        elif tag == 'a':
+            if self.collect_pages and attributes.get('href'):
+                url = self._resolve(attributes['href'])
+                # Direct links to images are not pages
+                if url is not None and url not in self._seen_pages and image_extension(url) is None:
+                    self._seen_pages.add(url)
+                    self.page_links.append(url)
+        elif tag == 'picture':
+            self._picture = []
+        elif tag == 'source' and self._picture is not None:
+            self._picture.extend(self._candidates(attributes))
+        elif tag == 'img':
+            try:
+                layout_width = int(attributes.get('width', ''))
+            except ValueError:
+                layout_width = None
+            if self._picture is not None:
+                self._picture.extend(self._candidates(attributes, layout_width, fallback=not self._picture))
+            else:
+                self._add(choose_candidate(self._candidates(attributes, layout_width), self.target_width, layout_width))
+
+    def end(self, tag):
+        if tag == 'picture' and self._picture is not None:
+            self._add(choose_candidate(self._picture, self.target_width))
+            self._picture = None
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return self.links
+
+
+def extract_image_links(html, page_url, charset=None, target_width=TARGET_WIDTH):
+    """
+    Extract the addresses of png/jpeg images from the HTML page.
+
+    The page is parsed by chunks with the lxml event parser, no element tree is built. Links are taken from
+    <img> (src, srcset and the lazy loading attributes) and <picture><source srcset>; of several candidates
+    of one image the one suitable for target_width is chosen. Relative links are resolved against <base href>
+    and the page URL, duplicates are removed.
+
+    Args:
+        html (bytes): The page content.
+        page_url (str): The final URL of the page (after redirects).
+        charset (str, optional): The encoding from the Content-Type header. Defaults to None,
+                                 which detects it from <meta charset>.
+        target_width (int, optional): The width srcset candidates are chosen for. Defaults to TARGET_WIDTH.
+
+    Returns:
+        list of str: The absolute image URLs in the order of the page.
+    """
+    return _parse(html, _ImageLinkTarget(page_url, target_width), charset).links
+
+
+def extract_links(html, page_url, charset=None, target_width=TARGET_WIDTH):
+    """
+    Extract the image addresses like extract_image_links() and the links to other pages (<a href>) in one pass,
+    e.g. to crawl a catalogue with pagination and detail pages.
+
+    Args:
+        html (bytes): The page content.
+        page_url (str): The final URL of the page (after redirects).
+        charset (str, optional): The encoding from the Content-Type header. Defaults to None,
+                                 which detects it from <meta charset>.
+        target_width (int, optional): The width srcset candidates are chosen for. Defaults to TARGET_WIDTH.
+
+    Returns:
+        tuple: (image_links, page_links), lists of absolute URLs in the order of the page without duplicates.
+               Links to png/jpeg files are not included in page_links.
+    """
+    target = _parse(html, _ImageLinkTarget(page_url, target_width, collect_pages=True), charset)
+    return target.links, target.page_links
+
+
+def _parse(html, target, charset):
+    if not html:
+        return target
+    parser = etree.HTMLParser(target=target, encoding=charset, recover=True, no_network=True)
+    for position in range(0, len(html), FEED_SIZE):
+        parser.feed(html[position:position + FEED_SIZE])
+    parser.close()
+    return target
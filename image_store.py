@@ -0,0 +1,193 @@
+import shutil
+import json
+import time
+import uuid
+import os
+
+
+# Temporary files older than this are considered abandoned (e.g. after a crash) and are removed by collect_garbage().
+# Unlinked blobs are kept for the same time, so scrapes running in parallel can still link them
+TEMP_MAX_AGE = 60 * 60
+
+
+class ImageStore:
+    """
+    Content-addressed storage of downloaded images.
+
+    Every unique image is stored once as a blob named by the SHA-256 of its content. Scrape directories
+    (images/parsed_images/[image_name]/default.{ext}) are hard links to the blobs, so repeated images
+    and repeated scrapes of the same page do not write the same bytes again. A blob is removed by
+    collect_garbage() when no scrape directory and no HTTP cache body refers to it anymore.
+
+    Args:
+        path (str, optional): The root directory of the store. Defaults to 'images/store'.
+                              It should be on the same file system as the scrape directories.
+    """
+
+    def __init__(self, path='images/store'):
+        self.path = path
+        self.blobs_path = os.path.join(path, 'blobs')
+        self.temp_path = os.path.join(path, 'tmp')
+        os.makedirs(self.blobs_path, exist_ok=True)
+        os.makedirs(self.temp_path, exist_ok=True)
+
+    def new_temp_file(self):
+        """
+        Get a unique path for a file being downloaded.
+
+        Returns:
+            str: The path to the temporary file inside the store.
+        """
+        return os.path.join(self.temp_path, uuid.uuid4().hex)
+
+    def blob_path(self, digest, extension):
+        """
+        Get the path of the blob.
+
+        Args:
+            digest (str): The SHA-256 hex digest of the image.
+            extension (str): The image file extension.
+
+        Returns:
+            str: The path to the blob.
+        """
+        return os.path.join(self.blobs_path, digest[:2], f'{digest}.{extension}')
+
+    def add(self, temp_file, digest, extension):
+        """
+        Move the downloaded file into the store. If the same image is stored already, the file is just removed.
+
+        Args:
+            temp_file (str): The path to the file returned by new_temp_file().
+            digest (str): The SHA-256 hex digest of the file content.
+            extension (str): The image file extension.
+
+        Returns:
+            str: The path to the blob.
+        """
+        blob = self.blob_path(digest, extension)
+        if os.path.exists(blob):
+            os.remove(temp_file)
+            # Protects the blob from collect_garbage() running in parallel until it is linked
+            os.utime(blob)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(temp_file, blob)
+        return blob
+
+    def add_link(self, source, digest, extension):
+        """
+        Put an existing file with the known digest into the store without copying it, e.g. a cached HTTP response.
+
+        Args:
+            source (str): The path to the file, it is left in place.
+            digest (str): The SHA-256 hex digest of the file content.
+            extension (str): The image file extension.
+
+        Returns:
+            str: The path to the blob.
+        """
+        blob = self.blob_path(digest, extension)
+        if os.path.exists(blob):
+            os.utime(blob)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            self.link(source, blob)
+        return blob
+
+    @staticmethod
+    def link(blob, destination):
+        """
+        Place the blob at the destination path as a hard link, or as a copy if hard links are not supported.
+
+        Args:
+            blob (str): The path to the blob.
+            destination (str): The path of the new file, it is replaced if it exists.
+        """
+        # The temporary name is hidden, so it is not mistaken for the default image of the directory
+        directory, name = os.path.split(destination)
+        temp_destination = os.path.join(directory, f'.{name}.tmp')
+        if os.path.exists(temp_destination):
+            os.remove(temp_destination)
+        try:
+            os.link(blob, temp_destination)
+        except OSError:
+            shutil.copyfile(blob, temp_destination)
+        os.replace(temp_destination, destination)
+        # Renaming a hard link onto another link of the same file does nothing, so the temporary link may remain
+        if os.path.exists(temp_destination):
+            os.remove(temp_destination)
+
+    def collect_garbage(self):
+        """
+        Remove the blobs that have not been linked from anywhere for TEMP_MAX_AGE seconds and abandoned temporary files.
+
+        A blob counts as unreferenced when it is its only hard link. The bodies of cached image responses are hard
+        links to the blobs too (HttpCache.store(link=True)), so a blob stays while the HTTP cache keeps its response,
+        even if no scrape directory uses it, and is removed by the first collection after HttpCache.evict() drops it.
+
+        Returns:
+            int: The number of removed blobs.
+        """
+        removed = 0
+        now = time.time()
+        for prefix in os.listdir(self.blobs_path):
+            prefix_path = os.path.join(self.blobs_path, prefix)
+            for name in os.listdir(prefix_path):
+                blob = os.path.join(prefix_path, name)
+                try:
+                    stat = os.stat(blob)
+                except FileNotFoundError:
+                    # Removed by a collection running in another process
+                    continue
+                # Fresh blobs may be not linked yet by the scrape that is still in progress
+                if stat.st_nlink == 1 and now - stat.st_mtime > TEMP_MAX_AGE:
+                    try:
+                        os.remove(blob)
+                    except FileNotFoundError:
+                        continue
+                    removed += 1
+        for name in os.listdir(self.temp_path):
+            temp_file = os.path.join(self.temp_path, name)
+            try:
+                if now - os.stat(temp_file).st_mtime > TEMP_MAX_AGE:
+                    os.remove(temp_file)
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def read_manifest(directory):
+    """
+    Read the manifest of the scrape saved in the directory.
+
+    Args:
+        directory (str): The scrape directory, e.g. 'images/parsed_images'.
+
+    Returns:
+        dict: The manifest {'url': page_url, 'images': [{'name', 'url', 'sha256', 'extension'}, ...]}.
+              If there is no manifest, the list of images is empty.
+    """
+    try:
+        with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'url': None, 'images': []}
+
+
+def write_manifest(directory, manifest, fsync=False):
+    """
+    Atomically write the manifest of the scrape to the directory.
+
+    Args:
+        directory (str): The scrape directory, e.g. 'images/parsed_images'.
+        manifest (dict): The manifest in the format returned by read_manifest().
+        fsync (bool, optional): Flush the manifest to the disk before it replaces the old one. Defaults to False.
+    """
+    path = os.path.join(directory, 'manifest.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,288 @@
+import threading
+import sqlite3
+import json
+import time
+import os
+
+
+# Kinds of jobs and their maximum number of simultaneously running jobs over all workers
+JOB_CONCURRENCY = {'scrape': 2, 'operation': 4}
+# A running job whose worker has not reported for this many seconds is considered lost and is queued again
+STALE_AFTER = 60
+# A job that has been started this many times without finishing fails, so a job crashing its worker is not repeated forever
+MAX_ATTEMPTS = 3
+# Finished jobs are kept for this many seconds after the chat has been notified
+KEEP_FINISHED = 24 * 60 * 60
+
+_QUEUED = 'queued'
+_RUNNING = 'running'
+_DONE = 'done'
+_FAILED = 'failed'
+
+
+class JobQueue:
+    """
+    Durable queue of the scrapes and image operations of the bot, stored in SQLite.
+
+    The bot submits a job and returns to polling at once; worker processes claim the jobs, run them and store
+    their results; the bot reads the state changes back and notifies the chats. Since the jobs are in the database,
+    they survive restarts: queued jobs stay queued, and the jobs of workers that died (no heartbeat for
+    stale_after seconds) are queued again by recover(). A worker that was only paused for that long cannot overwrite
+    the job it lost: heartbeat(), complete() and fail() are ignored once the job has been given to another worker.
+
+    Jobs of one chat run one at a time in the order of submission, whatever their kind, because they work in
+    the same directory. Among the chats, the one whose last job started the longest time ago goes first, so a chat
+    with a long queue does not hold back the others. Every kind of job has its own limit of running jobs.
+
+    Args:
+        path (str, optional): The SQLite database file, shared by the bot and the workers.
+                              Defaults to 'images/jobs.sqlite3'.
+        concurrency (dict, optional): The maximum number of running jobs of every kind. Defaults to JOB_CONCURRENCY.
+        stale_after (float, optional): Seconds without a heartbeat after which a running job is lost.
+                                       Defaults to STALE_AFTER.
+        max_attempts (int, optional): The number of starts after which an unfinished job fails.
+                                      Defaults to MAX_ATTEMPTS.
+    """
+
+    def __init__(self, path='images/jobs.sqlite3', concurrency=None, stale_after=STALE_AFTER,
+                 max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.concurrency = dict(JOB_CONCURRENCY if concurrency is None else concurrency)
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Several processes use the database, busy ones wait for the lock instead of failing
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                heartbeat REAL,
+                finished REAL,
+                notified TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, kind);
+            CREATE INDEX IF NOT EXISTS jobs_chat ON jobs (chat_id, state);
+        ''')
+
+    @staticmethod
+    def _job(row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def submit(self, kind, chat_id, payload):
+        """
+        Queue a job.
+
+        Args:
+            kind (str): The kind of the job, e.g. 'scrape' or 'operation'.
+            chat_id (int): The chat the job belongs to.
+            payload (dict): The JSON serializable arguments of the job.
+
+        Returns:
+            int: The job id.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT INTO jobs (kind, chat_id, payload, state, created) VALUES (?, ?, ?, ?, ?)',
+                (kind, chat_id, json.dumps(payload), _QUEUED, time.time()))
+            return cursor.lastrowid
+
+    def position(self, job_id):
+        """
+        Get the number of unfinished jobs of the same kind submitted before the job.
+
+        Args:
+            job_id (int): The job id.
+
+        Returns:
+            int: The number of jobs ahead of the job.
+        """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM jobs WHERE id < ? AND state IN (?, ?) '
+                'AND kind = (SELECT kind FROM jobs WHERE id = ?)', (job_id, _QUEUED, _RUNNING, job_id)).fetchone()[0]
+
+    def claim(self, kind, worker):
+        """
+        Take the next job of the kind and mark it as running.
+
+        Args:
+            kind (str): The kind of the job.
+            worker (str): The name of the worker, e.g. host and process id.
+
+        Returns:
+            dict or None: The job (the columns of the table, payload and result decoded), or None if there is no job
+                          to run or the concurrency limit of the kind is reached.
+        """
+        now = time.time()
+        with self._lock:
+            # The immediate transaction keeps other processes from claiming the same job
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                limit = self.concurrency.get(kind)
+                running = self._connection.execute('SELECT COUNT(*) FROM jobs WHERE kind = ? AND state = ?',
+                                                   (kind, _RUNNING)).fetchone()[0]
+                if limit is not None and running >= limit:
+                    self._connection.execute('COMMIT')
+                    return None
+                # The earliest queued job of the chat, if the chat has no running job,
+                # from the chat which has been waiting the longest
+                row = self._connection.execute('''
+                    SELECT * FROM jobs AS j
+                    WHERE j.state = :queued AND j.kind = :kind
+                      AND NOT EXISTS (SELECT 1 FROM jobs AS o WHERE o.chat_id = j.chat_id
+                                      AND (o.state = :running OR (o.state = :queued AND o.id < j.id)))
+                    ORDER BY (SELECT COALESCE(MAX(s.started), 0) FROM jobs AS s WHERE s.chat_id = j.chat_id), j.id
+                    LIMIT 1
+                ''', {'queued': _QUEUED, 'running': _RUNNING, 'kind': kind}).fetchone()
+                if row is None:
+                    self._connection.execute('COMMIT')
+                    return None
+                self._connection.execute(
+                    'UPDATE jobs SET state = ?, worker = ?, started = ?, heartbeat = ?, attempts = attempts + 1 '
+                    'WHERE id = ?', (_RUNNING, worker, now, now, row['id']))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        job = self._job(row)
+        job.update(state=_RUNNING, worker=worker, started=now, heartbeat=now, attempts=job['attempts'] + 1)
+        return job
+
+    def heartbeat(self, job):
+        """
+        Report that the worker is still running the job.
+
+        Args:
+            job (dict): The job returned by claim().
+
+        Returns:
+            bool: False if the job is not this worker's anymore.
+        """
+        with self._lock:
+            return self._connection.execute('UPDATE jobs SET heartbeat = ? WHERE id = ? AND state = ? AND worker = ?',
+                                            (time.time(), job['id'], _RUNNING, job['worker'])).rowcount > 0
+
+    def complete(self, job, result=None):
+        """
+        Store the result of the job.
+
+        Args:
+            job (dict): The job returned by claim().
+            result (optional): The JSON serializable result. Defaults to None.
+        """
+        with self._lock:
+            self._connection.execute('UPDATE jobs SET state = ?, result = ?, finished = ? '
+                                     'WHERE id = ? AND state = ? AND worker = ?',
+                                     (_DONE, json.dumps(result), time.time(), job['id'], _RUNNING, job['worker']))
+
+    def fail(self, job, error):
+        """
+        Mark the job as failed.
+
+        Args:
+            job (dict): The job returned by claim().
+            error (str): The description of the error.
+        """
+        with self._lock:
+            self._connection.execute('UPDATE jobs SET state = ?, error = ?, finished = ? '
+                                     'WHERE id = ? AND state = ? AND worker = ?',
+                                     (_FAILED, error, time.time(), job['id'], _RUNNING, job['worker']))
+
+    def recover(self):
+        """
+        Queue again the running jobs of the workers that stopped reporting (e.g. killed by a restart),
+        fail the ones that have been started max_attempts times, and remove old notified jobs.
+
+        Returns:
+            int: The number of queued jobs.
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._connection.execute(
+                    "UPDATE jobs SET state = ?, error = 'The worker stopped', finished = ? "
+                    'WHERE state = ? AND heartbeat < ? AND attempts >= ?',
+                    (_FAILED, now, _RUNNING, now - self.stale_after, self.max_attempts))
+                queued = self._connection.execute(
+                    'UPDATE jobs SET state = ?, worker = NULL WHERE state = ? AND heartbeat < ?',
+                    (_QUEUED, _RUNNING, now - self.stale_after)).rowcount
+                self._connection.execute('DELETE FROM jobs WHERE state IN (?, ?) AND notified = state AND finished < ?',
+                                         (_DONE, _FAILED, now - KEEP_FINISHED))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        return queued
+
+    def updates(self):
+        """
+        Get the jobs which have started or finished since the chat was notified last time.
+
+        Returns:
+            list of dict: The jobs in the order of submission.
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT * FROM jobs WHERE state != ? AND notified IS NOT state ORDER BY id',
+                                            (_QUEUED,)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def busy_chats(self):
+        """
+        Get the chats that have queued or running jobs, or finished jobs they have not been notified about.
+
+        Returns:
+            set of int: The chat ids.
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT DISTINCT chat_id FROM jobs WHERE state IN (?, ?) '
+                                            'OR notified IS NOT state', (_QUEUED, _RUNNING)).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_notified(self, job_id, state):
+        """
+        Remember that the chat was notified about the state of the job.
+
+        Args:
+            job_id (int): The job id.
+            state (str): The state of the job returned by updates().
+        """
+        with self._lock:
+            self._connection.execute('UPDATE jobs SET notified = ? WHERE id = ?', (state, job_id))
+
+    def stats(self):
+        """
+        Get the number of jobs of every kind in every state.
+
+        Returns:
+            dict: {kind: {state: count}}.
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT kind, state, COUNT(*) FROM jobs GROUP BY kind, state').fetchall()
+        stats = {}
+        for kind, state, count in rows:
+            stats.setdefault(kind, {})[state] = count
+        return stats
+
+    def close(self):
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,358 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import contextlib
+import threading
+import time
+import os
+
+
+# Latency buckets in seconds, from a cached result to a big blur or a slow page
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Metrics are recorded only after enable(), until then every call returns right after checking this flag
+_enabled = False
+_metrics = []
+_lock = threading.Lock()
+# Labels added to every series of the process, e.g. the name of the worker
+_process_labels = ()
+# (directory, max_age) of the metrics dumped by other processes and included in render()
+_collected = None
+
+
+def enable():
+    """
+    Start recording the metrics.
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """
+    Stop recording the metrics, the recorded values are kept.
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    """
+    Check if the metrics are recorded.
+
+    Returns:
+        bool: True after enable().
+    """
+    return _enabled
+
+
+def set_process_labels(**labels):
+    """
+    Add the labels to every series of the process, so the series of several processes running the same code differ.
+
+    Args:
+        **labels: The label values, e.g. worker='scrape-1234'.
+    """
+    global _process_labels
+    _process_labels = tuple(sorted(labels.items()))
+
+
+def _labels_text(labels):
+    labels = _process_labels + tuple(labels)
+    if not labels:
+        return ''
+    values = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return '{' + values + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    """
+    Monotonically increasing value, e.g. the number of downloaded bytes, with optional labels.
+
+    Args:
+        name (str): The metric name.
+        description (str): The help text.
+    """
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+
+    def inc(self, value=1, **labels):
+        """
+        Increase the counter.
+
+        Args:
+            value (int or float, optional): The increment. Defaults to 1.
+            **labels: The label values of the series.
+        """
+        if not _enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for key, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_labels_text(key)} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values, e.g. latencies in seconds, with optional labels.
+
+    Args:
+        name (str): The metric name.
+        description (str): The help text.
+        buckets (tuple of float, optional): The upper bounds of the buckets. Defaults to DEFAULT_BUCKETS.
+    """
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        """
+        Record the value.
+
+        Args:
+            value (float): The observed value.
+            **labels: The label values of the series.
+        """
+        if not _enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                # Counts of the buckets, then the sum and the count of all the values
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, errors=None, **labels):
+        """
+        Measure the duration of the with block.
+
+        Args:
+            errors (Counter, optional): Increased with the same labels if the block raises an exception.
+            **labels: The label values of the series.
+
+        Returns:
+            context manager: Records the duration in seconds on exit.
+        """
+        if not _enabled:
+            return _NULL_CONTEXT
+        return _Timer(self, errors, labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels_text(key + (("le", repr(bound)),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels_text(key + (("le", "+Inf"),))} {series[-1]}')
+            lines.append(f'{self.name}_sum{_labels_text(key)} {series[-2]}')
+            lines.append(f'{self.name}_count{_labels_text(key)} {series[-1]}')
+        return lines
+
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class _Timer:
+    def __init__(self, histogram, errors, labels):
+        self.histogram = histogram
+        self.errors = errors
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None and self.errors is not None:
+            self.errors.inc(**self.labels)
+        return False
+
+
+def counter(name, description):
+    """
+    Create and register a counter.
+
+    Args:
+        name (str): The metric name, by convention ending with _total.
+        description (str): The help text.
+
+    Returns:
+        Counter: The registered counter.
+    """
+    metric = Counter(name, description)
+    with _lock:
+        _metrics.append(metric)
+    return metric
+
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS):
+    """
+    Create and register a histogram.
+
+    Args:
+        name (str): The metric name, by convention ending with the unit, e.g. _seconds.
+        description (str): The help text.
+        buckets (tuple of float, optional): The upper bounds of the buckets. Defaults to DEFAULT_BUCKETS.
+
+    Returns:
+        Histogram: The registered histogram.
+    """
+    metric = Histogram(name, description, buckets)
+    with _lock:
+        _metrics.append(metric)
+    return metric
+
+
+def collect(directory, max_age=60):
+    """
+    Include the metrics that other processes (e.g. the job workers) dump into the directory in render().
+    The processes should dump to their own '*.prom' files with set_process_labels(), so their series do not collide.
+
+    Args:
+        directory (str): The directory with the dumped metrics.
+        max_age (float, optional): Files not rewritten for this many seconds belong to stopped processes,
+                                   they are removed. Defaults to 60.
+    """
+    global _collected
+    os.makedirs(directory, exist_ok=True)
+    _collected = (directory, max_age)
+
+
+def _collected_texts():
+    directory, max_age = _collected
+    now = time.time()
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.prom'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.stat(path).st_mtime > max_age:
+                os.remove(path)
+                continue
+            with open(path, encoding='utf-8') as f:
+                yield f.read()
+        except FileNotFoundError:
+            pass
+
+
+def _merge(texts):
+    # Every metric may appear only once in the exposition: the samples of all processes go under one HELP and TYPE
+    families = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# '):
+                family = families.setdefault(line.split()[2], ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+            elif line and family is not None:
+                family[1].append(line)
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header + samples)
+    return '\n'.join(lines) + '\n'
+
+
+def render():
+    """
+    Render all the registered metrics in the Prometheus text exposition format,
+    together with the metrics of other processes passed to collect().
+
+    Returns:
+        str: The metrics text.
+    """
+    with _lock:
+        lines = []
+        for metric in _metrics:
+            lines.extend(metric.render())
+    text = '\n'.join(lines) + '\n'
+    if _collected is None:
+        return text
+    return _merge([text, *_collected_texts()])
+
+
+def dump(path):
+    """
+    Atomically write the metrics to the file in the Prometheus text format, e.g. for the node_exporter textfile collector.
+
+    Args:
+        path (str): The path to the file.
+    """
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(render())
+    os.replace(path + '.tmp', path)
+
+
+def dump_periodically(path, interval=15):
+    """
+    Write the metrics to the file every interval seconds in a background thread.
+
+    Args:
+        path (str): The path to the file.
+        interval (float, optional): The period in seconds. Defaults to 15.
+
+    Returns:
+        threading.Event: Set it to stop dumping.
+    """
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            dump(path)
+
+    threading.Thread(target=run, name='metrics-dump', daemon=True).start()
+    return stopped
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """
+    Serve the metrics at http://host:port/metrics from a background thread.
+
+    Args:
+        port (int): The port, 0 selects a free one.
+        host (str, optional): The address to listen on. Defaults to '127.0.0.1'.
+
+    Returns:
+        ThreadingHTTPServer: The running server, call shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
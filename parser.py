@@ -1,69 +1,424 @@
 import shutil
-import re
-from bs4 import BeautifulSoup
-import requests
+import hashlib
 import aiohttp
 import asyncio
+import threading
+import functools
+import io
+import contextlib
+import posixpath
 import os
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from image_store import ImageStore, write_manifest
+from http_cache import HttpCache
+from image_links import extract_links, image_extension
+from crawl import CrawlPolicy, Frontier, HostRateLimiter, SINGLE_PAGE
+from perceptual_hash import DuplicateIndex, fingerprint
+from retry import TransientError, HostCircuitBreaker, TRANSIENT_STATUSES, MAX_RETRIES, parse_retry_after, \
+    backoff_delay
+import metrics
+from image_formatter import create_preview, DEFAULT_ENCODING
+from encoding import EncodingPolicy
+
+
+# Ограничения на загрузку изображений
+MAX_CONNECTIONS = 20  # Одновременных соединений всего
+MAX_CONNECTIONS_PER_HOST = 4  # Одновременных соединений с одним сайтом
+CONNECT_TIMEOUT = 10  # Секунд на установку соединения
+READ_TIMEOUT = 30  # Секунд ожидания очередной порции данных
+MAX_IMAGE_BYTES = 20 * 1024 * 1024  # Изображения больше этого размера не скачиваются
+CHUNK_SIZE = 64 * 1024  # Размер порции при записи на диск
+DISK_THREADS = 4  # Потоков для записи файлов, чтобы диск не останавливал event loop со скачиваниями
+FSYNC_WRITES = False  # Сбрасывать файлы на диск перед переименованием: надежнее при сбое питания, но медленнее
+
+# Фильтры изображений. Формат и размеры определяются по заголовку файла, прочитанному из начала ответа,
+# и неподходящие изображения (счетчики 1×1, иконки, спрайты, огромные оригиналы) не скачиваются до конца
+MIN_IMAGE_SIZE = (50, 50)  # Минимальные ширина и высота в пикселях
+MAX_IMAGE_SIZE = (12000, 12000)  # Максимальные ширина и высота в пикселях
+ALLOWED_FORMATS = ('JPEG', 'PNG')  # Форматы по заголовку файла, а не по расширению в ссылке
+PROBE_MAX_BYTES = 256 * 1024  # Если в начале файла такого размера нет заголовка изображения, это не изображение
+# Почти одинаковые изображения (одна фотография в разных разрешениях, с мелкими отличиями) сохраняются один раз,
+# в наибольшем разрешении. Сходство определяется по перцептивным хэшам и расположению цветов, поэтому варианты
+# товара другого цвета или тона сохраняются отдельно, см. perceptual_hash.DuplicateIndex
+DEDUPLICATE = True
+
+# Результат _fetch() для изображения, не прошедшего фильтры
+_SKIPPED = 'skipped'
+# Результат _download_image() для почти дубликата уже сохраненного изображения
+_DUPLICATE = 'duplicate'
+
+# Метрики парсинга, записываются только после metrics.enable()
+SCRAPE_STAGE_SECONDS = metrics.histogram('scrape_stage_seconds', 'Duration of the scrape stages')
+SCRAPE_ERRORS = metrics.counter('scrape_errors_total', 'Failed scrape stages')
+SCRAPE_IMAGES = metrics.counter('scrape_images_total', 'Images found on the scraped pages by outcome')
+SCRAPE_DOWNLOADED_BYTES = metrics.counter('scrape_downloaded_bytes_total', 'Bytes of image responses received')
+SCRAPE_PAGES = metrics.counter('scrape_pages_total', 'Fetched pages by outcome')
+SCRAPE_RETRIES = metrics.counter('scrape_retries_total', 'Retried image requests by reason')
+SCRAPE_CIRCUIT_OPEN = metrics.counter('scrape_circuit_open_total', 'Image requests refused by an open circuit breaker')
+
+# HTTP-кэш страниц и изображений общий для всех парсингов процесса
+_http_cache = None
+_http_cache_lock = threading.Lock()
+# Сайты, которые раз за разом не отвечают, на время перестают запрашиваться всеми парсингами процесса
+_breaker = HostCircuitBreaker()
+# Пул потоков для блокирующих операций с файлами
+_disk_executor = ThreadPoolExecutor(DISK_THREADS, thread_name_prefix='parser-disk')
+
+
+def _get_http_cache() -> HttpCache:
+    global _http_cache
+    with _http_cache_lock:
+        if _http_cache is None:
+            _http_cache = HttpCache()
+        return _http_cache
+
+
+def create_session() -> aiohttp.ClientSession:
+    # Сессию можно передать в scrape_images(), чтобы несколько парсингов переиспользовали соединения
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST)
+    timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    return aiohttp.ClientSession(trust_env=True, connector=connector, timeout=timeout)
+
+
+async def _on_disk(function, *args):
+    # Выполняет блокирующую операцию с файлами в пуле, пока event loop продолжает скачивание
+    return await asyncio.get_running_loop().run_in_executor(_disk_executor, function, *args)
+
+
+def _probe(data: bytes) -> tuple:
+    # Возвращает (формат, (ширина, высота)) по началу файла или None, если заголовок еще не прочитан целиком.
+    # Image.open() читает только заголовок, пиксели не декодируются
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.format, image.size
+    except Image.DecompressionBombError:
+        # Слишком большое изображение, фильтры его не пропустят
+        return None, (0, 0)
+    except Exception:
+        return None
+
+
+def _is_suitable(info: tuple) -> bool:
+    image_format, (width, height) = info
+    return (image_format in ALLOWED_FORMATS
+            and MIN_IMAGE_SIZE[0] <= width <= MAX_IMAGE_SIZE[0] and MIN_IMAGE_SIZE[1] <= height <= MAX_IMAGE_SIZE[1])
+
+
+def _from_cache(url: str, entry: dict, store: ImageStore, extension: str, cache: HttpCache) -> str:
+    # Фильтры проверяются и для закэшированных изображений: их могли поменять с прошлого парсинга
+    with open(cache.body_path(url), 'rb') as f:
+        info = _probe(f.read(PROBE_MAX_BYTES))
+    if info is None or not _is_suitable(info):
+        return _SKIPPED
+    store.add_link(cache.body_path(url), entry['sha256'], extension)
+    return entry['sha256']
+
+
+class DownloadError(Exception):
+    """Изображение не удалось скачать, повторять запрос бессмысленно."""
+
+
+async def _fetch(s: aiohttp.ClientSession, url: str, store: ImageStore, extension: str, cache: HttpCache) -> str:
+    # Временные сбои (5xx, 429, обрыв соединения, таймаут) повторяются с экспоненциальной задержкой со случайным
+    # разбросом, чтобы одновременно упавшие запросы не повторялись одновременно. Возвращает SHA-256 изображения
+    # или _SKIPPED, при неудаче бросает DownloadError
+    for attempt in range(MAX_RETRIES + 1):
+        if not _breaker.allows(url):
+            SCRAPE_CIRCUIT_OPEN.inc()
+            raise DownloadError('the site is not responding, try again later')
+        try:
+            digest = await _fetch_once(s, url, store, extension, cache)
+        except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            error, reason = TransientError(str(e) or type(e).__name__), type(e).__name__
+        except TransientError as e:
+            error, reason = e, str(e).replace(' ', '_')
+        except Exception:
+            # Сайт ответил, ошибка не его (например, диска), поэтому он не считается недоступным
+            _breaker.record_success(url)
+            raise
+        except BaseException:
+            # Запрос отменен (например, вместе с парсингом) или прерван: ответил ли сайт, неизвестно
+            _breaker.release(url)
+            raise
+        else:
+            _breaker.record_success(url)
+            return digest
+        _breaker.record_failure(url)
+        delay = backoff_delay(attempt, error.retry_after)
+        if attempt == MAX_RETRIES or delay is None:
+            raise DownloadError(str(error))
+        SCRAPE_RETRIES.inc(reason=reason)
+        await asyncio.sleep(delay)
+
+
+async def _fetch_once(s: aiohttp.ClientSession, url: str, store: ImageStore, extension: str, cache: HttpCache) -> str:
+    # Тело ответа пишется на диск по частям, поэтому в памяти не держится целиком.
+    # Возвращает SHA-256 изображения, сохраненного в хранилище, или _SKIPPED, если изображение не прошло фильтры.
+    # Временный сбой бросает TransientError, недоступное изображение — DownloadError
+    entry = await _on_disk(cache.lookup, url)
+    if entry is not None and cache.is_fresh(entry):
+        # Изображение в кэше еще свежее, запрос не нужен
+        cache.refresh(url)
+        return await _on_disk(_from_cache, url, entry, store, extension, cache)
+
+    temp_file = store.new_temp_file()
+    size = 0
+    try:
+        async with s.get(url, headers=cache.conditional_headers(entry)) as r:
+            if r.status == 304 and entry is not None:
+                # Изображение не изменилось, берем его из кэша
+                cache.refresh(url, r.headers)
+                return await _on_disk(_from_cache, url, entry, store, extension, cache)
+            if r.status in TRANSIENT_STATUSES:
+                raise TransientError(f'status {r.status}', parse_retry_after(r.headers.get('Retry-After')))
+            if r.status != 200:
+                raise DownloadError(f'status {r.status}')
+            if r.content_length is not None and r.content_length > MAX_IMAGE_BYTES:
+                return _SKIPPED
+            sha256 = hashlib.sha256()
+            # Начало ответа, пока по нему не определены формат и размеры изображения
+            head = b''
+            info = None
+            # Файл пишется в пуле потоков, пока следующая порция скачивается
+            f = await _on_disk(open, temp_file, 'wb')
+            try:
+                async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MAX_IMAGE_BYTES:
+                        return _SKIPPED
+                    if info is None:
+                        head += chunk
+                        info = _probe(head)
+                        # Выход из async with закрывает соединение, остаток ответа не скачивается
+                        if info is None and len(head) >= PROBE_MAX_BYTES:
+                            raise DownloadError('not an image')
+                        if info is not None and not _is_suitable(info):
+                            return _SKIPPED
+                    sha256.update(chunk)
+                    await _on_disk(f.write, chunk)
+                if FSYNC_WRITES:
+                    await _on_disk(_fsync, f)
+            finally:
+                await _on_disk(f.close)
+            if info is None:
+                # Ответ закончился раньше, чем заголовок изображения
+                raise DownloadError('not an image')
+        digest = sha256.hexdigest()
+        with SCRAPE_STAGE_SECONDS.time(SCRAPE_ERRORS, stage='write'):
+            await _on_disk(_store_download, url, r.headers, temp_file, digest, store, extension, cache)
+        return digest
+    finally:
+        SCRAPE_DOWNLOADED_BYTES.inc(size)
+        await _on_disk(_remove_if_exists, temp_file)
+
+
+def _fsync(f) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _remove_if_exists(file_path: str) -> None:
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def _store_download(url: str, headers, temp_file: str, digest: str, store: ImageStore, extension: str,
+                    cache: HttpCache) -> None:
+    # Скачанный файл целиком переименовывается в файл хранилища, недокачанных файлов в хранилище не бывает
+    blob = store.add(temp_file, digest, extension)
+    if cache.is_cacheable(headers):
+        cache.store(url, headers, blob, link=True, sha256=digest)
+
+
+def _fingerprint(blob: str) -> dict:
+    try:
+        return fingerprint(blob)
+    except Exception:
+        # Изображение, которое не удалось декодировать, не сравнивается с другими
+        return None
 
 
-async def _fetch(s: aiohttp.ClientSession, url: str) -> bytes:
-    async with s.get(url) as r:
-        return await r.read()
-
-
-async def _fetch_all(s: aiohttp.ClientSession, img_urls: list) -> list:
-    tasks = []
-    for url in img_urls:
-        task = asyncio.create_task(_fetch(s, url))
-        tasks.append(task)
-    res = await asyncio.gather(*tasks)
-    return res
+async def _download_image(s: aiohttp.ClientSession, path: str, image: dict, store: ImageStore,
+                          cache: HttpCache, encoding: EncodingPolicy, duplicates: DuplicateIndex) -> tuple:
+    # Изображение попадает в папку парсинга и получает превью сразу после загрузки, пока другие еще скачиваются.
+    # Возвращает (digest, error): у каждого изображения свой результат, ошибка одного не отменяет остальные
+    try:
+        digest = await _fetch(s, image['url'], store, image['extension'], cache)
+        if digest != _SKIPPED and duplicates is not None:
+            # Хэши считаются по уменьшенной копии, декодированной сразу после загрузки. Дубликат уже сохраненного
+            # изображения не сохраняется и не получает превью; если он больше, он заменяет сохраненное
+            with SCRAPE_STAGE_SECONDS.time(SCRAPE_ERRORS, stage='hash'):
+                image_fingerprint = await asyncio.to_thread(_fingerprint, store.blob_path(digest, image['extension']))
+            if image_fingerprint is not None and not duplicates.add(image['name'], image_fingerprint):
+                return _DUPLICATE, None
+        if digest != _SKIPPED:
+            image['sha256'] = digest
+            with SCRAPE_STAGE_SECONDS.time(SCRAPE_ERRORS, stage='place'):
+                await _on_disk(_place_image, path, store, image)
+            with SCRAPE_STAGE_SECONDS.time(SCRAPE_ERRORS, stage='preview'):
+                await asyncio.to_thread(_create_preview, os.path.join(path, image['name']), image['extension'],
+                                        encoding)
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+    return digest, None
+
+
+def _place_image(path: str, store: ImageStore, image: dict) -> None:
+    # Папка изображения ссылается на файл хранилища. Папки изображений, которые не изменились
+    # с прошлого парсинга (уже ссылаются на тот же файл), не трогаются
+    file_folder = os.path.join(path, image['name'])
+    file_path = os.path.join(file_folder, f"default.{image['extension']}")
+    blob = store.blob_path(image['sha256'], image['extension'])
+    if os.path.exists(file_path) and os.path.samefile(file_path, blob):
+        return
+    if os.path.exists(file_folder):
+        shutil.rmtree(file_folder)
+    os.makedirs(file_folder)
+    # Файл появляется в папке атомарным переименованием, поэтому бот не увидит его недописанным
+    store.link(blob, file_path)
+
+
+def _finish_images(path: str, page_url: str, images: list) -> None:
+    # Удаляем изображения, которых нет в новом парсинге, и записываем манифест
+    names = {image['name'] for image in images}
+    for name in os.listdir(path):
+        if name in names or name == 'manifest.json':
+            continue
+        if os.path.isdir(os.path.join(path, name)):
+            shutil.rmtree(os.path.join(path, name))
+        else:
+            os.remove(os.path.join(path, name))
+    write_manifest(path, {'url': page_url, 'images': images}, fsync=FSYNC_WRITES)
 
 
-def _fetch_img_links(url: str) -> list:
-    page = requests.get(url)
-    soup = BeautifulSoup(page.text, 'lxml')
-    # Формирование списка со всеми ссылками на изображения
-    image_links = []
+def _create_preview(file_folder: str, extension: str, encoding: EncodingPolicy) -> None:
+    preview_path = os.path.join(file_folder, f'preview.{encoding.preview_format}')
+    if os.path.exists(preview_path):  # Изображение не менялось с прошлого парсинга
+        return
+    try:
+        create_preview(os.path.join(file_folder, f'default.{extension}'), preview_path, encoding=encoding)
+    except Exception:
+        # Без превью бот отправит оригинал
+        pass
 
-    # Определение корневой ссылки (domain)
-    domain = re.search(r'https?://[^/]+', url).group()
-    http = re.search(r'https?:', url).group()
-    for item in soup.find_all('img'):
-        # Поиск ссылки на изображение в img
-        link = item.get('data-src') or item.get('src')
-        if not link:
-            # Ссылка не найдена
-            continue
 
-        # Если изображение не того формата, то не добавляем
-        if re.search(r'[.](png|jpg|jpeg)$', link) is None:
-            continue
+def _read_file(file_path: str) -> bytes:
+    with open(file_path, 'rb') as f:
+        return f.read()
 
-        if link.startswith('http'):
-            image_links.append(link)
-        elif link.startswith('//'):
-            image_links.append(http + link)
-        elif link.startswith('/'):
-            image_links.append(domain + link)
-        else:
-            image_links.append(domain + '/' + link)
 
-    return image_links
+def _cleanup(cache: HttpCache, store: ImageStore) -> None:
+    # evict() сохраняет и индекс кэша
+    cache.evict()
+    store.collect_garbage()
 
 
-def _check_website_access(url: str) -> str:
+async def _fetch_page(s: aiohttp.ClientSession, url: str, cache: HttpCache, limiter: HostRateLimiter) -> tuple:
+    # Один запрос к странице: его ответ используется и для проверки доступа, и для поиска изображений.
+    # Возвращает (status, html, charset, url), где url — адрес страницы после перенаправлений
     try:
-        page = requests.get(url)
-        if page.status_code == requests.codes.ok:
-            return 'done'
-        return f'Failed to access the site: status_code {page.status_code}'
+        # Запись кэша проверяет файл тела ответа на диске
+        entry = await _on_disk(cache.lookup, url)
+        if entry is not None and cache.is_fresh(entry):
+            cache.refresh(url)
+            return 'done', await _on_disk(_read_file, cache.body_path(url)), entry['charset'], entry['final_url']
+        # Свежие страницы из кэша не нагружают сайт, ограничение частоты только для запросов
+        await limiter.wait(url)
+        async with s.get(url, headers=cache.conditional_headers(entry)) as r:
+            if r.status == 304 and entry is not None:
+                # Страница не изменилась с прошлого раза
+                cache.refresh(url, r.headers)
+                return 'done', await _on_disk(_read_file, cache.body_path(url)), entry['charset'], entry['final_url']
+            if r.status != 200:
+                return f'Failed to access the site: status_code {r.status}', None, None, None
+            html = await r.read()
+            if cache.is_cacheable(r.headers):
+                await _on_disk(functools.partial(cache.store_bytes, url, r.headers, html, charset=r.charset,
+                                                 final_url=str(r.url)))
+            return 'done', html, r.charset, str(r.url)
     except Exception as e:
-        return f'Failed to access the site: {e}'
+        return f'Failed to access the site: {e}', None, None, None
+
+
+async def _crawl(s: aiohttp.ClientSession, url: str, path: str, store: ImageStore, cache: HttpCache,
+                 encoding: EncodingPolicy, crawl: CrawlPolicy, duplicates: DuplicateIndex) -> tuple:
+    # Страницы обходятся в ширину crawl.concurrency задачами. Изображение начинает скачиваться, как только
+    # найдено на странице, пока следующие страницы еще загружаются.
+    # Возвращает (images, downloads, page_errors, final_url): изображения, задачи их загрузки,
+    # ошибки страниц [(depth, url, status)] и адрес стартовой страницы после перенаправлений
+    frontier = Frontier(url, crawl)
+    limiter = HostRateLimiter(crawl.requests_per_second)
+    images, downloads, page_errors = [], [], []
+    final_url = url
+    # Изображение, найденное на нескольких страницах, скачивается один раз
+    seen_images = set()
+    # Имена папок изображений: имя файла, а при повторе — "имя (2)", "имя (3)", ...
+    name_counts = {}
+
+    async def visit(page_url: str, depth: int) -> None:
+        nonlocal final_url
+        with SCRAPE_STAGE_SECONDS.time(stage='page'):
+            status, html, charset, redirected_url = await _fetch_page(s, page_url, cache, limiter)
+        if status != 'done':
+            SCRAPE_ERRORS.inc(stage='page')
+            SCRAPE_PAGES.inc(outcome='failed')
+            page_errors.append((depth, page_url, status))
+            return
+        SCRAPE_PAGES.inc(outcome='fetched')
+        if depth == 0:
+            # Ссылки сравниваются с сайтом, на который перенаправила стартовая страница
+            final_url = redirected_url
+            frontier.redirected(redirected_url)
+
+        # Разбор HTML и работа с диском идут в потоках, чтобы не останавливать event loop,
+        # на котором могут выполняться другие парсинги и загрузки
+        with SCRAPE_STAGE_SECONDS.time(SCRAPE_ERRORS, stage='links'):
+            image_links, page_links = await asyncio.to_thread(extract_links, html, redirected_url, charset)
+
+        new_links = [img_url for img_url in image_links if img_url not in seen_images]
+        if new_links:
+            await _on_disk(functools.partial(os.makedirs, path, exist_ok=True))
+        for img_url in new_links:
+            seen_images.add(img_url)
+            filename = posixpath.basename(urlsplit(img_url).path)  # Имя файла с расширением, без параметров запроса
+            name_counts[filename] = name_counts.get(filename, 0) + 1
+            name = filename if name_counts[filename] == 1 else f'{filename} ({name_counts[filename]})'
+            image = {'name': name, 'url': img_url, 'sha256': None, 'extension': image_extension(img_url)}
+            images.append(image)
+            # Количество одновременных соединений ограничивает коннектор сессии
+            downloads.append(asyncio.create_task(_download_image(s, path, image, store, cache, encoding,
+                                                                 duplicates)))
+
+        if depth < crawl.max_depth:
+            for link in page_links:
+                if frontier.is_full():
+                    break
+                frontier.add(link, depth + 1)
+
+    async def worker() -> None:
+        while True:
+            page_url, depth = await frontier.get()
+            try:
+                await visit(page_url, depth)
+            except Exception as e:
+                page_errors.append((depth, page_url, f'Failed to parse the page: {e}'))
+            finally:
+                frontier.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(crawl.concurrency)]
+    try:
+        await frontier.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return images, downloads, page_errors, final_url
 
 
-async def _parser(url: str) -> tuple:
+async def _parser(url: str, path: str, session: aiohttp.ClientSession = None,
+                  encoding: EncodingPolicy = None, crawl: CrawlPolicy = None) -> tuple:
     # Сохраняю ошибки, если не удалось запарсить/скачать фото
     download_error = []
 
@@ -75,61 +430,66 @@ async def _parser(url: str) -> tuple:
     if not url.startswith('http'):
         url = 'http://' + url
 
-    # Проверка доступа к сайту
-    status = _check_website_access(url)
-    if status != 'done':
-        return 'error', status
-
-    # Массив из ссылок на изображения
-    image_links = _fetch_img_links(url)
-    if len(image_links) == 0:
+    cache = _get_http_cache()
+    encoding = encoding or DEFAULT_ENCODING
+    crawl = crawl or SINGLE_PAGE
+    duplicates = DuplicateIndex() if DEDUPLICATE else None
+    # Изображения скачиваются в хранилище, папки изображений ссылаются на его файлы
+    store = ImageStore()
+    # Чужая сессия не закрывается по окончании парсинга
+    session_context = contextlib.nullcontext(session) if session is not None else create_session()
+    async with session_context as session:
+        downloads = []
+        try:
+            # Асинхронная загрузка изображений сразу на диск, одновременно с обходом страниц
+            with SCRAPE_STAGE_SECONDS.time(SCRAPE_ERRORS, stage='downloads'):
+                images, downloads, page_errors, url = await _crawl(session, url, path, store, cache, encoding, crawl,
+                                                                   duplicates)
+                outcomes = await asyncio.gather(*downloads)
+        except Exception as e:
+            for task in downloads:
+                task.cancel()
+            return 'error', f'Failed to retrieve the image. Try again. {e}'
+
+    for depth, page_url, status in page_errors:
+        # Без стартовой страницы парсить нечего
+        if depth == 0:
+            return 'error', status
+        download_error.append(f'{status}: {page_url}')
+    if len(images) == 0:
         return 'error', 'No images found on the site! Suitable format png, jpeg, jpg'
 
-    # Асинхронное получение изображений в двоичном представление
-    try:
-        async with aiohttp.ClientSession(trust_env=True) as session:
-            imgs = await _fetch_all(session, image_links)
-    except Exception as e:
-        return 'error', f'Failed to retrieve the image. Try again. {e}'
-
-    # Путь images/parsed_images/название_изображения
-    path_parsed_images = 'images/parsed_images'
-
-    # Очищаем папку parsed_images
-    if os.path.exists(path_parsed_images):
-        shutil.rmtree(path_parsed_images)
-
-    # Скачка файлов по нужным папкам
-    for img, img_url in zip(imgs, image_links):
-
-        # Создаем папку с именем файла
-        filename = img_url.split('/')[-1]  # Имя файла с расширением
-        file_folder = os.path.join(path_parsed_images, filename)
-        if os.path.exists(file_folder):  # Если попался файл с существующим названием
-            c = 2
-            while os.path.exists(file_folder + f' ({c})'):
-                c += 1
-            file_folder += f' ({c})'
-        os.makedirs(file_folder, exist_ok=True)  # Создание папки с именем файла
-
-        # Если не удалось запарсить изображение
-        if img is None:
-            download_error.append(f"Failed to download a file: {img_url}")
-            shutil.rmtree(file_folder)  # Удаляем созданную папку для этого файла
+    saved_images = []
+    for image, (digest, error) in zip(images, outcomes):
+        # Изображение отфильтровано по формату, размерам или объему
+        if digest == _SKIPPED:
+            SCRAPE_IMAGES.inc(outcome='skipped')
+            continue
+        # Почти дубликат другого изображения, возможно, замененный большим дубликатом позже. Папка уже
+        # сохраненного дубликата удаляется вместе с папками изображений, которых нет в новом парсинге
+        if digest == _DUPLICATE or duplicates is not None and not duplicates.is_kept(image['name']):
+            SCRAPE_IMAGES.inc(outcome='duplicate')
             continue
+        # Если не удалось скачать изображение, остальные все равно сохраняются
+        if digest is None:
+            SCRAPE_IMAGES.inc(outcome='failed')
+            download_error.append(f"Failed to download a file: {image['url']} ({error})")
+            continue
+        SCRAPE_IMAGES.inc(outcome='saved')
+        saved_images.append(image)
 
-        try:  # Загружаем изображения
-            file_extension = filename.split('.')[-1]
-            with open(os.path.join(file_folder, f'default.{file_extension}'), 'wb') as f:
-                f.write(img)
-        except Exception as e:
-            shutil.rmtree(file_folder)  # Удаляем созданную папку для этого файла
-            download_error.append(f'Error when writing a file: {img_url} {e}')
+    try:
+        with SCRAPE_STAGE_SECONDS.time(SCRAPE_ERRORS, stage='finish'):
+            await _on_disk(_finish_images, path, url, saved_images)
+            await _on_disk(_cleanup, cache, store)
+    except Exception as e:
+        return 'error', f'Error when writing files: {e}'
 
     return ('done', 'OK') if not download_error else ('warning', '\n'.join(download_error))
 
 
-def scrape_and_save_images(url: str = None) -> tuple:
+def scrape_and_save_images(url: str = None, path: str = 'images/parsed_images',
+                           encoding: EncodingPolicy = None, crawl: CrawlPolicy = None) -> tuple:
     """
     Загружает и сохраняет все изображения с указанного веб-сайта.
 
@@ -137,6 +497,12 @@ def scrape_and_save_images(url: str = None) -> tuple:
     все изображения и сохраняет их локально. Возвращает статус выполнения и сообщение.
 
     :param url: URL веб-страницы, с которой необходимо загрузить изображения.
+    :param path: Папка, в которую сохраняются изображения (path/название_изображения/default.расширение).
+    :param encoding: Настройки кодирования превью (формат, качество). Если не переданы, используются
+        настройки по умолчанию из image_formatter.DEFAULT_ENCODING.
+    :param crawl: Настройки обхода нескольких страниц (crawl.CrawlPolicy): глубина, число страниц, фильтры ссылок
+        и частота запросов к сайту. Изображения собираются со всех страниц в одну папку. Если не переданы,
+        парсится только страница url.
     :return: Кортеж (status, message), где:
         - status (str):
             * 'done' — парсинг и сохранение изображений выполнены успешно.
@@ -145,9 +511,26 @@ def scrape_and_save_images(url: str = None) -> tuple:
         - message (str):
             * 'OK' — если процесс завершен без ошибок.
             * Текст ошибки — если возникла критическая ошибка.
-            * Описание проблемных изображений — если статус 'warning'.
+            * Описание проблемных изображений и недоступных страниц — если статус 'warning'.
     """
-    return asyncio.run(_parser(url))
+    return asyncio.run(_parser(url, path, encoding=encoding, crawl=crawl))
+
+
+async def scrape_images(url: str = None, path: str = 'images/parsed_images',
+                        session: aiohttp.ClientSession = None, encoding: EncodingPolicy = None,
+                        crawl: CrawlPolicy = None) -> tuple:
+    """
+    Асинхронный вариант scrape_and_save_images() для программ, у которых уже есть свой event loop (например, бота).
+
+    :param url: URL веб-страницы, с которой необходимо загрузить изображения.
+    :param path: Папка, в которую сохраняются изображения (path/название_изображения/default.расширение).
+    :param session: Сессия из create_session(), общая для нескольких парсингов. Если не передана,
+        на время парсинга создается своя.
+    :param encoding: Настройки кодирования превью, как у scrape_and_save_images().
+    :param crawl: Настройки обхода нескольких страниц, как у scrape_and_save_images().
+    :return: Кортеж (status, message), как у scrape_and_save_images().
+    """
+    return await _parser(url, path, session, encoding, crawl)
 
 
 # ТГ бот пользуется только функцией scrape_and_save_images(), которая на вход ожидает url.
@@ -158,6 +541,10 @@ if __name__ == '__main__':
     print(scrape_and_save_images(address))
     # output: ('done', 'OK')
 
+    # Каталог с пагинацией и страницами товаров: изображения со стартовой страницы и страниц по ссылкам с нее
+    # print(scrape_and_save_images(address, crawl=CrawlPolicy(max_depth=1, max_pages=20,
+    #                                                         include=[r'/exercise/list_basic']))
+
     # address = 'https://texterra.ru/blog/kak-sdelat-iz-stranitsy-404-chto-to-poleznoe-i-interesnoe-priаmery.html'
     # print(scrape_and_save_images(address))
     # # output: ('error', 'Failed to access the site: status_code 404')
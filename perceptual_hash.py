@@ -0,0 +1,300 @@
+from operator import mul
+import statistics
+import math
+from PIL import Image
+
+
+# Images are decoded at least this large before hashing, JPEG ones straight at a reduced scale (libjpeg DCT scaling)
+DECODE_SIZE = 64
+# pHash is computed from the 8x8 lowest frequencies of the DCT of the 32x32 grayscale image
+PHASH_SIZE = 32
+HASH_SIZE = 8
+# Images are near-duplicates if their pHashes differ in at most PHASH_MAX_DISTANCE bits of 64 and their dHashes
+# confirm it, differing in at most DHASH_MAX_DISTANCE bits. Resized and recompressed copies differ in 0-4 bits,
+# unrelated images in about 32
+PHASH_MAX_DISTANCE = 8
+DHASH_MAX_DISTANCE = 12
+# The hashes ignore the color, so near-duplicates must also have the same color layout: the mean RGB of the cells
+# of a COLOR_GRID x COLOR_GRID grid, no channel of a cell differing by more than COLOR_MAX_DISTANCE of 255.
+# Resized and recompressed copies differ by 0-3, channel conversions, grayscale and brighter copies and watermarks
+# by 40 and more
+COLOR_GRID = 4
+COLOR_MAX_DISTANCE = 16
+
+# DCT-II basis of the HASH_SIZE lowest frequencies, _COSINES[u][x] = cos((2x + 1) u pi / 2N)
+_COSINES = [[math.cos((2 * x + 1) * u * math.pi / (2 * PHASH_SIZE)) for x in range(PHASH_SIZE)]
+            for u in range(HASH_SIZE)]
+
+
+def _bits(values, threshold):
+    result = 0
+    for value in values:
+        result = (result << 1) | (value > threshold)
+    return result
+
+
+def average_hash(image):
+    """
+    Compute the aHash: every bit tells if a pixel of the 8x8 grayscale image is brighter than the mean.
+
+    Args:
+        image (PIL.Image.Image): The image, ideally already downscaled.
+
+    Returns:
+        int: The 64-bit hash.
+    """
+    pixels = list(image.convert('L').resize((HASH_SIZE, HASH_SIZE), Image.Resampling.BOX).getdata())
+    return _bits(pixels, sum(pixels) / len(pixels))
+
+
+def difference_hash(image):
+    """
+    Compute the dHash: every bit tells if a pixel of the 9x8 grayscale image is brighter than its right neighbour.
+    It follows the gradients of the image, so it does not change with the brightness and the contrast.
+
+    Args:
+        image (PIL.Image.Image): The image, ideally already downscaled.
+
+    Returns:
+        int: The 64-bit hash.
+    """
+    pixels = list(image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX).getdata())
+    result = 0
+    for row in range(HASH_SIZE):
+        line = pixels[row * (HASH_SIZE + 1):(row + 1) * (HASH_SIZE + 1)]
+        for left, right in zip(line, line[1:]):
+            result = (result << 1) | (left > right)
+    return result
+
+
+def perceptual_hash(image):
+    """
+    Compute the pHash: every bit tells if one of the 8x8 lowest frequencies of the DCT of the 32x32 grayscale image
+    is above their median. The low frequencies describe the structure of the image and are not affected
+    by resizing, compression artifacts and small edits.
+
+    Args:
+        image (PIL.Image.Image): The image, ideally already downscaled.
+
+    Returns:
+        int: The 64-bit hash.
+    """
+    pixels = list(image.convert('L').resize((PHASH_SIZE, PHASH_SIZE), Image.Resampling.LANCZOS).getdata())
+    rows = [pixels[y * PHASH_SIZE:(y + 1) * PHASH_SIZE] for y in range(PHASH_SIZE)]
+    # The 2D DCT is separable: only the needed frequencies are computed along the rows, then along the columns
+    row_frequencies = [[sum(map(mul, row, cosines)) for cosines in _COSINES] for row in rows]
+    columns = list(zip(*row_frequencies))
+    coefficients = [sum(map(mul, columns[u], cosines)) for cosines in _COSINES for u in range(HASH_SIZE)]
+    return _bits(coefficients, statistics.median(coefficients))
+
+
+def hamming(first, second):
+    """
+    Args:
+        first (int): A hash.
+        second (int): Another hash of the same kind.
+
+    Returns:
+        int: The number of different bits.
+    """
+    return (first ^ second).bit_count()
+
+
+def color_layout(image):
+    """
+    Compute the mean color of the cells of the COLOR_GRID x COLOR_GRID grid over the image.
+
+    Args:
+        image (PIL.Image.Image): The image, ideally already downscaled.
+
+    Returns:
+        bytes: The R, G and B values of the cells, row by row.
+    """
+    return image.convert('RGB').resize((COLOR_GRID, COLOR_GRID), Image.Resampling.BOX).tobytes()
+
+
+def color_distance(first, second):
+    """
+    Args:
+        first (bytes): A color layout.
+        second (bytes): Another color layout.
+
+    Returns:
+        int: The largest difference of a channel of a cell.
+    """
+    return max(abs(a - b) for a, b in zip(first, second))
+
+
+def fingerprint(path):
+    """
+    Decode a small version of the image and compute its hashes and color layout.
+
+    Args:
+        path (str): The path to the image file.
+
+    Returns:
+        dict: {'width', 'height'} of the full image, its 'ahash', 'dhash' and 'phash' and its 'color' layout.
+    """
+    with Image.open(path) as image:
+        size = image.size
+        # Only a reduced scale of JPEG images is decoded, other formats are reduced right after decoding
+        image.draft('RGB', (DECODE_SIZE, DECODE_SIZE))
+        small = image.convert('RGB')
+    if small.width > DECODE_SIZE * 2 and small.height > DECODE_SIZE * 2:
+        small = small.reduce(min(small.width, small.height) // DECODE_SIZE)
+    gray = small.convert('L')
+    return {'width': size[0], 'height': size[1], 'ahash': average_hash(gray), 'dhash': difference_hash(gray),
+            'phash': perceptual_hash(gray), 'color': color_layout(small)}
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing: the search of all hashes within a Hamming distance by exact lookups.
+
+    The hashes are split into max_distance + 1 chunks, and every chunk has its own table. Two hashes that differ
+    in at most max_distance bits have at least one equal chunk (there are more chunks than different bits), so only
+    the hashes sharing a chunk with the searched one are compared. Unrelated hashes rarely share one, and a search
+    compares a small part of the hashes instead of all of them. A BK-tree does not help at this distance: random
+    64-bit hashes are about 32 bits apart, and a search with the radius of 8 still visits most of the tree.
+
+    Args:
+        max_distance (int): The largest distance that will be searched for.
+        bits (int, optional): The length of the hashes. Defaults to 64.
+    """
+
+    def __init__(self, max_distance, bits=HASH_SIZE * HASH_SIZE):
+        self.max_distance = max_distance
+        chunks = max_distance + 1
+        # (shift, mask) of every chunk
+        self._chunks = [(bits * i // chunks, (1 << (bits * (i + 1) // chunks - bits * i // chunks)) - 1)
+                        for i in range(chunks)]
+        self._tables = [{} for _ in range(chunks)]
+        self._values = []
+        self._items = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, value, item):
+        """
+        Add the hash.
+
+        Args:
+            value (int): The hash.
+            item: The object returned by search() for the hash.
+        """
+        position = len(self._values)
+        self._values.append(value)
+        self._items.append(item)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((value >> shift) & mask, []).append(position)
+
+    def search(self, value, max_distance=None):
+        """
+        Find the hashes within the distance.
+
+        Args:
+            value (int): The hash.
+            max_distance (int, optional): The maximum Hamming distance, at most the one of the index.
+                                          Defaults to None, which uses the one of the index.
+
+        Returns:
+            list of tuple: (distance, item) of the found hashes, nearest first.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        elif max_distance > self.max_distance:
+            raise ValueError(f'The index supports distances up to {self.max_distance}')
+        candidates = set()
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            candidates.update(table.get((value >> shift) & mask, ()))
+        found = []
+        for position in candidates:
+            distance = hamming(value, self._values[position])
+            if distance <= max_distance:
+                found.append((distance, self._items[position]))
+        found.sort(key=lambda result: result[0])
+        return found
+
+
+class DuplicateIndex:
+    """
+    Groups near-duplicate images as they arrive and keeps the one with the highest resolution of every group.
+
+    The pHashes of the kept images are indexed by MultiIndexHash. A new image is a near-duplicate of a kept one if
+    their pHashes are within phash_distance and their dHashes within dhash_distance (two different hashes
+    make unrelated images sharing one hash pattern much less likely to be merged), and their color layouts are
+    within color_distance, so color and tone variants of a product (another color, grayscale, brighter,
+    watermarked) are kept. A duplicate with no more pixels than the kept image is dropped at once; a larger one
+    replaces it, and the replaced image is dropped.
+
+    Args:
+        phash_distance (int, optional): The maximum pHash distance of duplicates. Defaults to PHASH_MAX_DISTANCE.
+        dhash_distance (int, optional): The maximum dHash distance of duplicates. Defaults to DHASH_MAX_DISTANCE.
+        color_distance (int, optional): The maximum color layout distance of duplicates.
+                                        Defaults to COLOR_MAX_DISTANCE.
+    """
+
+    def __init__(self, phash_distance=PHASH_MAX_DISTANCE, dhash_distance=DHASH_MAX_DISTANCE,
+                 color_distance=COLOR_MAX_DISTANCE):
+        self.phash_distance = phash_distance
+        self.dhash_distance = dhash_distance
+        self.color_distance = color_distance
+        self._index = MultiIndexHash(phash_distance)
+        # Fingerprints of the kept images by key; replaced images stay in the index and are skipped
+        self._kept = {}
+        # The key of every dropped image -> the key of the image kept instead of it
+        self._dropped = {}
+
+    def add(self, key, fingerprint):
+        """
+        Add the image.
+
+        Args:
+            key: The unique identifier of the image, e.g. its name.
+            fingerprint (dict): The hashes and the size of the image returned by fingerprint().
+
+        Returns:
+            bool: True if the image is kept for now (it may be replaced by a larger duplicate later),
+                  False if it is a duplicate of a kept image at least as large.
+        """
+        pixels = fingerprint['width'] * fingerprint['height']
+        matches = [match for _, match in self._index.search(fingerprint['phash'])
+                   if match in self._kept
+                   and hamming(self._kept[match]['dhash'], fingerprint['dhash']) <= self.dhash_distance
+                   and color_distance(self._kept[match]['color'], fingerprint['color']) <= self.color_distance]
+        for match in matches:
+            if self._kept[match]['width'] * self._kept[match]['height'] >= pixels:
+                self._dropped[key] = match
+                return False
+        for match in matches:
+            del self._kept[match]
+            self._dropped[match] = key
+        self._kept[key] = fingerprint
+        self._index.add(fingerprint['phash'], key)
+        return True
+
+    def is_kept(self, key):
+        """
+        Args:
+            key: The identifier of the image passed to add().
+
+        Returns:
+            bool: False if the image turned out to be a duplicate.
+        """
+        return key not in self._dropped
+
+    def kept_instead(self, key):
+        """
+        Args:
+            key: The identifier of the image passed to add().
+
+        Returns:
+            The key of the image kept instead of the dropped one, None if the image is kept.
+        """
+        if key not in self._dropped:
+            return None
+        # A dropped image could have been kept instead of others before
+        while key in self._dropped:
+            key = self._dropped[key]
+        return key
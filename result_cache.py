@@ -0,0 +1,192 @@
+from file_digests import FileDigests
+import hashlib
+import threading
+import json
+import uuid
+import os
+
+
+# Default disk budget of the results of image operations
+RESULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# An eviction frees the cache down to this share of max_bytes, so the next stores do not scan the directory again
+RESULT_CACHE_LOW_WATER = 0.9
+
+
+def _normalize(value):
+    # Equal arguments passed in different ways (90 and 90.0, a tuple and a list) give the same key
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, (tuple, list)):
+        return [_normalize(item) for item in value]
+    return repr(value)
+
+
+class ResultCache:
+    """
+    On-disk cache of the results of image operations.
+
+    Every result is keyed by the SHA-256 of the source image content, the name of the operation and its normalized
+    arguments, so the same operation on the same image is computed only once, whatever the file is called, and
+    results with different arguments never overwrite each other. The cache is limited by the total size
+    of the results: once it is exceeded the least recently used ones (by modification time, which is updated
+    on every hit) are removed until the results take low_water of max_bytes.
+
+    Args:
+        path (str, optional): The directory of the cache. Defaults to 'images/results'.
+        max_bytes (int, optional): The disk budget in bytes. Defaults to RESULT_CACHE_MAX_BYTES.
+        low_water (float, optional): The share of max_bytes left after an eviction. Defaults to RESULT_CACHE_LOW_WATER.
+        digests (FileDigests, optional): The memo of file hashes, can be shared with the other caches of the same
+                                         files. Defaults to None, which creates a new one.
+    """
+
+    def __init__(self, path='images/results', max_bytes=RESULT_CACHE_MAX_BYTES, low_water=RESULT_CACHE_LOW_WATER,
+                 digests=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self._digests = digests if digests is not None else FileDigests()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.current_bytes = sum(os.path.getsize(result) for result in self._results())
+
+    def _results(self):
+        for prefix in os.listdir(self.path):
+            prefix_path = os.path.join(self.path, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            for name in os.listdir(prefix_path):
+                if '.tmp.' not in name:
+                    yield os.path.join(prefix_path, name)
+
+    def source_digest(self, path):
+        """
+        Get the SHA-256 of the file content. It is computed once for every version (modification time and size) of the file.
+
+        Args:
+            path (str): The path to the file.
+
+        Returns:
+            str: The hex digest.
+        """
+        return self._digests.get(path)
+
+    def result_path(self, source_digest, operation, args, extension):
+        """
+        Get the path of the result.
+
+        Args:
+            source_digest (str): The SHA-256 of the source image returned by source_digest().
+            operation (str): The name of the operation.
+            args (tuple): The arguments of the operation.
+            extension (str): The extension of the result file, it selects the format.
+
+        Returns:
+            str: The path to the result, which may not exist yet.
+        """
+        key = json.dumps([source_digest, operation, _normalize(args)])
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.path, digest[:2], f'{digest}.{extension}')
+
+    def lookup(self, path):
+        """
+        Check if the result is cached and mark it as recently used.
+
+        Args:
+            path (str): The path returned by result_path().
+
+        Returns:
+            bool: True if the result exists.
+        """
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, path, save):
+        """
+        Write the result and evict the least recently used ones if the cache exceeds max_bytes.
+
+        Args:
+            path (str): The path returned by result_path().
+            save (callable): Writes the result to the path passed to it.
+
+        Returns:
+            str: The path to the result.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The result appears only when it is written completely, parallel writers of the same result are harmless
+        name, extension = os.path.splitext(path)
+        temp_path = f'{name}.{uuid.uuid4().hex}.tmp{extension}'
+        try:
+            save(temp_path)
+        except BaseException:
+            # A failed or interrupted operation leaves no partial file behind
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.current_bytes += size
+            if self.current_bytes > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    def _evict(self, keep):
+        results = []
+        for result in self._results():
+            try:
+                stat = os.stat(result)
+            except FileNotFoundError:
+                continue
+            results.append((stat.st_mtime, stat.st_size, result))
+        self.current_bytes = sum(size for _, size, _ in results)
+        target = self.max_bytes * self.low_water
+        for _, size, result in sorted(results):
+            if self.current_bytes <= target:
+                break
+            if result == keep:
+                continue
+            try:
+                os.remove(result)
+            except FileNotFoundError:
+                pass
+            self.current_bytes -= size
+
+    def clear(self):
+        """
+        Remove all the results.
+        """
+        with self._lock:
+            for result in list(self._results()):
+                os.remove(result)
+            self.current_bytes = 0
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        Returns:
+            dict: The number of hits and misses, the hit rate, the number of results and their size in bytes.
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'entries': sum(1 for _ in self._results()),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,163 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+import threading
+import random
+import time
+
+
+# Responses worth retrying: the server is overloaded, restarting or asks to slow down
+TRANSIENT_STATUSES = (408, 429, 500, 502, 503, 504)
+# Retries of one request after the first attempt
+MAX_RETRIES = 3
+# The backoff before the n-th retry is random between 0 and min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** n) seconds
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+# A host is not requested for BREAKER_COOLDOWN seconds after BREAKER_FAILURES transient failures in a row
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN = 30
+
+
+class TransientError(Exception):
+    """
+    A request failed in a way that may succeed if repeated: a transient status, a reset connection or a timeout.
+
+    Args:
+        reason (str): The description of the failure.
+        retry_after (float, optional): The delay in seconds requested by the server. Defaults to None.
+    """
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """
+    Parse the Retry-After header.
+
+    Args:
+        value (str or None): The header value, either a number of seconds or an HTTP date.
+
+    Returns:
+        float or None: The delay in seconds (0 for dates in the past), None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Get the delay before the retry: exponential backoff with full jitter, so the requests that failed together
+    do not come back together, or the delay requested by the server with a small jitter.
+
+    Args:
+        attempt (int): The number of the retry, starting from 0.
+        retry_after (float, optional): The delay from the Retry-After header. Defaults to None.
+
+    Returns:
+        float or None: The delay in seconds, None if the server asks to wait longer than RETRY_MAX_DELAY.
+    """
+    if retry_after is not None:
+        if retry_after > RETRY_MAX_DELAY:
+            return None
+        return retry_after + random.uniform(0, RETRY_BASE_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class HostCircuitBreaker:
+    """
+    Stops requests to the hosts that keep failing.
+
+    After `failures` transient failures in a row the circuit of the host opens and its requests are refused
+    without touching the network for `cooldown` seconds. Then a single trial request is let through: its success
+    closes the circuit, its failure opens it for another cooldown. Any response that is not a transient failure
+    (including 404) counts as a success, the host is alive. The breaker is thread-safe and can be shared by scrapes
+    running in different threads.
+
+    Args:
+        failures (int, optional): The failures in a row that open the circuit. Defaults to BREAKER_FAILURES.
+        cooldown (float, optional): The time in seconds the circuit stays open. Defaults to BREAKER_COOLDOWN.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        # host -> [failures in a row, the time the circuit opened or None, a trial request is running]
+        self._hosts = {}
+
+    @staticmethod
+    def _host(url):
+        return urlsplit(url).netloc.lower()
+
+    def allows(self, url):
+        """
+        Check if the request can be sent. When the cooldown is over the first caller gets the trial request.
+
+        Args:
+            url (str): The requested URL.
+
+        Returns:
+            bool: False if the circuit of the host is open.
+        """
+        with self._lock:
+            state = self._hosts.get(self._host(url))
+            if state is None or state[1] is None:
+                return True
+            if state[2] or time.monotonic() - state[1] < self.cooldown:
+                return False
+            state[2] = True
+            return True
+
+    def record_success(self, url):
+        """
+        Record a response of the host, it closes the circuit.
+
+        Args:
+            url (str): The requested URL.
+        """
+        with self._lock:
+            self._hosts.pop(self._host(url), None)
+
+    def release(self, url):
+        """
+        Record a request that ended with neither a response nor a failure, e.g. a cancelled one. The failures in a row
+        are not changed; if it was the trial request, the next caller gets the trial.
+
+        Args:
+            url (str): The requested URL.
+        """
+        with self._lock:
+            state = self._hosts.get(self._host(url))
+            if state is not None:
+                state[2] = False
+
+    def record_failure(self, url):
+        """
+        Record a transient failure of the host.
+
+        Args:
+            url (str): The requested URL.
+
+        Returns:
+            bool: True if the circuit of the host is open now.
+        """
+        with self._lock:
+            state = self._hosts.setdefault(self._host(url), [0, None, False])
+            state[0] += 1
+            if state[2] or state[0] >= self.failures:
+                # The trial request failed or the host failed too many times
+                state[1] = time.monotonic()
+                state[2] = False
+            return state[1] is not None
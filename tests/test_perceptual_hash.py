@@ -0,0 +1,44 @@
+import io
+import os
+import unittest
+from PIL import Image
+from perceptual_hash import DuplicateIndex, fingerprint
+
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'images', 'example_parsed_images', 'image_name')
+# Variants of the example photo that differ only in color or tone, users want every one of them
+COLOR_VARIANTS = ('chanel_converted_r', 'chanel_converted_g', 'chanel_converted_b', 'brightness_changed',
+                  'watermarked', 'grayscaled')
+
+
+def _example(name):
+    return fingerprint(os.path.join(EXAMPLES, f'{name}.jpeg'))
+
+
+class DuplicateIndexTest(unittest.TestCase):
+    def test_color_variants_are_kept(self):
+        index = DuplicateIndex()
+        for name in ('default',) + COLOR_VARIANTS:
+            self.assertTrue(index.add(name, _example(name)), name)
+        for name in ('default',) + COLOR_VARIANTS:
+            self.assertTrue(index.is_kept(name), name)
+
+    def test_resized_copy_is_dropped_for_the_larger_original(self):
+        index = DuplicateIndex()
+        self.assertTrue(index.add('resized', _example('resized')))
+        self.assertTrue(index.add('default', _example('default')))
+        self.assertFalse(index.is_kept('resized'))
+        self.assertEqual(index.kept_instead('resized'), 'default')
+
+    def test_recompressed_copy_is_dropped(self):
+        buffer = io.BytesIO()
+        with Image.open(os.path.join(EXAMPLES, 'default.jpeg')) as image:
+            image.save(buffer, 'JPEG', quality=30)
+        buffer.seek(0)
+        index = DuplicateIndex()
+        self.assertTrue(index.add('default', _example('default')))
+        self.assertFalse(index.add('recompressed', fingerprint(buffer)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import multiprocessing
+import threading
+import argparse
+import socket
+import time
+import os
+from job_queue import JobQueue
+from parser import scrape_and_save_images
+from image_formatter import ImageFormatter, DecodedImageCache
+from result_cache import ResultCache
+from encoding import EncodingPolicy
+from crawl import CrawlPolicy
+import metrics
+from config import JOBS_PATH, JOB_CONCURRENCY, RESULTS_PATH, RESULT_CACHE_MAX_BYTES, JPEG_QUALITY, PREVIEW_FORMAT, \
+    MAX_PHOTO_BYTES, IMAGE_MAX_PIXELS, OPERATION_MAX_BYTES, CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES, CRAWL_REQUESTS_PER_SECOND, \
+    METRICS_PORT, METRICS_FILE, METRICS_DUMP_INTERVAL, WORKER_METRICS_PATH
+
+
+# Seconds between the checks of an empty queue
+POLL_INTERVAL = 0.5
+# Seconds between the heartbeats of a running job, well below job_queue.STALE_AFTER
+HEARTBEAT_INTERVAL = 10
+
+# The encoder settings of the results and previews sent to Telegram, shared with the bot
+encoding = EncodingPolicy(jpeg_quality=JPEG_QUALITY, preview_format=PREVIEW_FORMAT, max_bytes=MAX_PHOTO_BYTES)
+# Links followed from the sent page, None scrapes only the page itself
+crawl = CrawlPolicy(CRAWL_MAX_DEPTH, CRAWL_MAX_PAGES, requests_per_second=CRAWL_REQUESTS_PER_SECOND) \
+    if CRAWL_MAX_DEPTH else None
+# Decoded images are cached by every process separately, results are shared on disk
+_image_cache = None
+_result_cache = None
+
+
+def run_scrape(payload):
+    """
+    Scrape the page into the chat directory.
+
+    Args:
+        payload (dict): {'url': the page, 'path': the chat directory}.
+
+    Returns:
+        dict: {'status', 'message'} returned by scrape_and_save_images().
+    """
+    status, message = scrape_and_save_images(payload['url'], payload['path'], encoding, crawl)
+    return {'status': status, 'message': message}
+
+
+def run_operation(payload):
+    """
+    Run the ImageFormatter operation on the selected image of the chat.
+
+    Args:
+        payload (dict): {'path': the chat directory, 'image': the selected image directory,
+                         'operation': the name of the ImageFormatter method, 'args': its arguments}.
+
+    Returns:
+        dict: {'path': the path to the result}.
+
+    Raises:
+        ImageTooLarge: If the operation does not fit the memory budget.
+    """
+    global _image_cache, _result_cache
+    if _image_cache is None:
+        _image_cache = DecodedImageCache()
+        _result_cache = ResultCache(RESULTS_PATH, RESULT_CACHE_MAX_BYTES)
+    formatter = ImageFormatter(payload['path'], _image_cache, _result_cache, encoding, IMAGE_MAX_PIXELS,
+                               OPERATION_MAX_BYTES)
+    formatter.select_image_directory(payload['image'])
+    # JSON turns tuples (e.g. the text color) into lists
+    args = [tuple(arg) if isinstance(arg, list) else arg for arg in payload['args']]
+    return {'path': getattr(formatter, payload['operation'])(*args)}
+
+
+HANDLERS = {'scrape': run_scrape, 'operation': run_operation}
+
+
+def _heartbeat(queue, job, stop):
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        queue.heartbeat(job)
+
+
+def start_metrics(kind):
+    """
+    Record the metrics of the worker if the bot exposes them (config.METRICS_PORT or METRICS_FILE is set).
+    They are dumped to config.WORKER_METRICS_PATH/{kind}-{pid}.prom with the label worker="{kind}-{pid}",
+    the bot merges the files into its own metrics.
+
+    Args:
+        kind (str): The kind of the jobs of the worker.
+    """
+    if METRICS_PORT is None and METRICS_FILE is None:
+        return
+    name = f'{kind}-{os.getpid()}'
+    os.makedirs(WORKER_METRICS_PATH, exist_ok=True)
+    metrics.enable()
+    metrics.set_process_labels(worker=name)
+    metrics.dump_periodically(os.path.join(WORKER_METRICS_PATH, f'{name}.prom'), METRICS_DUMP_INTERVAL)
+
+
+def work(kind, path=JOBS_PATH):
+    """
+    Run the jobs of the kind one by one until the process is stopped.
+
+    Args:
+        kind (str): The kind of the jobs, a key of HANDLERS.
+        path (str, optional): The job database. Defaults to config.JOBS_PATH.
+    """
+    start_metrics(kind)
+    queue = JobQueue(path, JOB_CONCURRENCY)
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    handler = HANDLERS[kind]
+    while True:
+        job = queue.claim(kind, name)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        # The heartbeat goes from a thread, the job itself may hold the process for minutes
+        stop = threading.Event()
+        beat = threading.Thread(target=_heartbeat, args=(queue, job, stop), daemon=True)
+        beat.start()
+        try:
+            result = handler(job['payload'])
+        except Exception as e:
+            queue.fail(job, f'{type(e).__name__}: {e}')
+        else:
+            queue.complete(job, result)
+        finally:
+            stop.set()
+            beat.join()
+
+
+def start_workers(workers, path=JOBS_PATH):
+    """
+    Start the worker processes.
+
+    Args:
+        workers (dict): The number of processes of every kind, e.g. {'scrape': 2, 'operation': 2}.
+        path (str, optional): The job database. Defaults to config.JOBS_PATH.
+
+    Returns:
+        list of multiprocessing.Process: The started processes, they are stopped together with the parent process.
+    """
+    # Spawned processes do not inherit the connections and threads of the bot
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for kind, count in workers.items():
+        for i in range(count):
+            process = context.Process(target=work, args=(kind, path), name=f'{kind}-worker-{i}', daemon=True)
+            process.start()
+            processes.append(process)
+    return processes
+
+
+# More workers besides the ones started by the bot: python worker.py scrape --processes 2
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Runs the jobs queued by the bot.')
+    arguments.add_argument('kind', choices=sorted(HANDLERS))
+    arguments.add_argument('--processes', type=int, default=1)
+    arguments.add_argument('--path', default=JOBS_PATH)
+    options = arguments.parse_args()
+    if options.processes == 1:
+        work(options.kind, options.path)
+    else:
+        for process in start_workers({options.kind: options.processes}, options.path):
+            process.join()
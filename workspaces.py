@@ -0,0 +1,159 @@
+import asyncio
+import shutil
+import threading
+import time
+import uuid
+import os
+from image_formatter import ImageFormatter, DecodedImageCache, MAX_PIXELS, OPERATION_MAX_BYTES
+
+
+# Expired directories are renamed to '{chat_id}.{random}.deleted' before they are removed
+DELETED_SUFFIX = '.deleted'
+
+
+class Workspace:
+    """
+    State of a single chat: its own scrape directory, image formatter and selected image.
+
+    Args:
+        chat_id (int): The chat identifier.
+        path (str): The directory where the images of the chat are scraped to.
+        image_cache (DecodedImageCache): The decoded image cache shared by all workspaces.
+        result_cache (ResultCache, optional): The cache of operation results shared by all workspaces. Defaults to None.
+        encoding (EncodingPolicy, optional): The encoder settings of the results. Defaults to None, which uses
+                                             image_formatter.DEFAULT_ENCODING.
+        max_pixels (int, optional): Larger images are downscaled on load. Defaults to image_formatter.MAX_PIXELS.
+        max_memory_bytes (int, optional): The memory budget of one operation.
+                                          Defaults to image_formatter.OPERATION_MAX_BYTES.
+
+    Notes:
+        Operations on the workspace should be performed while holding its lock, so the requests
+        of one chat are processed one by one while different chats are processed in parallel.
+        The asyncio bot orders the requests of the chat with async_lock instead and takes lock
+        in the worker thread that runs the image operation.
+    """
+
+    def __init__(self, chat_id, path, image_cache, result_cache=None, encoding=None, max_pixels=MAX_PIXELS,
+                 max_memory_bytes=OPERATION_MAX_BYTES):
+        self.chat_id = chat_id
+        self.path = path
+        self.formatter = ImageFormatter(path, image_cache, result_cache, encoding, max_pixels, max_memory_bytes)
+        self.selected_path = None
+        self.lock = threading.RLock()
+        self.async_lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class WorkspaceManager:
+    """
+    Lazily created per-chat workspaces with idle expiry.
+
+    A workspace that has not been used for idle_timeout seconds is removed together with its directory,
+    so memory and disk usage stay bounded by the number of active chats.
+
+    Args:
+        root (str, optional): The directory with the workspaces of all chats. Defaults to 'images/chats'.
+        idle_timeout (float, optional): Seconds of inactivity after which a workspace is removed. Defaults to one hour.
+        image_cache (DecodedImageCache, optional): The decoded image cache shared by the workspaces.
+                                                   Defaults to None, which creates a new one.
+        result_cache (ResultCache, optional): The cache of operation results shared by the workspaces, it is kept
+                                              when a workspace expires. Defaults to None, which disables it.
+        encoding (EncodingPolicy, optional): The encoder settings of the results. Defaults to None, which uses
+                                             image_formatter.DEFAULT_ENCODING.
+        max_pixels (int, optional): Larger images are downscaled on load. Defaults to image_formatter.MAX_PIXELS.
+        max_memory_bytes (int, optional): The memory budget of one operation in every workspace, the peak memory
+                                          is about this value times the number of parallel operations.
+                                          Defaults to image_formatter.OPERATION_MAX_BYTES.
+        busy_chats (callable, optional): Returns the ids of the chats whose directories are in use outside
+                                         the workspaces (e.g. by the jobs of worker processes), they are not removed.
+                                         Defaults to None.
+    """
+
+    def __init__(self, root='images/chats', idle_timeout=60 * 60, image_cache=None, result_cache=None,
+                 encoding=None, max_pixels=MAX_PIXELS, max_memory_bytes=OPERATION_MAX_BYTES, busy_chats=None):
+        self.root = root
+        self.idle_timeout = idle_timeout
+        self.image_cache = image_cache if image_cache is not None else DecodedImageCache()
+        self.result_cache = result_cache
+        self.encoding = encoding
+        self.max_pixels = max_pixels
+        self.max_memory_bytes = max_memory_bytes
+        self.busy_chats = busy_chats
+        self._workspaces = {}
+        self._lock = threading.Lock()
+        self._last_expire = time.monotonic()
+        os.makedirs(root, exist_ok=True)
+
+    def get(self, chat_id):
+        """
+        Get the workspace of the chat, creating it if needed.
+
+        Args:
+            chat_id (int): The chat identifier.
+
+        Returns:
+            Workspace: The workspace of the chat.
+        """
+        with self._lock:
+            workspace = self._workspaces.get(chat_id)
+            if workspace is None:
+                workspace = Workspace(chat_id, os.path.join(self.root, str(chat_id)), self.image_cache,
+                                      self.result_cache, self.encoding, self.max_pixels, self.max_memory_bytes)
+                self._workspaces[chat_id] = workspace
+            workspace.last_used = time.monotonic()
+            expire = workspace.last_used - self._last_expire > self.idle_timeout / 10
+        if expire:
+            self.expire()
+        return workspace
+
+    def expire(self):
+        """
+        Remove the workspaces which have been idle for longer than idle_timeout, including the directories
+        left on disk by the previous runs of the bot. The directories are renamed while the workspaces are locked
+        and removed afterwards, so a chat that comes back in the meantime starts in a new directory.
+
+        Returns:
+            int: The number of removed workspaces.
+        """
+        now = time.monotonic()
+        expired = []
+        deleted = []
+        busy = set(self.busy_chats()) if self.busy_chats is not None else set()
+        with self._lock:
+            self._last_expire = now
+            for chat_id, workspace in list(self._workspaces.items()):
+                if now - workspace.last_used <= self.idle_timeout or chat_id in busy:
+                    continue
+                # The workspace is busy, it will be checked next time
+                if workspace.async_lock.locked() or not workspace.lock.acquire(blocking=False):
+                    continue
+                try:
+                    del self._workspaces[chat_id]
+                    expired.append(workspace)
+                    self.image_cache.invalidate(workspace.path)
+                    deleted.append(self._rename_deleted(workspace.path))
+                finally:
+                    workspace.lock.release()
+            active = {str(chat_id) for chat_id in self._workspaces} | {str(chat_id) for chat_id in busy}
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name.endswith(DELETED_SUFFIX):
+                    # Left by an interrupted removal
+                    deleted.append(path)
+                elif name not in active and time.time() - os.path.getmtime(path) > self.idle_timeout:
+                    deleted.append(self._rename_deleted(path))
+
+        # The slow removal does not hold up get() of the other chats
+        for path in deleted:
+            if path is not None:
+                shutil.rmtree(path, ignore_errors=True)
+        return len(expired)
+
+    def _rename_deleted(self, path):
+        # Returns the new path of the directory, or None if there is no directory
+        deleted_path = f'{path}.{uuid.uuid4().hex}{DELETED_SUFFIX}'
+        try:
+            os.rename(path, deleted_path)
+        except FileNotFoundError:
+            return None
+        return deleted_path